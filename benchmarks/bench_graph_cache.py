@@ -0,0 +1,62 @@
+"""Compare cold starts, which parse and link the canvas, with warm starts, which read the compiled graph cache.
+
+Run from the repository root with: python -m benchmarks.bench_graph_cache
+"""
+
+
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic_canvas import generate_canvas, write_canvas
+from source.flowchart_importing import FLOWCHART_PATH, read_game_graph
+from source.graph_cache import read_graph_cache, write_graph_cache
+
+
+SIZES = (1_000, 10_000, 100_000)
+REPEATS = 3
+
+
+def best_time(function, *args) -> float:
+    """
+    Run a function a few times and return its fastest run.
+    :param function:    function to time
+    :param args:        arguments to call it with
+    :return:            fastest run, in seconds
+    """
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def time_startup(flowchart_path: str, directory: str) -> tuple:
+    """
+    Time a cold start and a warm start for one canvas.
+    :param flowchart_path:  path to the canvas file
+    :param directory:       directory to write the cache file in
+    :return:                tuple with (seconds for a cold start, seconds for a warm start)
+    """
+    cache_path = os.path.join(directory, "bench.compiled")
+    cold_seconds = best_time(read_game_graph, flowchart_path)
+    write_graph_cache(read_game_graph(flowchart_path), flowchart_path, cache_path)
+    warm_seconds = best_time(read_graph_cache, flowchart_path, cache_path)
+    return cold_seconds, warm_seconds
+
+
+def main() -> None:
+    print(f"{'canvas':>16} {'cold (s)':>10} {'warm (s)':>10} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        cold_seconds, warm_seconds = time_startup(FLOWCHART_PATH, directory)
+        print(f"{'game canvas':>16} {cold_seconds:>10.4f} {warm_seconds:>10.4f} {cold_seconds / warm_seconds:>7.1f}x")
+        for size in SIZES:
+            flowchart_path = os.path.join(directory, f"synthetic_{size}.canvas")
+            write_canvas(generate_canvas(size), flowchart_path)
+            cold_seconds, warm_seconds = time_startup(flowchart_path, directory)
+            print(f"{size:>16} {cold_seconds:>10.4f} {warm_seconds:>10.4f} {cold_seconds / warm_seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
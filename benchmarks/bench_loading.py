@@ -0,0 +1,54 @@
+"""Time read_game_graph and its linking stage on synthetic canvases of increasing size.
+
+Run from the repository root with: python -m benchmarks.bench_loading
+"""
+
+
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic_canvas import generate_canvas, write_canvas
+from source.flowchart_importing import build_choice_objects, build_scene_objects, link_graph, read_game_graph
+
+
+SIZES = (1_000, 10_000, 100_000)
+
+
+def time_loading(num_nodes: int) -> tuple:
+    """
+    Time one full load and its linking stage alone.
+    :param num_nodes:   approximate number of nodes in the synthetic canvas
+    :return:            tuple with (actual node count, seconds for linking, seconds for read_game_graph)
+    """
+    canvas = generate_canvas(num_nodes)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "synthetic.canvas")
+        write_canvas(canvas, path)
+
+        with open(path, encoding="utf-8") as file:
+            content = json.load(file)
+        scenes = build_scene_objects(content["nodes"])
+        choices = build_choice_objects(content["edges"])
+        start = time.perf_counter()
+        link_graph(scenes, choices)
+        link_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        read_game_graph(path)
+        load_seconds = time.perf_counter() - start
+
+    return len(canvas["nodes"]), link_seconds, load_seconds
+
+
+def main() -> None:
+    print(f"{'nodes':>10} {'link (s)':>10} {'us/node':>10} {'load (s)':>10} {'us/node':>10}")
+    for size in SIZES:
+        num_nodes, link_seconds, load_seconds = time_loading(size)
+        print(f"{num_nodes:>10} {link_seconds:>10.3f} {link_seconds / num_nodes * 1e6:>10.2f} "
+              f"{load_seconds:>10.3f} {load_seconds / num_nodes * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
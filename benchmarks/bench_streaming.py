@@ -0,0 +1,57 @@
+"""Compare peak memory and time of the whole-document canvas loader with the streaming one, on a large synthetic
+canvas.  Each loader runs in its own fresh process, so that its peak resident set size is its own.
+
+Run from the repository root with: python -m benchmarks.bench_streaming --megabytes 500
+"""
+
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic_canvas import write_large_canvas
+
+
+LOADER_SCRIPT = """
+import json, resource, sys, time
+from source.flowchart_importing import read_game_graph
+start = time.perf_counter()
+graph = read_game_graph(sys.argv[1], streaming=sys.argv[2] == "streaming")
+seconds = time.perf_counter() - start
+peak_kilobytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"seconds": seconds, "peak_megabytes": peak_kilobytes / 1024, "scenes": len(graph.scenes)}))
+"""
+
+
+def measure_loader(flowchart_path: str, loader: str) -> dict:
+    """
+    Load a canvas in a fresh process and measure it.
+    :param flowchart_path:  path to the canvas file
+    :param loader:          "streaming" or "whole"
+    :return:                dict with keys "seconds", "peak_megabytes" and "scenes"
+    """
+    output = subprocess.run([sys.executable, "-c", LOADER_SCRIPT, flowchart_path, loader],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the whole-document and streaming canvas loaders.")
+    parser.add_argument("--megabytes", type=int, default=500, help="size of the synthetic canvas (default: 500)")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        flowchart_path = os.path.join(directory, "large.canvas")
+        write_large_canvas(flowchart_path, arguments.megabytes << 20)
+        print(f"Canvas: {os.path.getsize(flowchart_path) / (1 << 20):.0f} MB")
+        print(f"{'loader':>10} {'scenes':>10} {'time (s)':>10} {'peak RSS (MB)':>14}")
+        for loader in ("whole", "streaming"):
+            result = measure_loader(flowchart_path, loader)
+            print(f"{loader:>10} {result['scenes']:>10} {result['seconds']:>10.2f} {result['peak_megabytes']:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Load-test the multi-session server with many concurrent simulated players, and report turn latency.
+
+Each simulated player connects, names itself, and then picks random choices for a number of turns.  A turn's latency
+is the time from sending a choice to receiving the server's whole reply, up to its next input marker.
+
+Run from the repository root with: python -m benchmarks.server_load_test --sessions 2000 --turns 50
+By default a server is started in a subprocess with a temporary save directory.  Use --connect to test a server that
+is already running instead.
+"""
+
+
+import argparse
+import asyncio
+import os
+import random
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from source.server import INPUT_MARKER
+
+
+MARKER = ("\n    " + INPUT_MARKER).encode("utf-8")
+OPTION_PATTERN = re.compile(rb"^    (\d+): ", re.MULTILINE)
+
+
+def raise_open_file_limit() -> None:
+    """Raise this process's limit on open files as far as allowed, since every session needs a socket."""
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+
+
+async def play_session(host: str, port: int, number: int, turns: int, latencies: list, rng: random.Random) -> bool:
+    """
+    Play one simulated session.
+    :param host:        server host
+    :param port:        server port
+    :param number:      number of this session, used to give it a unique name
+    :param turns:       number of choices to make before disconnecting
+    :param latencies:   list to append each turn's latency to, in seconds
+    :param rng:         random number generator to pick choices with
+    :return:            True if the session ran without errors
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await reader.readuntil(INPUT_MARKER.encode("utf-8"))
+        writer.write(f"loadtest{number}\n".encode("utf-8"))
+        reply = await reader.readuntil(MARKER)
+        for _ in range(turns):
+            options = OPTION_PATTERN.findall(reply[reply.rfind(b"\n\n", 0, len(reply) - len(MARKER)):])
+            writer.write(rng.choice(options) + b"\n")
+            start = time.perf_counter()
+            try:
+                reply = await reader.readuntil(MARKER)
+            except asyncio.IncompleteReadError:     # The game reached an END and the server hung up
+                latencies.append(time.perf_counter() - start)
+                return True
+            latencies.append(time.perf_counter() - start)
+        return True
+    except (ConnectionError, asyncio.IncompleteReadError):
+        return False
+    finally:
+        writer.close()
+
+
+async def run_load_test(host: str, port: int, sessions: int, turns: int, seed: int) -> None:
+    """
+    Run every simulated session at once and print a latency report.
+    :param host:        server host
+    :param port:        server port
+    :param sessions:    number of concurrent sessions
+    :param turns:       number of choices each session makes
+    :param seed:        seed for the random number generator
+    """
+    rng = random.Random(seed)
+    latencies = []
+    start = time.perf_counter()
+    results = await asyncio.gather(*(play_session(host, port, number, turns, latencies, rng) for number in range(sessions)),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    failures = sum(result is not True for result in results)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"Sessions: {sessions} ({failures} failed), turns: {len(latencies)}, wall time: {elapsed:.2f} s")
+    print(f"Throughput: {len(latencies) / elapsed:.0f} turns/s")
+    print(f"Turn latency: p50 {quantiles[49] * 1000:.2f} ms, p99 {quantiles[98] * 1000:.2f} ms, max {max(latencies) * 1000:.2f} ms")
+
+
+async def wait_for_server(host: str, port: int, timeout: float = 60.0) -> None:
+    """
+    Wait until a server accepts connections.
+    :param host:        server host
+    :param port:        server port
+    :param timeout:     seconds to wait before giving up
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the multi-session game server.")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7778)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-debounce", type=float, default=0.0, help="passed on to the server it starts")
+    parser.add_argument("--connect", action="store_true", help="test an already running server instead of starting one")
+    arguments = parser.parse_args()
+    raise_open_file_limit()
+
+    if arguments.connect:
+        asyncio.run(run_load_test(arguments.host, arguments.port, arguments.sessions, arguments.turns, arguments.seed))
+        return
+
+    with tempfile.TemporaryDirectory() as save_directory:
+        server = subprocess.Popen(
+            [sys.executable, "main.py", "--serve", "--host", arguments.host, "--port", str(arguments.port),
+             "--save-directory", save_directory, "--save-debounce", str(arguments.save_debounce)],
+            stdout=subprocess.DEVNULL, preexec_fn=raise_open_file_limit,
+        )
+        try:
+            asyncio.run(wait_for_server(arguments.host, arguments.port))
+            asyncio.run(run_load_test(arguments.host, arguments.port, arguments.sessions, arguments.turns, arguments.seed))
+        finally:
+            server.terminate()
+            server.wait()
+            print(f"Ship logs written: {len(os.listdir(save_directory))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""Time the engine's main operations on synthetic canvases of several shapes and sizes, store the results, and compare
+them with an earlier run to spot regressions.
+
+Run from the repository root with: python -m benchmarks.suite
+Results are written to benchmarks/results/<name>.json, and compared with the most recent earlier results file there,
+if any.  Two stored runs can be compared without running anything with:
+python -m benchmarks.suite --compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+from benchmarks.synthetic_canvas import generate_canvas, write_canvas
+from source.flowchart_importing import read_game_graph
+from source.game_running import find_first_scene
+from source.headless import RandomPolicy, play_headless
+from source.saving_and_loading import load, save
+
+
+RESULTS_DIRECTORY = os.path.join("benchmarks", "results")
+SCALES = (1_000, 10_000, 100_000)
+# Keyword arguments for generate_canvas(), by shape name
+SHAPES = {
+    "branching": {},
+    "tricky": {"tricks_per_world": 8, "redirect_chain_length": 3},
+    "linear": {"scenes_per_world": 5, "linear_depth": 500},
+}
+REPEATS = 3
+WORLD_SEARCH_SAMPLE = 1_000
+TRAVERSAL_STEPS = 20_000
+SAVE_REPEATS = 100
+REGRESSION_THRESHOLD = 0.10
+
+
+def best_time(function, *args, repeats: int = REPEATS) -> float:
+    """
+    Run a function a few times and return its fastest run.
+    :param function:    function to time
+    :param args:        arguments to call it with
+    :param repeats:     number of runs
+    :return:            fastest run, in seconds
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def search_for_worlds(scenes: list) -> None:
+    """
+    Run Scene.is_child_of_world() on every given scene.
+    :param scenes:  list of Scene objects
+    """
+    for scene in scenes:
+        scene.is_child_of_world()
+
+
+def traverse(graph, steps: int) -> None:
+    """
+    Play headless games picking at random, one after another, until a number of choices have been made in total.
+    Each game's random numbers are seeded by its place in the run, so runs are repeatable.
+    :param graph:   Graph object representing the full game
+    :param steps:   number of choices to make
+    """
+    policy = RandomPolicy()
+    steps_left = steps
+    playthrough = 0
+    while steps_left > 0:
+        _, steps_taken, _ = play_headless(graph, policy, random.Random(playthrough), steps_left)
+        steps_left -= max(1, steps_taken)
+        playthrough += 1
+
+
+def save_and_load(ship_log_path: str, scene_id: str, tricks_found: set, repeats: int) -> tuple:
+    """
+    Time saving a game and loading it back.
+    :param ship_log_path:   path of the ship log to write
+    :param scene_id:        id of the scene to save
+    :param tricks_found:    set of tricks to save
+    :param repeats:         number of saves and loads to time
+    :return:                tuple with (mean seconds per save, mean seconds per load)
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        save(scene_id, tricks_found, ship_log_path)
+    save_seconds = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        load(ship_log_path)
+    load_seconds = (time.perf_counter() - start) / repeats
+    return save_seconds, load_seconds
+
+
+def run_benchmarks(shape: str, scale: int, repeats: int = REPEATS) -> dict:
+    """
+    Time every benchmarked operation on one synthetic canvas.
+    :param shape:       name of the canvas shape, a key of SHAPES
+    :param scale:       approximate number of nodes in the canvas
+    :param repeats:     number of runs to take the fastest of, for the slower operations
+    :return:            dict of seconds by operation name.  Per-scene, per-step, per-save and per-load times are means
+    """
+    canvas = generate_canvas(scale, **SHAPES[shape])
+    with tempfile.TemporaryDirectory() as directory:
+        flowchart_path = os.path.join(directory, "synthetic.canvas")
+        write_canvas(canvas, flowchart_path)
+        del canvas
+        results = {"read_game_graph": best_time(read_game_graph, flowchart_path, False, repeats=repeats)}
+
+        graph = read_game_graph(flowchart_path)
+        sample = random.Random(0).sample(graph.scenes, min(WORLD_SEARCH_SAMPLE, len(graph.scenes)))
+        results["is_child_of_world_per_scene"] = best_time(search_for_worlds, sample, repeats=repeats) / len(sample)
+        results["headless_traversal_per_step"] = best_time(traverse, graph, TRAVERSAL_STEPS, repeats=repeats) / TRAVERSAL_STEPS
+
+        scene_id = find_first_scene(graph).id
+        tricks_found = set(graph.trick_names)
+        results["save"], results["load"] = save_and_load(os.path.join(directory, "ship_log.txt"), scene_id,
+                                                         tricks_found, SAVE_REPEATS)
+    return results
+
+
+def get_git_commit() -> str:
+    """
+    Get the commit the working tree is at, to label results with.
+    :return:    short commit hash, or None if it can't be found
+    """
+    try:
+        completed = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
+
+
+def run_suite(shapes: list, scales: list, repeats: int = REPEATS) -> dict:
+    """
+    Run the benchmarks for every shape at every scale, printing each result as it comes.
+    :param shapes:      names of canvas shapes, keys of SHAPES
+    :param scales:      approximate numbers of nodes
+    :param repeats:     number of runs to take the fastest of, for the slower operations
+    :return:            dict with keys "context" (when and where the suite ran) and "results" (a dict of seconds by
+                        "shape/scale/operation")
+    """
+    results = {}
+    for shape in shapes:
+        for scale in scales:
+            for operation, seconds in run_benchmarks(shape, scale, repeats).items():
+                key = f"{shape}/{scale}/{operation}"
+                results[key] = seconds
+                print(f"{key:<50} {format_seconds(seconds):>12}")
+    context = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": get_git_commit(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    return {"context": context, "results": results}
+
+
+def format_seconds(seconds: float) -> str:
+    """
+    Format a duration with a unit that suits its size.
+    :param seconds:     duration in seconds
+    :return:            e.g. "1.234 s", "5.678 ms" or "9.012 us"
+    """
+    if seconds >= 1:
+        return f"{seconds:.3f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f} ms"
+    return f"{seconds * 1e6:.3f} us"
+
+
+def compare_results(old: dict, new: dict, threshold: float = REGRESSION_THRESHOLD) -> str:
+    """
+    Compare two runs of the suite.
+    :param old:         dict returned by run_suite() for the earlier run
+    :param new:         dict returned by run_suite() for the later run
+    :param threshold:   fraction by which a time must change to be flagged, e.g. 0.1 for 10%
+    :return:            multi-line table of every operation both runs timed, flagging regressions and improvements
+    """
+    lines = [f"Comparing {old['context'].get('git_commit')} ({old['context']['created']}) "
+             f"with {new['context'].get('git_commit')} ({new['context']['created']})",
+             f"{'benchmark':<50} {'old':>12} {'new':>12} {'change':>8}"]
+    regressions = 0
+    for key, new_seconds in new["results"].items():
+        old_seconds = old["results"].get(key)
+        if old_seconds is None:
+            continue
+        change = new_seconds / old_seconds - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  faster"
+        lines.append(f"{key:<50} {format_seconds(old_seconds):>12} {format_seconds(new_seconds):>12} {change:>+8.1%}{flag}")
+    lines.append(f"Regressions over {threshold:.0%}: {regressions}")
+    return "\n".join(lines)
+
+
+def read_results(results_path: str) -> dict:
+    """
+    Read a results file written by main().
+    :param results_path:    path to the results file
+    :return:                dict as returned by run_suite()
+    """
+    with open(results_path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def find_latest_results(directory: str = RESULTS_DIRECTORY) -> str:
+    """
+    Find the most recently written results file.
+    :param directory:   directory to look in
+    :return:            path to the results file, or None if there are none
+    """
+    if not os.path.isdir(directory):
+        return None
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".json")]
+    if len(paths) == 0:
+        return None
+    return max(paths, key=os.path.getmtime)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the engine on synthetic canvases and compare with earlier runs.")
+    parser.add_argument("--shapes", nargs="+", default=list(SHAPES), choices=list(SHAPES))
+    parser.add_argument("--scales", nargs="+", type=int, default=list(SCALES))
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--name", help="name of the results file to write (default: the current date and time)")
+    parser.add_argument("--baseline", help="results file to compare with (default: the latest in benchmarks/results)")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="fraction by which a time must grow to be flagged as a regression")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results files, then exit")
+    arguments = parser.parse_args()
+
+    if arguments.compare is not None:
+        old_path, new_path = arguments.compare
+        print(compare_results(read_results(old_path), read_results(new_path), arguments.threshold))
+        return
+
+    baseline_path = arguments.baseline or find_latest_results()
+    suite_results = run_suite(arguments.shapes, arguments.scales, arguments.repeats)
+    os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    name = arguments.name or time.strftime("%Y%m%d-%H%M%S")
+    results_path = os.path.join(RESULTS_DIRECTORY, f"{name}.json")
+    with open(results_path, "w", encoding="utf-8") as file:
+        json.dump(suite_results, file, indent=2)
+        file.write("\n")
+    print(f"Results written to {results_path}")
+
+    if baseline_path is not None:
+        print()
+        print(compare_results(read_results(baseline_path), suite_results, arguments.threshold))
+
+
+if __name__ == "__main__":
+    main()
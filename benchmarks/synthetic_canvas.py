@@ -0,0 +1,215 @@
+"""Generating synthetic Obsidian .canvas flowcharts, for benchmarking the engine on large graphs."""
+
+
+import json
+import os
+import random
+
+from source.flowchart_importing import color_number_to_name
+
+
+# Obsidian color numbers by the color name the engine gives them
+COLOR_NUMBERS = {color_number_to_name(number): number for number in "123456"}
+
+
+def make_node(node_id: str, text: str, color=None) -> dict:
+    """
+    Build a node dict the way Obsidian Canvas writes it, layout fields included.
+    :param node_id:     unique identifier
+    :param text:        text of the node
+    :param color:       Obsidian color number as a string, or None for gray
+    :return:            node dict
+    """
+    node = {"id": node_id, "type": "text", "text": text, "x": 0, "y": 0, "width": 250, "height": 60}
+    if color is not None:
+        node["color"] = color
+    return node
+
+
+def make_edge(edge_id: str, from_node: str, to_node: str, label=None, color=None) -> dict:
+    """
+    Build an edge dict the way Obsidian Canvas writes it, layout fields included.
+    :param edge_id:     unique identifier
+    :param from_node:   id of the node this edge points away from
+    :param to_node:     id of the node this edge points toward
+    :param label:       label of the edge, or None for a blank label
+    :param color:       Obsidian color number as a string, or None for gray
+    :return:            edge dict
+    """
+    edge = {"id": edge_id, "fromNode": from_node, "fromSide": "right", "toNode": to_node, "toSide": "left"}
+    if label is not None:
+        edge["label"] = label
+    if color is not None:
+        edge["color"] = color
+    return edge
+
+
+def generate_world(world_number: int, entry_id: str, scenes_per_world: int, rng: random.Random,
+                   tricks_per_world=1, redirect_chain_length=0, linear_depth=0) -> tuple:
+    """
+    Generate one world: a blue WORLD hub entered from entry_id, a section of gray scenes with random branching, a
+    chain of tricks that each unlock a yellow choice, and a last scene to leave the world from.  Each trick but the
+    last is found in a secret scene behind the yellow choice unlocked by the trick before it.
+    :param world_number:            number of the world, used to make its ids unique
+    :param entry_id:                id of the node that leads into this world
+    :param scenes_per_world:        number of ordinary scenes in the world's section
+    :param rng:                     random number generator
+    :param tricks_per_world:        number of tricks in the world's chain of tricks
+    :param redirect_chain_length:   number of state variants chained by orange redirects off a side scene, each
+                                    requiring the next trick of the chain, or 0 for none
+    :param linear_depth:            number of scenes in a deep linear section, with one choice each, between the
+                                    section and the scene to leave the world from, or 0 for none
+    :return:                        tuple with (list of node dicts, list of edge dicts, id of the scene to leave from)
+    """
+    nodes = []
+    edges = []
+
+    def add_edge(from_node, to_node, label=None, color=None):
+        edges.append(make_edge(f"w{world_number}e{len(edges)}", from_node, to_node, label, color))
+
+    world_id = f"w{world_number}"
+    nodes.append(make_node(world_id, f"WORLD: World {world_number}", COLOR_NUMBERS["blue"]))
+    add_edge(entry_id, world_id)
+
+    # A section of ordinary scenes, each reachable from an earlier scene in the section
+    section = []
+    for scene_number in range(scenes_per_world):
+        scene_id = f"w{world_number}s{scene_number}"
+        nodes.append(make_node(scene_id, f"Scene {scene_number} of world {world_number}.  " * 3))
+        parent = rng.choice(section) if section else world_id
+        add_edge(parent, scene_id, f"Go to scene {scene_number}")
+        section.append(scene_id)
+
+    # A chain of tricks.  Each is found somewhere and unlocks a yellow choice elsewhere in the section.  Each gates a
+    # different scene where possible, since a yellow choice needs every trick that gates its scene.
+    trick_ids = []
+    gated_scenes = set()
+    found_at = rng.choice(section)
+    for trick_number in range(tricks_per_world):
+        if trick_number == 0:
+            trick_id = f"w{world_number}t"
+            nodes.append(make_node(trick_id, f"TRICK: Secret of world {world_number}", COLOR_NUMBERS["green"]))
+        else:
+            trick_id = f"w{world_number}t{trick_number}"
+            nodes.append(make_node(trick_id, f"TRICK: Secret {trick_number} of world {world_number}", COLOR_NUMBERS["green"]))
+        trick_ids.append(trick_id)
+        add_edge(found_at, trick_id)
+        gated_scene = rng.choice(section)
+        while gated_scene in gated_scenes and len(gated_scenes) < len(section):
+            gated_scene = rng.choice(section)
+        gated_scenes.add(gated_scene)
+        add_edge(trick_id, gated_scene, color=COLOR_NUMBERS["green"])
+        if trick_number == tricks_per_world - 1:
+            add_edge(gated_scene, rng.choice(section), "A path that was hidden before", COLOR_NUMBERS["yellow"])
+        else:
+            secret_id = f"w{world_number}x{trick_number}"
+            nodes.append(make_node(secret_id, f"Secret place {trick_number} of world {world_number}."))
+            add_edge(gated_scene, secret_id, "A path that was hidden before", COLOR_NUMBERS["yellow"])
+            add_edge(secret_id, rng.choice(section), "Go back")
+            found_at = secret_id
+
+    # A side scene that turns into a chain of state variants as tricks are found.  It's off the section's paths, so
+    # redirecting away from it never cuts the player off from the rest of the world.
+    if redirect_chain_length > 0:
+        redirected_id = f"w{world_number}r"
+        nodes.append(make_node(redirected_id, f"A place in world {world_number} that changes."))
+        add_edge(rng.choice(section), redirected_id, "Look around")
+        add_edge(redirected_id, rng.choice(section), "Continue")
+        for variant_number in range(redirect_chain_length):
+            variant_id = f"w{world_number}v{variant_number}"
+            nodes.append(make_node(variant_id, f"The same place, changed {variant_number + 1} times."))
+            add_edge(redirected_id, variant_id, color=COLOR_NUMBERS["orange"])
+            if len(trick_ids) > 0:
+                add_edge(trick_ids[min(variant_number, len(trick_ids) - 1)], redirected_id, color=COLOR_NUMBERS["orange"])
+            add_edge(variant_id, rng.choice(section), "Continue")
+            redirected_id = variant_id
+
+    # A deep linear section to leave the world through
+    exit_id = section[-1]
+    for depth in range(linear_depth):
+        scene_id = f"w{world_number}l{depth}"
+        nodes.append(make_node(scene_id, f"A long corridor in world {world_number}, {depth} steps in."))
+        add_edge(exit_id, scene_id, "Continue")
+        exit_id = scene_id
+
+    return nodes, edges, exit_id
+
+
+def count_world_nodes(scenes_per_world: int, tricks_per_world=1, redirect_chain_length=0, linear_depth=0) -> int:
+    """
+    Count the nodes generate_world() makes for one world.
+    :param scenes_per_world:        number of ordinary scenes in the world's section
+    :param tricks_per_world:        number of tricks in the world's chain of tricks
+    :param redirect_chain_length:   number of state variants chained by orange redirects
+    :param linear_depth:            number of scenes in the world's deep linear section
+    :return:                        number of nodes
+    """
+    redirect_nodes = 1 + redirect_chain_length if redirect_chain_length > 0 else 0
+    return 1 + scenes_per_world + 2 * tricks_per_world - 1 + redirect_nodes + linear_depth
+
+
+def generate_canvas(num_nodes: int, scenes_per_world=50, seed=0, tricks_per_world=1, redirect_chain_length=0,
+                    linear_depth=0) -> dict:
+    """
+    Generate a playable canvas with roughly num_nodes nodes.  The START node leads to the first of a series of worlds
+    made by generate_world(), each leading on to the next.  The last world leads to the END node.
+    :param num_nodes:               approximate number of nodes to generate
+    :param scenes_per_world:        number of ordinary scenes in each world's section
+    :param seed:                    seed for the random number generator
+    :param tricks_per_world:        number of tricks in each world's chain of tricks
+    :param redirect_chain_length:   number of state variants chained by orange redirects in each world
+    :param linear_depth:            number of scenes in each world's deep linear section
+    :return:                        canvas dict, ready to be dumped as JSON
+    """
+    rng = random.Random(seed)
+    nodes = [make_node("start", "START", COLOR_NUMBERS["red"])]
+    edges = []
+    previous_exit = "start"
+    nodes_per_world = count_world_nodes(scenes_per_world, tricks_per_world, redirect_chain_length, linear_depth)
+    for world_number in range(max(1, num_nodes // nodes_per_world)):
+        world_nodes, world_edges, previous_exit = generate_world(world_number, previous_exit, scenes_per_world, rng,
+                                                                 tricks_per_world, redirect_chain_length, linear_depth)
+        nodes.extend(world_nodes)
+        edges.extend(world_edges)
+    nodes.append(make_node("end", "END", COLOR_NUMBERS["red"]))
+    edges.append(make_edge("end_edge", previous_exit, "end", "Leave this place"))
+    return {"nodes": nodes, "edges": edges}
+
+
+def write_large_canvas(path: str, target_bytes: int, scenes_per_world=50, seed=0) -> None:
+    """
+    Write a playable canvas of at least target_bytes to a file, shaped like generate_canvas() makes them, without
+    ever holding the whole canvas in memory.  Edges are spooled to a second file until all nodes are written.
+    :param path:                path of the file to write
+    :param target_bytes:        approximate size of the file to write
+    :param scenes_per_world:    number of ordinary scenes in each world's section
+    :param seed:                seed for the random number generator
+    """
+    rng = random.Random(seed)
+    edges_path = path + ".edges"
+    with open(path, "w", encoding="utf-8") as file, open(edges_path, "w+", encoding="utf-8") as edges_file:
+        file.write('{\n\t"nodes":[\n\t\t' + json.dumps(make_node("start", "START", COLOR_NUMBERS["red"])))
+        previous_exit = "start"
+        world_number = 0
+        while file.tell() + edges_file.tell() < target_bytes:
+            world_nodes, world_edges, previous_exit = generate_world(world_number, previous_exit, scenes_per_world, rng)
+            file.write("".join(",\n\t\t" + json.dumps(node) for node in world_nodes))
+            edges_file.write("".join(json.dumps(edge) + ",\n\t\t" for edge in world_edges))
+            world_number += 1
+        file.write(",\n\t\t" + json.dumps(make_node("end", "END", COLOR_NUMBERS["red"])) + '\n\t],\n\t"edges":[\n\t\t')
+        edges_file.write(json.dumps(make_edge("end_edge", previous_exit, "end", "Leave this place")))
+        edges_file.seek(0)
+        for block in iter(lambda: edges_file.read(1 << 20), ""):
+            file.write(block)
+        file.write("\n\t]\n}\n")
+    os.remove(edges_path)
+
+
+def write_canvas(canvas: dict, path: str) -> None:
+    """
+    Write a canvas dict to a .canvas file.
+    :param canvas:      canvas dict
+    :param path:        path of the file to write
+    """
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(canvas, file)
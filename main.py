@@ -1,10 +1,150 @@
 """Run this to run the game."""
 
 
-from source.flowchart_importing import read_game_graph
+import argparse
+import platform
+import shutil
+import sys
+from source.analysis import analyze_graph, format_analysis_report
+from source.audio import set_audio_enabled
+from source.basic_utils import DEFAULT_LINE_LENGTH, set_line_length, set_batched_input
 from source.game_running import run_game_main_loop
+from source.flowchart_importing import FLOWCHART_PATH
+from source.graph_cache import compile_game_graph, hash_file, load_game_graph
+from source.headless import POLICIES, ScriptedPolicy, format_batch_statistics, read_script, run_batch
+from source.hints import HintIndex
+from source.hot_reload import CanvasWatcher
+from source.metrics import serve_metrics
+from source.profiling import format_profile_report, start_profiling
+from source.saving_and_loading import AutoSaver, JournalSaver
+from source.search import format_search_results, load_search_index
+from source.server import run_server
+from source.story_pack import StoryPack, split_canvas_into_pack
+from source.traces import TraceRecorder, format_replay_report, replay_traces
+from source.validation import format_validation_report, validate_canvas
+
+
+PIPED_SAVE_DEBOUNCE_SECONDS = 5.0
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Parse the command-line arguments."""
+    parser = argparse.ArgumentParser(description="Play Inner Wilds, a text-based adventure game.")
+    parser.add_argument("--compile", action="store_true", help="compile the game flowchart into its binary cache file, then exit")
+    parser.add_argument("--check", nargs="?", const=FLOWCHART_PATH, metavar="CANVAS_PATH", help="report every structural error in a canvas (default: the game flowchart), then exit with status 1 if there are any")
+    parser.add_argument("--search", metavar="QUERY", help="list the scenes, choices and tricks of the game flowchart that mention every word of QUERY, best match first, then exit.  End a word with * to match every word it begins")
+    parser.add_argument("--analyze", action="store_true", help="report unreachable scenes, dead ends and softlocks in the game flowchart, then exit")
+    parser.add_argument("--replay", nargs="+", metavar="TRACE_PATH", help="replay recorded traces, or directories of them, against the game flowchart without playing, then report where each diverged and exit")
+    parser.add_argument("--simulate", type=int, metavar="N", help="play N headless games with a policy instead of a player, then print statistics and exit")
+    parser.add_argument("--policy", default="random", choices=list(POLICIES), help="policy that picks choices in headless games (default: random)")
+    parser.add_argument("--script", metavar="SCRIPT_PATH", help="with --policy scripted, file of choice numbers separated by spaces or line breaks for every headless game to pick in order, before picking at random once they run out.  A number the menu doesn't have is an error")
+    parser.add_argument("--workers", type=int, help="number of worker processes for headless games and --check (default: one per CPU)")
+    parser.add_argument("--save-debounce", type=float, metavar="SECONDS", help=f"write the save file at most once per this many seconds (default: 0, after every action, or {PIPED_SAVE_DEBOUNCE_SECONDS:g} when input is piped in)")
+    parser.add_argument("--background-save", action="store_true", help="write the save file on a background thread")
+    parser.add_argument("--journal-save", action="store_true", help="save by appending changes to a journal, which is compacted into the ship log from time to time and on exit")
+    parser.add_argument("--width", type=int, default=DEFAULT_LINE_LENGTH, metavar="COLUMNS", help=f"wrap text to this many columns, or 0 to fit the terminal (default: {DEFAULT_LINE_LENGTH})")
+    parser.add_argument("--no-audio", action="store_true", help="don't play any music.  Setting the environment variable INNER_WILDS_NO_AUDIO does the same")
+    parser.add_argument("--watch", action="store_true", help="reload the game flowchart whenever it's saved, keeping the game in progress")
+    parser.add_argument("--record", metavar="TRACE_PATH", help="record every choice made in this game to a trace file, for --replay")
+    parser.add_argument("--pack", metavar="MANIFEST_PATH", help="play, or with --analyze check, the story pack with this manifest instead of the game flowchart.  Each world's canvas is loaded when it's first entered")
+    parser.add_argument("--max-loaded-worlds", type=int, metavar="N", help="with --pack, keep at most N worlds loaded, unloading those entered least recently (default: keep every world once it's loaded)")
+    parser.add_argument("--split-pack", metavar="DIRECTORY", help="split the game flowchart into a story pack in DIRECTORY, with one canvas per world, then exit")
+    parser.add_argument("--serve", action="store_true", help="host the game for many players at once over TCP, instead of playing in this terminal")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to host the game on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=7777, help="TCP port to host the game on (default: 7777)")
+    parser.add_argument("--save-directory", default="ship_logs", help="directory for hosted players' ship logs (default: ship_logs)")
+    parser.add_argument("--metrics", type=int, metavar="PORT", help="serve live metrics in the Prometheus text format at http://127.0.0.1:PORT/metrics while playing or hosting the game")
+    parser.add_argument("--profile", metavar="REPORT_PATH", help="time each phase of loading and of every turn, then write a JSON report to REPORT_PATH and print a summary on exit")
+    arguments = parser.parse_args()
+    if arguments.record is not None and arguments.pack is not None:
+        parser.error("--record can't be used with --pack, since traces are replayed against the game flowchart")
+    if arguments.record is not None and arguments.watch:
+        parser.error("--record can't be used with --watch, since a trace is replayed against one version of the canvas")
+    if (arguments.policy == "scripted") != (arguments.script is not None):
+        parser.error("--policy scripted and --script must be used together")
+    return arguments
+
+
+def run(arguments: argparse.Namespace) -> None:
+    """Do what the command-line arguments ask for."""
+    if arguments.compile:
+        compile_game_graph()
+    elif arguments.check is not None:
+        errors = validate_canvas(arguments.check, arguments.workers)
+        print(format_validation_report(errors, arguments.check))
+        if len(errors) > 0:
+            sys.exit(1)
+    elif arguments.split_pack is not None:
+        print(f"Story pack written to {split_canvas_into_pack(FLOWCHART_PATH, arguments.split_pack)}")
+    elif arguments.search is not None:
+        graph = load_game_graph()
+        print(format_search_results(load_search_index(graph).search(arguments.search), graph, arguments.search))
+    elif arguments.analyze:
+        if arguments.pack is not None:
+            graph = StoryPack(arguments.pack).load_all_worlds()
+        else:
+            graph = load_game_graph()
+        print(format_analysis_report(analyze_graph(graph), graph))
+    elif arguments.replay is not None:
+        results = replay_traces(arguments.replay)
+        print(format_replay_report(results))
+        if any(diverged_step is not None for _, _, diverged_step, _ in results):
+            sys.exit(1)
+    elif arguments.simulate is not None:
+        if arguments.policy == "scripted":
+            policy = ScriptedPolicy(read_script(arguments.script))
+        else:
+            policy = POLICIES[arguments.policy]()
+        batch_statistics = run_batch(policy, arguments.simulate, arguments.workers)
+        print(format_batch_statistics(batch_statistics, load_game_graph()))
+    elif arguments.serve:
+        run_server(load_game_graph(), arguments.host, arguments.port, arguments.save_directory,
+                   arguments.save_debounce or 0.0)
+    else:
+        watcher = None
+        pack = None
+        if arguments.pack is not None:
+            pack = StoryPack(arguments.pack, arguments.max_loaded_worlds)
+            graph = pack.graph
+        elif arguments.watch:
+            watcher = CanvasWatcher()
+            graph = watcher.graph
+        else:
+            graph = load_game_graph()
+        if arguments.journal_save:
+            saver = JournalSaver()
+        else:
+            save_debounce = arguments.save_debounce
+            if save_debounce is None:
+                # A piped transcript can take thousands of choices a second, so don't write a save after every one
+                save_debounce = 0.0 if sys.stdin.isatty() else PIPED_SAVE_DEBOUNCE_SECONDS
+            saver = AutoSaver(debounce_seconds=save_debounce, background=arguments.background_save)
+        recorder = None
+        if arguments.record is not None:
+            recorder = TraceRecorder(arguments.record, hash_file(FLOWCHART_PATH))
+        run_game_main_loop(graph, saver, watcher, pack, recorder, HintIndex(graph))
 
 
 if __name__ == "__main__":
-    graph = read_game_graph()
-    run_game_main_loop(graph)
+    arguments = parse_arguments()
+    if arguments.width == 0:
+        set_line_length(shutil.get_terminal_size((DEFAULT_LINE_LENGTH, 24)).columns)
+    else:
+        set_line_length(arguments.width)
+    if arguments.no_audio:
+        set_audio_enabled(False)
+    if arguments.metrics is not None:
+        serve_metrics(arguments.metrics)
+    if not sys.stdin.isatty():
+        set_batched_input(True)     # Input is piped in, so read it in bulk
+    if arguments.profile is None:
+        run(arguments)
+    else:
+        profiler = start_profiling()
+        try:
+            run(arguments)
+        finally:
+            profiler.context.update(flowchart_path=FLOWCHART_PATH, canvas_sha256=hash_file(FLOWCHART_PATH).hex(),
+                                    python_version=platform.python_version())
+            profiler.write_report(arguments.profile)
+            print(format_profile_report(profiler.get_report()), file=sys.stderr)
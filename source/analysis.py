@@ -0,0 +1,279 @@
+"""For analyzing which parts of a story can actually be reached under the trick and orange redirect rules, without
+playing it.
+
+The linked Graph is flattened into compressed sparse row (CSR) arrays: scenes are numbered, the choices each scene can
+offer are packed into one array of target scene numbers, and each choice's required tricks are a bitmask.  The game's
+state is then a pair of (scene, tricks found), and the analysis explores every reachable state.  Two states that
+differ only in tricks that can never matter again from their scene behave the same, so each state's bitmask is cut
+down to the tricks still required somewhere downstream of its scene.  This keeps the number of states close to the
+number of scenes on typical canvases, rather than exponential in the number of tricks.
+"""
+
+
+from array import array
+from collections import deque
+from source.game_running import find_first_scene
+from source.graph import Graph
+
+
+class GraphArrays:
+    """The linked Graph flattened into integer arrays, with every scene and trick set addressed by number."""
+    def __init__(self, graph: Graph):
+        """
+        :param graph:   Graph object representing the full game
+        """
+        self.scenes = tuple(graph.scenes)
+        self.scene_indices = {scene: index for index, scene in enumerate(self.scenes)}
+
+        # Choices each scene can offer, in CSR layout: the choices from scene s are choices[offsets[s]:offsets[s+1]]
+        self.offsets = array("i", [0])
+        self.targets = array("i")
+        self.requires_masks = []
+        self.choices = []
+        for scene in self.scenes:
+            for choice in scene.visible_choices:
+                self.targets.append(self.scene_indices[choice.leads_to_reference])
+                self.requires_masks.append(choice.requires_mask)
+                self.choices.append(choice)
+            self.offsets.append(len(self.targets))
+
+        # Per-scene arrival rules: the compiled redirect rules, and every trick any of them needs
+        self.redirect_rules = [
+            tuple((required_mask, self.scene_indices[variant]) for required_mask, variant in scene.redirect_rules)
+            for scene in self.scenes
+        ]
+        self.redirect_masks = [rules[0][0] if len(rules) > 0 else 0 for rules in self.redirect_rules]
+        self.grants_masks = [scene.grants_mask for scene in self.scenes]
+        self.is_end = bytes(scene.is_end for scene in self.scenes)
+
+    def successors(self, scene_index: int) -> list:
+        """
+        Get every scene that could follow a scene, ignoring which tricks the player has.
+        :param scene_index:     number of the scene
+        :return:                list of scene numbers
+        """
+        out = list(self.targets[self.offsets[scene_index]:self.offsets[scene_index + 1]])
+        out.extend(variant for _, variant in self.redirect_rules[scene_index])
+        return out
+
+
+def find_relevant_trick_masks(arrays: GraphArrays) -> list:
+    """
+    For every scene, find the tricks that are required by some choice or redirect downstream of it.  Tricks outside
+    this mask can never change what happens once the player is at that scene.  Scenes in one strongly connected
+    component share a mask, so the components are found with an iterative version of Tarjan's algorithm, which
+    finishes them in reverse topological order.
+    :param arrays:      GraphArrays of the game
+    :return:            list of int bitmasks, one per scene
+    """
+    num_scenes = len(arrays.scenes)
+    successors = [arrays.successors(scene_index) for scene_index in range(num_scenes)]
+    local_masks = []
+    for scene_index in range(num_scenes):
+        mask = 0
+        for choice_index in range(arrays.offsets[scene_index], arrays.offsets[scene_index + 1]):
+            mask |= arrays.requires_masks[choice_index] | arrays.redirect_masks[arrays.targets[choice_index]]
+        local_masks.append(mask)
+
+    relevant = [0] * num_scenes
+    order = [-1] * num_scenes
+    low_link = [0] * num_scenes
+    on_stack = bytearray(num_scenes)
+    component_stack = []
+    counter = 0
+    for root in range(num_scenes):
+        if order[root] != -1:
+            continue
+        call_stack = [(root, 0)]
+        while len(call_stack) > 0:
+            scene_index, next_successor = call_stack.pop()
+            if next_successor == 0:
+                order[scene_index] = low_link[scene_index] = counter
+                counter += 1
+                component_stack.append(scene_index)
+                on_stack[scene_index] = 1
+            recursed = False
+            scene_successors = successors[scene_index]
+            while next_successor < len(scene_successors):
+                successor = scene_successors[next_successor]
+                next_successor += 1
+                if order[successor] == -1:
+                    call_stack.append((scene_index, next_successor))
+                    call_stack.append((successor, 0))
+                    recursed = True
+                    break
+                if on_stack[successor]:
+                    low_link[scene_index] = min(low_link[scene_index], order[successor])
+            if recursed:
+                continue
+            if low_link[scene_index] == order[scene_index]:
+                # Pop the finished component.  All components downstream of it are already finished.
+                component = []
+                while True:
+                    member = component_stack.pop()
+                    on_stack[member] = 0
+                    component.append(member)
+                    if member == scene_index:
+                        break
+                mask = 0
+                for member in component:
+                    mask |= local_masks[member]
+                    for successor in successors[member]:
+                        mask |= relevant[successor]
+                for member in component:
+                    relevant[member] = mask
+            if len(call_stack) > 0:
+                parent = call_stack[-1][0]
+                low_link[parent] = min(low_link[parent], low_link[scene_index])
+    return relevant
+
+
+def explore_state_space(graph: Graph) -> dict:
+    """
+    Explore every reachable (scene, tricks found) state of the game, starting from a new game.
+    :param graph:   Graph object representing the full game
+    :return:        dict with keys "arrays" (the GraphArrays), "state_scenes" and "state_masks" (the scene number and
+                    trick bitmask of each state, by state number), "edges_from" and "edges_to" (arrays of state numbers,
+                    one pair per transition), "arrived" (bytearray flagging scenes the player arrives at, before any
+                    redirect), and "available_choices" (bytearray flagging choices offered in some state)
+    """
+    arrays = GraphArrays(graph)
+    relevant = find_relevant_trick_masks(arrays)
+    num_scenes = len(arrays.scenes)
+    offsets, targets, requires_masks = arrays.offsets, arrays.targets, arrays.requires_masks
+    redirect_rules, grants_masks = arrays.redirect_rules, arrays.grants_masks
+
+    state_numbers = {}
+    state_scenes = array("i")
+    state_masks = []
+    edges_from = array("i")
+    edges_to = array("i")
+    arrived = bytearray(num_scenes)
+    available_choices = bytearray(len(targets))
+
+    first_scene = arrays.scene_indices[find_first_scene(graph)]
+    arrived[first_scene] = 1
+    state_numbers[first_scene] = 0
+    state_scenes.append(first_scene)
+    state_masks.append(0)
+    fringe = deque([0])
+    while len(fringe) > 0:
+        state = fringe.popleft()
+        scene_index = state_scenes[state]
+        mask = state_masks[state]
+        if arrays.is_end[scene_index]:
+            continue
+        for choice_index in range(offsets[scene_index], offsets[scene_index + 1]):
+            requires_mask = requires_masks[choice_index]
+            if mask & requires_mask != requires_mask:
+                continue
+            available_choices[choice_index] = 1
+            next_scene = targets[choice_index]
+            arrived[next_scene] = 1
+            for required_mask, variant in redirect_rules[next_scene]:
+                if mask & required_mask == required_mask:
+                    next_scene = variant
+                    arrived[next_scene] = 1
+                    break
+            next_mask = (mask | grants_masks[next_scene]) & relevant[next_scene]
+            key = next_mask * num_scenes + next_scene
+            next_state = state_numbers.get(key)
+            if next_state is None:
+                next_state = state_numbers[key] = len(state_scenes)
+                state_scenes.append(next_scene)
+                state_masks.append(next_mask)
+                fringe.append(next_state)
+            edges_from.append(state)
+            edges_to.append(next_state)
+
+    return {
+        "arrays": arrays,
+        "state_scenes": state_scenes,
+        "state_masks": state_masks,
+        "edges_from": edges_from,
+        "edges_to": edges_to,
+        "arrived": arrived,
+        "available_choices": available_choices,
+    }
+
+
+def analyze_graph(graph: Graph) -> dict:
+    """
+    Find the parts of the story that can't be reached, and the states a player can get stuck in.
+    :param graph:   Graph object representing the full game
+    :return:        dict with keys "states" (number of reachable states), "unreachable_scenes", "unreachable_ends",
+                    "unreachable_yellow_choices" (list of (from scene id, choice text) pairs), "dead_ends" (scene ids
+                    where some reachable state offers no choices), "softlocks" (scene ids where some reachable state
+                    can no longer reach any END)
+    """
+    state_space = explore_state_space(graph)
+    arrays = state_space["arrays"]
+    state_scenes = state_space["state_scenes"]
+    num_states = len(state_scenes)
+
+    # States that can still reach an END, found by searching backward from the END states
+    predecessors = [[] for _ in range(num_states)]
+    out_degrees = array("i", [0]) * num_states
+    for state, next_state in zip(state_space["edges_from"], state_space["edges_to"]):
+        predecessors[next_state].append(state)
+        out_degrees[state] += 1
+    can_finish = bytearray(num_states)
+    fringe = deque(state for state in range(num_states) if arrays.is_end[state_scenes[state]])
+    for state in fringe:
+        can_finish[state] = 1
+    while len(fringe) > 0:
+        state = fringe.popleft()
+        for previous_state in predecessors[state]:
+            if not can_finish[previous_state]:
+                can_finish[previous_state] = 1
+                fringe.append(previous_state)
+
+    shown = bytearray(len(arrays.scenes))
+    dead_ends = set()
+    softlocks = set()
+    for state in range(num_states):
+        scene_index = state_scenes[state]
+        shown[scene_index] = 1
+        if arrays.is_end[scene_index]:
+            continue
+        if out_degrees[state] == 0:
+            dead_ends.add(scene_index)
+        elif not can_finish[state]:
+            softlocks.add(scene_index)
+
+    scene_ids = [scene.id for scene in arrays.scenes]
+    return {
+        "states": num_states,
+        "unreachable_scenes": [scene.id for index, scene in enumerate(arrays.scenes)
+                               if not state_space["arrived"][index] and not scene.is_trick and not scene.is_start],
+        "unreachable_ends": [scene.id for index, scene in enumerate(arrays.scenes) if scene.is_end and not shown[index]],
+        "unreachable_yellow_choices": [(choice.leads_from_reference.id, choice.text)
+                                       for index, choice in enumerate(arrays.choices)
+                                       if choice.color == "yellow" and not state_space["available_choices"][index]],
+        "dead_ends": sorted(scene_ids[index] for index in dead_ends),
+        "softlocks": sorted(scene_ids[index] for index in softlocks),
+    }
+
+
+def format_analysis_report(report: dict, graph: Graph) -> str:
+    """
+    Summarize the report from analyze_graph() for a person to read.
+    :param report:  dict returned by analyze_graph()
+    :param graph:   Graph object that was analyzed, to look up scene text
+    :return:        multi-line summary
+    """
+    lines = [f"Reachable (scene, tricks found) states: {report['states']}"]
+    sections = (
+        ("Scenes that can never be reached", report["unreachable_scenes"]),
+        ("END scenes that can never be reached", report["unreachable_ends"]),
+        ("Dead ends: scenes where the player can be left with no choices", report["dead_ends"]),
+        ("Softlocks: scenes where the player can be left unable to reach any END", report["softlocks"]),
+    )
+    for title, scene_ids in sections:
+        lines.append(f"{title}: {len(scene_ids)}")
+        for scene_id in scene_ids:
+            lines.append(f"    {scene_id}  {graph.scene_by_id[scene_id].text[:50]!r}")
+    lines.append(f"Yellow choices that can never be offered: {len(report['unreachable_yellow_choices'])}")
+    for scene_id, text in report["unreachable_yellow_choices"]:
+        lines.append(f"    from {scene_id}  {text[:50]!r}")
+    return "\n".join(lines)
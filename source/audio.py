@@ -0,0 +1,53 @@
+"""For playing the game's music.
+
+Audio is optional.  playsound3 is only imported the first time a sound is played, so headless runs and the server
+never pay for it, and if it's missing or has no way to play sound on this machine, the game carries on in silence.
+Audio can also be turned off with set_audio_enabled(False), or by setting the environment variable
+INNER_WILDS_NO_AUDIO to any non-empty value.
+"""
+
+
+import os
+
+
+INTRO_SONG_PATH = "source/audio/Inner Wilds.mp3"
+NO_AUDIO_ENVIRONMENT_VARIABLE = "INNER_WILDS_NO_AUDIO"
+
+audio_enabled = len(os.environ.get(NO_AUDIO_ENVIRONMENT_VARIABLE, "")) == 0
+
+
+def set_audio_enabled(enabled: bool) -> None:
+    """
+    Turn all audio on or off from now on.
+    :param enabled:     whether sounds should be played
+    """
+    global audio_enabled
+    audio_enabled = enabled
+
+
+def play_in_background(sound_path: str):
+    """
+    Start playing a sound without waiting for it to finish.
+    :param sound_path:  path to the sound file
+    :return:            playsound3 Sound object that can be stopped with stop_sound(), or None if audio is off or
+                        can't be played
+    """
+    if not audio_enabled:
+        return None
+    try:
+        from playsound3 import playsound
+    except ImportError:
+        return None
+    try:
+        return playsound(sound_path, block=False)
+    except Exception:   # No audio backend, no audio device, etc.  Music is never worth stopping the game over.
+        return None
+
+
+def stop_sound(sound) -> None:
+    """
+    Stop a sound started with play_in_background(), if it's still playing.
+    :param sound:   playsound3 Sound object, or None
+    """
+    if sound is not None and sound.is_alive():
+        sound.stop()
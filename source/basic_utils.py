@@ -1,53 +1,279 @@
 """Handling really basic stuff, below even the level of scenes and choices."""
 
 
-def word_wrap(s: str, line_length=80) -> str:
+import codecs
+import gc
+import os
+import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+
+@contextmanager
+def paused_garbage_collection():
+    """
+    Pause the cyclic garbage collector for the duration of a with block.  Building a graph allocates lots of objects
+    that all point at each other and all stay alive, so letting the collector repeatedly scan them only wastes time.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+DEFAULT_LINE_LENGTH = 80
+WORD_WRAP_CACHE_SIZE = 1 << 16
+CHOICE_MENU_CACHE_SIZE = 1 << 14
+
+INPUT_CHUNK_SIZE = 1 << 16
+BACKGROUND_READ_POLL_SECONDS = 0.1
+
+screen_line_length = DEFAULT_LINE_LENGTH
+
+# Player input.  In batched mode, e.g. when a transcript of choices is piped in, input is read in big chunks, and
+# output is only flushed when the game has to wait for more input.
+batched_input = False
+input_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+unfinished_line = ""        # Start of a line read in bulk, whose end hasn't been read yet
+pending_lines = deque()     # Lines read in bulk that haven't been used yet
+pending_choices = deque()   # The rest of a line of choices typed ahead, like "1 3 2"
+background_reader = None    # Thread reading the player's next line while the game waits on something else
+background_result = []      # The line it read, or the EOFError it hit
+
+
+def set_line_length(new_line_length: int) -> None:
+    """
+    Set the maximum character count between newlines for all text shown to the player from now on.
+    :param new_line_length:     maximum character count between newlines.  Must be at least 1
+    """
+    global screen_line_length
+    if new_line_length < 1:
+        raise ValueError("line length must be at least 1")
+    screen_line_length = new_line_length
+
+
+def set_batched_input(enabled: bool) -> None:
+    """
+    Turn batched reading of the player's input on or off.  Meant for when standard input isn't a terminal.
+    :param enabled:     True to read input in bulk, False to read it a line at a time with input()
+    """
+    global batched_input
+    batched_input = enabled
+
+
+def read_line(prompt: str) -> str:
+    """
+    Show a prompt and read a line of the player's input, like input().
+    :param prompt:  the text to show before reading
+    :return:        the line, without its line ending
+    Raises EOFError if there's no more input.
+    """
+    if background_reader is not None:
+        # A line is already being read, so show the prompt and wait for that one
+        sys.stdout.write(prompt)
+        sys.stdout.flush()
+        return finish_background_read()
+    return read_input_line(prompt)
+
+
+def read_input_line(prompt: str) -> str:
+    """
+    Show a prompt and read the next line of standard input, in bulk when in batched mode.
+    :param prompt:  the text to show before reading
+    :return:        the line, without its line ending
+    Raises EOFError if there's no more input.
+    """
+    if not batched_input:
+        return input(prompt)
+    global unfinished_line
+    sys.stdout.write(prompt)
+    while len(pending_lines) == 0:
+        sys.stdout.flush()  # Only flush when there's nothing left to do but wait for input
+        chunk = os.read(sys.stdin.fileno(), INPUT_CHUNK_SIZE)
+        if len(chunk) == 0:
+            if len(unfinished_line) == 0:
+                raise EOFError("EOF when reading a line")
+            pending_lines.append(unfinished_line)
+            unfinished_line = ""
+        else:
+            lines = (unfinished_line + input_decoder.decode(chunk)).split("\n")
+            unfinished_line = lines.pop()
+            pending_lines.extend(line.rstrip("\r") for line in lines)
+    return pending_lines.popleft()
+
+
+def read_line_into(result: list, prompt: str) -> None:
+    """
+    Read a line with read_input_line() on a background thread.
+    :param result:  list to add the line to, or the EOFError if there's no more input
+    :param prompt:  the text to show before reading
+    """
+    try:
+        result.append(read_input_line(prompt))
+    except EOFError as error:
+        result.append(error)
+
+
+def finish_background_read() -> str:
+    """
+    Wait for the line being read on a background thread.
+    :return:    the line
+    Raises EOFError if there was no more input.
+    """
+    global background_reader
+    background_reader.join()
+    background_reader = None
+    line = background_result.pop()
+    if isinstance(line, EOFError):
+        raise line
+    return line
+
+
+def wait_for_line_or(is_done, prompt: str) -> None:
+    """
+    Show a prompt and wait until either the player enters a line or something else is done, whichever comes first.
+    Choices on the line are kept as if typed ahead.  If the other thing is done first, the line is still read, and
+    the next read gets it instead of reading another.
+    :param is_done:     function that returns True once there's no more need to wait
+    :param prompt:      the text to show before reading
+    """
+    global background_reader
+    if background_reader is None:
+        background_reader = threading.Thread(target=read_line_into, args=(background_result, prompt),
+                                             name="LineReader", daemon=True)
+        background_reader.start()
+    while background_reader.is_alive() and not is_done():
+        background_reader.join(BACKGROUND_READ_POLL_SECONDS)
+    if not background_reader.is_alive():
+        pending_choices.extend(finish_background_read().split())
+
+
+def read_choice(prompt: str) -> str:
+    """
+    Show a prompt and read the player's next choice.  A line can hold several choices separated by spaces, which are
+    then used one at a time, in order, for the next prompts.
+    :param prompt:  the text to show before reading
+    :return:        the choice
+    """
+    if len(pending_choices) == 0:
+        pending_choices.extend(read_line(prompt).split() or [""])
+        return pending_choices.popleft()
+    # A choice typed ahead.  At a terminal, show it as if it had just been typed.
+    choice = pending_choices.popleft()
+    sys.stdout.write(prompt if batched_input else f"{prompt}{choice}\n")
+    return choice
+
+
+def read_player_line(prompt: str) -> str:
+    """
+    Show a prompt and read a line of free text from the player, e.g. a search query.  If choices were typed ahead, the
+    rest of them are taken as the line instead.
+    :param prompt:  the text to show before reading
+    :return:        the line
+    """
+    if len(pending_choices) == 0:
+        return read_line(prompt)
+    line = " ".join(pending_choices)
+    pending_choices.clear()
+    sys.stdout.write(prompt if batched_input else f"{prompt}{line}\n")
+    return line
+
+
+@lru_cache(maxsize=WORD_WRAP_CACHE_SIZE)
+def word_wrap(s: str, line_length=DEFAULT_LINE_LENGTH) -> str:
     """
     Intersperse s with newlines so that it doesn't run off the player's screen so easily when printed.
-    Split on spaces whenever able
+    Split on spaces whenever able.  A word longer than a whole line is left on a line of its own.
+    Runs in time linear in the length of s, and remembers recent results, since the same scene text is wrapped every
+    time the scene is shown.
     :param s:               string to be processed
     :param line_length:     maximum character count between newlines
     :return:
     """
     chunks = []
 
-    unchunked = s
-    del s
-
-    while len(unchunked) > 0:
-        if len(unchunked) <= line_length:
-            chunks.append(unchunked)
-            unchunked = ""
-        elif "\n" in unchunked[:line_length]:
-            newline_index = unchunked.index("\n")
-            chunks.append(unchunked[:newline_index])
-            unchunked = unchunked[newline_index+1:]
+    position = 0    # index in s of the start of the part that hasn't been chunked yet
+    while position < len(s):
+        line_end = position + line_length
+        newline_index = s.find("\n", position, line_end)
+        if len(s) <= line_end:
+            chunks.append(s[position:])
+            position = len(s)
+        elif newline_index != -1:
+            chunks.append(s[position:newline_index])
+            position = newline_index + 1
         else:
-            # Get the line_length'th character of unchunked
-            index_to_chunk = line_length
-            char_to_chunk = unchunked[index_to_chunk]
-            # Get the nearest space at or before this character
-            while char_to_chunk != " ":
-                index_to_chunk -= 1
-                if index_to_chunk <= 0:     # If no spaces found, give up and treat all that remains as a chunk
-                    chunks.append(unchunked)
-                    unchunked = ""
-                char_to_chunk = unchunked[index_to_chunk]
+            # Get the nearest space at or before the line_length'th character of the part that hasn't been chunked
+            space_index = s.rfind(" ", position + 1, line_end + 1)
+            if space_index == -1:
+                # No spaces found, so leave the word whole and chunk at the first space or newline after it
+                space_index = s.find(" ", line_end)
+                newline_index = s.find("\n", line_end)
+                if newline_index != -1 and (space_index == -1 or newline_index < space_index):
+                    chunks.append(s[position:newline_index])
+                    position = newline_index + 1
+                    continue
+                if space_index == -1:
+                    chunks.append(s[position:])
+                    position = len(s)
+                    continue
             # Chunk on that entire contiguous collection of spaces
-            leftmost_space_index = index_to_chunk   # index of the leftmost space
-            rightmost_space_index = index_to_chunk + 1  # index of the character *after* the rightmost space
-            while leftmost_space_index > 0 and unchunked[leftmost_space_index-1] == " ":
+            leftmost_space_index = space_index      # index of the leftmost space
+            rightmost_space_index = space_index + 1     # index of the character *after* the rightmost space
+            while leftmost_space_index > position and s[leftmost_space_index-1] == " ":
                 leftmost_space_index -= 1
-            while rightmost_space_index <= len(unchunked)-1 and unchunked[rightmost_space_index] == " ":
+            while rightmost_space_index < len(s) and s[rightmost_space_index] == " ":
                 rightmost_space_index += 1
-            chunks.append(unchunked[:leftmost_space_index])
-            unchunked = unchunked[rightmost_space_index:]
+            chunks.append(s[position:leftmost_space_index])
+            position = rightmost_space_index
 
     # Recompose chunks into a string and return
     out = "\n".join(chunks)
     return out
 
 
+CHOICE_NOT_RECOGNIZED = "Choice not recognized.  Press a number for one of the following options, then press Enter."
+
+
+def wrap_to_screen(s: str) -> str:
+    """
+    Word-wrap text to the line length set with set_line_length().
+    :param s:   the text to wrap
+    :return:    the wrapped text
+    """
+    return word_wrap(s, screen_line_length)
+
+
+@lru_cache(maxsize=CHOICE_MENU_CACHE_SIZE)
+def render_choice_menu(prompt: str, options: tuple, line_length: int) -> tuple:
+    """
+    Lay out a prompt and a numbered collection of options, remembering recent results.  Use format_choice_menu()
+    rather than calling this directly.
+    :param prompt:          the prompt to show.
+    :param options:         tuple of (number, option text) pairs, in the order to show them.
+    :param line_length:     maximum character count between newlines
+    :return:                tuple with (the prompt text to show once, the menu of options to show before each input)
+    """
+    menu = "".join(word_wrap(f"    {key}: {value}\n", line_length) for key, value in options)
+    menu += "\n    "
+    return word_wrap(prompt, line_length) + "\n", menu
+
+
+def format_choice_menu(prompt: str, options: dict) -> tuple:
+    """
+    Lay out a prompt and a numbered collection of options the way they're shown to the player.
+    :param prompt:      the prompt to show.
+    :param options:     a dict of options to show, with their numbers as keys.
+    :return:            tuple with (the prompt text to show once, the menu of options to show before each input)
+    """
+    return render_choice_menu(prompt, tuple(options.items()), screen_line_length)
+
+
 def make_player_choose(prompt: str, options: dict) -> str:
     """
     Show a player a prompt and a numbered collection of options, then force them to pick a valid number.
@@ -55,13 +281,40 @@ def make_player_choose(prompt: str, options: dict) -> str:
     :param options:     a dict of options to show, with their numbers as keys.  For example, {"1": "Eat the bread", "2": "Smell the bread", "3": "Drop the bread"}
     :return:            the number the player chose
     """
-    print(word_wrap(prompt) + "\n")
-    prompt = ""
-    for key, value in options.items():
-        prompt += word_wrap(f"    {key}: {value}\n")
-    prompt += "\n    "
+    prompt, menu = format_choice_menu(prompt, options)
+    return read_player_choice(prompt, menu, options)
+
+
+def read_player_choice(prompt: str, menu: str, options: dict) -> str:
+    """
+    Show a player a prompt and menu already laid out by format_choice_menu(), then force them to pick a valid number.
+    :param prompt:      the prompt text to show once.
+    :param menu:        the menu of options to show before each input.
+    :param options:     a dict of options to show, with their numbers as keys.
+    :return:            the number the player chose
+    """
+    # The prompt and menu are shown with one write
+    player_response = read_choice(prompt + "\n" + menu)
+    while player_response not in options:
+        print(word_wrap(CHOICE_NOT_RECOGNIZED, screen_line_length))
+        player_response = read_choice(menu)
+    return player_response
+
+
+async def make_player_choose_async(player_io, prompt: str, options: dict) -> str:
+    """
+    Like make_player_choose(), but for a player on the other end of an asynchronous connection.
+    :param player_io:   object with a write(text) method, and a coroutine method readline() that returns the player's
+                        next line of input without its line ending
+    :param prompt:      the prompt to show.
+    :param options:     a dict of options to show, with their numbers as keys.
+    :return:            the number the player chose
+    """
+    prompt, menu = format_choice_menu(prompt, options)
+    player_io.write(prompt + "\n")
     while True:
-        player_response = input(prompt)
+        player_io.write(menu)
+        player_response = await player_io.readline()
         if player_response in options:
             return player_response
-        print(word_wrap("Choice not recognized.  Press a number for one of the following options, then press Enter."))
+        player_io.write(word_wrap(CHOICE_NOT_RECOGNIZED, screen_line_length) + "\n")
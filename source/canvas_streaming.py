@@ -0,0 +1,116 @@
+"""For reading very large flowchart canvas files a piece at a time, rather than loading the whole JSON document into
+memory at once.
+
+A canvas file is a JSON object whose "nodes" and "edges" keys hold arrays of small objects.  The scanner here walks the
+top-level object by hand, reading the file in chunks, and hands each node or edge object to json's own decoder as soon
+as it has been read in full.  Only one chunk of the file and one node or edge dict are alive at any time.
+"""
+
+
+import json
+
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = " \t\n\r"
+STREAMED_KEYS = ("nodes", "edges")
+
+
+class CanvasScanner:
+    """Reads JSON values one at a time from a text file, refilling a buffer as needed."""
+    def __init__(self, file, chunk_size: int = CHUNK_SIZE):
+        """
+        :param file:            text file opened for reading
+        :param chunk_size:      number of characters to read from the file at a time
+        """
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.at_end_of_file = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self) -> bool:
+        """
+        Read another chunk of the file into the buffer, dropping what has already been scanned.
+        :return:    False if the file has no more to read, else True
+        """
+        chunk = self.file.read(self.chunk_size)
+        if len(chunk) == 0:
+            self.at_end_of_file = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Skip whitespace and return the next character without consuming it.
+        :return:    the next character, or "" at the end of the file
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return ""
+
+    def expect(self, characters: str) -> str:
+        """
+        Skip whitespace and consume the next character, which must be one of the given characters.
+        :param characters:  the characters allowed next
+        :return:            the character consumed
+        """
+        character = self.peek()
+        if character == "" or character not in characters:
+            raise ValueError(f"malformed canvas file: expected one of {characters!r} but found {character!r}")
+        self.position += 1
+        return character
+
+    def read_value(self):
+        """
+        Skip whitespace and decode the next JSON value, reading more of the file until it's complete.
+        :return:    the decoded value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number at the very end of the buffer might continue in the next chunk
+            if end == len(self.buffer) and not self.at_end_of_file and self.fill():
+                continue
+            self.position = end
+            return value
+
+
+def iter_canvas_items(file, chunk_size: int = CHUNK_SIZE):
+    """
+    Read a canvas file one node or edge at a time.  Top-level keys other than "nodes" and "edges" are skipped.
+    :param file:            text file opened for reading
+    :param chunk_size:      number of characters to read from the file at a time
+    :return:                generator of (key, dict) tuples, where key is "nodes" or "edges"
+    """
+    scanner = CanvasScanner(file, chunk_size)
+    scanner.expect("{")
+    if scanner.peek() == "}":
+        return
+    while True:
+        key = scanner.read_value()
+        scanner.expect(":")
+        if key in STREAMED_KEYS and scanner.peek() == "[":
+            scanner.expect("[")
+            if scanner.peek() == "]":
+                scanner.expect("]")
+            else:
+                while True:
+                    yield key, scanner.read_value()
+                    if scanner.expect(",]") == "]":
+                        break
+        else:
+            scanner.read_value()
+        if scanner.expect(",}") == "}":
+            return
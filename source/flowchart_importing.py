@@ -4,13 +4,18 @@ redesigned.
 
 
 import json
+from collections import deque
 from os import path
+from source.basic_utils import paused_garbage_collection
+from source.canvas_streaming import iter_canvas_items
 from source.graph import Graph, Scene, Choice
 from source.flowchart_syntax import trick_signifier
+from source.profiling import profile_phase
 
 
 FLOWCHART_PATH = path.join("source", "game_flowchart.canvas")
 HUB_RETURN_CHOICE_STRING = "Return to the hub menu for this world"
+STREAMING_THRESHOLD_BYTES = 64 << 20
 
 
 def color_number_to_name(color_number) -> str:
@@ -34,163 +39,347 @@ def color_number_to_name(color_number) -> str:
         raise ValueError(f"color_number not recognized: {color_number}")
 
 
+def build_scene_object(scene_dict: dict) -> Scene:
+    """
+    Convert a scene dict read from the flowchart canvas file to a Scene object.
+    :param scene_dict:      scene dict read from the flowchart canvas file.
+    :return:                Scene object
+    """
+    # Id
+    this_id = scene_dict["id"]
+    # Text
+    this_text = scene_dict["text"]
+    if len(this_text) == 0:
+        this_text = "Continue"
+    # Color
+    if "color" in scene_dict:
+        this_color = color_number_to_name(scene_dict["color"])
+    else:
+        this_color = color_number_to_name(None)
+    # Is trick
+    this_is_trick = this_text.startswith(trick_signifier) and this_color == "green"
+    # Is start
+    this_is_start = this_text == "START" and this_color == "red"
+    # Is end
+    this_is_end = this_text == "END" and this_color == "red"
+    # Build
+    return Scene(this_id, this_text, this_color, this_is_trick, this_is_start, this_is_end)
+
+
 def build_scene_objects(scene_dicts: list) -> list:
     """
     Convert a list of scene dicts read from the flowchart canvas file to Scene objects.
     :param scene_dicts:     list of scene dicts read from the flowchart canvas file.
-    :param choice_dicts:    list of choice dicts read from the flowchart canvas file.
     :return:                list of Scene objects, one for each scene dict
     """
-    out = []
-
-    for this_dict in scene_dicts:
-        # Id
-        this_id = this_dict["id"]
-        # Text
-        this_text = this_dict["text"]
-        if len(this_text) == 0:
-            this_text = "Continue"
-        # Color
-        if "color" in this_dict:
-            this_color = color_number_to_name(this_dict["color"])
-        else:
-            this_color = color_number_to_name(None)
-        # Is trick
-        this_is_trick = this_text.startswith(trick_signifier) and this_color == "green"
-        # Is start
-        this_is_start = this_text == "START" and this_color == "red"
-        # Is end
-        this_is_end = this_text == "END" and this_color == "red"
-        # Build and append to output
-        out.append(Scene(this_id, this_text, this_color, this_is_trick, this_is_start, this_is_end))
-
-    return out
+    return [build_scene_object(this_dict) for this_dict in scene_dicts]
+
+
+def build_choice_object(choice_dict: dict) -> Choice:
+    """
+    Convert a choice dict read from the flowchart canvas file to a Choice object.
+    :param choice_dict:     choice dict read from the flowchart canvas file.
+    :return:                Choice object
+    """
+    # Id
+    this_id = choice_dict["id"]
+    # Text
+    if "label" in choice_dict:
+        this_text = choice_dict["label"]
+    else:
+        this_text = "Continue"
+    # Leads to
+    this_leads_to = choice_dict["toNode"]
+    # Leads from
+    this_leads_from = choice_dict["fromNode"]
+    # Color
+    if "color" in choice_dict:
+        this_color = color_number_to_name(choice_dict["color"])
+    else:
+        this_color = color_number_to_name(None)
+    # Build
+    return Choice(this_id, this_text, this_leads_to, this_leads_from, this_color)
 
 
 def build_choice_objects(choice_dicts: list) -> list:
     """
     Convert a list of choice dicts read from the flowchart canvas file to Choice objects.
-    :param scene_dicts:     list of scene dicts read from the flowchart canvas file.
     :param choice_dicts:    list of choice dicts read from the flowchart canvas file.
     :return:                list of Choice objects, one for each choice dict
     """
-    out = []
-
-    for this_dict in choice_dicts:
-        # Id
-        this_id = this_dict["id"]
-        # Text
-        if "label" in this_dict:
-            this_text = this_dict["label"]
-        else:
-            this_text = "Continue"
-        # Leads to
-        this_leads_to = this_dict["toNode"]
-        # Leads from
-        this_leads_from = this_dict["fromNode"]
-        # Color
-        if "color" in this_dict:
-            this_color = color_number_to_name(this_dict["color"])
-        else:
-            this_color = color_number_to_name(None)
-        # Build and append to output
-        out.append(Choice(this_id, this_text, this_leads_to, this_leads_from, this_color))
-        pass
-
-    return out
-
-
-def read_game_graph() -> Graph:
-    """Read the canvas file"""
-    # Get scenes and choices from the canvas file
-    with open(FLOWCHART_PATH) as file:
-        content = json.load(file)
-    scenes = content["nodes"]
-    choices = content["edges"]
+    return [build_choice_object(this_dict) for this_dict in choice_dicts]
 
-    # Convert them to Scene and Choice objects
-    scenes = build_scene_objects(scenes)
-    choices = build_choice_objects(choices)
 
-    # Set choices_to_ids, choices_to_references, choices_from_ids, and choices_from_references for all Scenes
-    # choices_to_ids and choices_to_references
-    for scene in scenes:
-        choices_to_ids = []
-        choices_to_references = []
-        for choice in choices:
-            if choice.leads_to_id == scene.id:
-                choices_to_ids.append(choice.id)
-                choices_to_references.append(choice)
-        scene.set_choices_to_ids(tuple(choices_to_ids))
-        scene.set_choices_to_references(tuple(choices_to_references))
-    # choices_from_ids and choices_from_references
+def link_graph(scenes: list, choices: list, allow_outside_targets: bool = False) -> None:
+    """
+    Set choices_to_ids, choices_to_references, choices_from_ids, and choices_from_references for all Scenes, and
+    leads_to_reference and leads_from_reference for all Choices.  Runs in time linear in the number of scenes plus the
+    number of choices, by indexing scenes by id and choices by the ids of their endpoints.
+    :param scenes:                  list of Scene objects, as built by build_scene_objects()
+    :param choices:                 list of Choice objects, as built by build_choice_objects()
+    :param allow_outside_targets:   whether choices may lead to scenes that aren't in the list, e.g. in another canvas
+                                    of a story pack.  Those choices are left without a leads_to_reference
+    Raises ValueError, before linking anything, if a choice leads away from a scene that isn't in the list, or to one
+    that isn't and allow_outside_targets is False.
+    """
+    # Index scenes by id, and choices by the ids of the scenes they point toward and away from.  Choices keep the
+    # order they have in the canvas file.
+    scene_by_id = {scene.id: scene for scene in scenes}
+    choices_to_by_id = {scene.id: [] for scene in scenes}
+    choices_from_by_id = {scene.id: [] for scene in scenes}
+    for choice in choices:
+        if choice.leads_to_id in choices_to_by_id:
+            choices_to_by_id[choice.leads_to_id].append(choice)
+        elif not allow_outside_targets:
+            raise ValueError(f"edge {choice.id} points at node {choice.leads_to_id}, which isn't in the canvas")
+        if choice.leads_from_id not in choices_from_by_id:
+            raise ValueError(f"edge {choice.id} leads away from node {choice.leads_from_id}, which isn't in the canvas")
+        choices_from_by_id[choice.leads_from_id].append(choice)
+
+    # choices_to_ids, choices_to_references, choices_from_ids, and choices_from_references
     for scene in scenes:
-        choices_from_ids = []
-        choices_from_references = []
-        for choice in choices:
-            if choice.leads_from_id == scene.id:
-                choices_from_ids.append(choice.id)
-                choices_from_references.append(choice)
-        scene.set_choices_from_ids(tuple(choices_from_ids))
-        scene.set_choices_from_references(tuple(choices_from_references))
+        choices_to_references = tuple(choices_to_by_id[scene.id])
+        choices_from_references = tuple(choices_from_by_id[scene.id])
+        scene.set_choices_to_ids(tuple(choice.id for choice in choices_to_references))
+        scene.set_choices_to_references(choices_to_references)
+        scene.set_choices_from_ids(tuple(choice.id for choice in choices_from_references))
+        scene.set_choices_from_references(choices_from_references)
 
-    # Set leads_to_reference and leads_from_reference for all Choices
+    # leads_to_reference and leads_from_reference
     for choice in choices:
-        # leads_to_reference
-        for scene in scenes:
-            if scene.id == choice.leads_to_id:
-                choice.set_leads_to_reference(scene)
-                break
-        # leads_from_reference
-        for scene in scenes:
-            if scene.id == choice.leads_from_id:
-                choice.set_leads_from_reference(scene)
-                break
+        if choice.leads_to_id in scene_by_id:
+            choice.set_leads_to_reference(scene_by_id[choice.leads_to_id])
+        choice.set_leads_from_reference(scene_by_id[choice.leads_from_id])
+
 
-    # For all Scenes, set gives_tricks
+def find_world_parents(scenes: list, stay_within: bool = False) -> dict:
+    """
+    For every Scene at once, find the nearest world it is the child of through a sequence of choices without any blue
+    or green choices.  This is a multi-source breadth-first search forward from all worlds, so it runs in time linear
+    in the number of scenes plus the number of choices.  Must be run after link_graph().
+    :param scenes:      list of linked Scene objects
+    :param stay_within: whether the search must never leave the given scenes, e.g. to keep to one canvas of a story
+                        pack.  Otherwise it follows choices to any Scene they lead to
+    :return:            dict mapping each Scene that is not a trick and not a world, and is the child of a world, to
+                        the world Scene it's a child of.  Scenes that aren't children of any world are left out.
+    """
+    nearest_world = {}
+    fringe = deque()
+    within = set(scenes) if stay_within else None
     for scene in scenes:
-        gives_tricks = []
-        for choice in scene.choices_from_references:
-            text = choice.leads_to_reference.text
-            if text.startswith(trick_signifier):
-                gives_tricks.append(text[len(trick_signifier):])
-        scene.set_gives_tricks(tuple(gives_tricks))
-
-    # For all Choices, set requires_tricks
-    for choice in choices:
-        requires_tricks = []
-        relevant_scene = choice.leads_from_reference
-        if choice.color == "yellow":
-            for inbound_choice in relevant_scene.choices_to_references:
-                if inbound_choice.color == "green" and inbound_choice.leads_from_reference.text.startswith(trick_signifier):
-                    requires_tricks.append(inbound_choice.leads_from_reference.text[len(trick_signifier):])
-            choice.set_requires_tricks(tuple(requires_tricks))
-        else:
-            choice.set_requires_tricks(tuple())
+        if scene.is_world:
+            nearest_world[scene] = scene
+            fringe.append(scene)
 
-    # For all Scenes, if that Scene is not a trick and is the child of a world through a sequence of choices without any blue or green choices, add a Choice to return to that world.
+    while len(fringe) > 0:
+        to_explore = fringe.popleft()
+        world = nearest_world[to_explore]
+        for choice in to_explore.choices_from_references:
+            if choice.color in ("green", "blue"):
+                continue
+            neighbor = choice.leads_to_reference
+            if neighbor not in nearest_world and (within is None or neighbor in within):
+                nearest_world[neighbor] = world
+                fringe.append(neighbor)
+
+    # Tricks can be passed through on the way to a scene, but never get to return to a world themselves
+    return {scene: world for scene, world in nearest_world.items() if not scene.is_world and not scene.is_trick}
+
+
+def find_gives_tricks(scene: Scene) -> tuple:
+    """
+    Find the tricks a linked Scene gives: those of the trick scenes its choices lead to.
+    :param scene:   linked Scene object
+    :return:        tuple of tricks, as strings
+    """
+    gives_tricks = []
+    for choice in scene.choices_from_references:
+        text = choice.leads_to_reference.text
+        if text.startswith(trick_signifier):
+            gives_tricks.append(text[len(trick_signifier):])
+    return tuple(gives_tricks)
+
+
+def find_requires_tricks(choice: Choice) -> tuple:
+    """
+    Find the tricks a linked Choice requires.  Only yellow choices require tricks: those of the trick scenes with green
+    choices into the scene the yellow choice leads away from.
+    :param choice:  linked Choice object
+    :return:        tuple of tricks, as strings
+    """
+    if choice.color != "yellow":
+        return tuple()
+    requires_tricks = []
+    for inbound_choice in choice.leads_from_reference.choices_to_references:
+        if inbound_choice.color == "green" and inbound_choice.leads_from_reference.text.startswith(trick_signifier):
+            requires_tricks.append(inbound_choice.leads_from_reference.text[len(trick_signifier):])
+    return tuple(requires_tricks)
+
+
+def find_redirect_chain_errors(variant_ids: dict) -> list:
+    """
+    Find every chain of state variants that Scene.compile_redirect_rules() couldn't compile.  Runs in time linear in
+    the number of scenes with state variants.
+    :param variant_ids:     dict mapping the id of every scene that isn't a trick and has outgoing orange choices to
+                            the list of ids of the scenes those choices lead to
+    :return:                list of (scene id, error message) pairs: one per scene with more than 1 outgoing orange
+                            choice, and one per loop of state variants
+    """
+    errors = []
+    for scene_id, targets in variant_ids.items():
+        if len(targets) != 1:
+            errors.append((scene_id, f"Cannot redirect to state variant of scene {scene_id} because does not have exactly 1 outgoing orange edge."))
+    finished = set()
+    for scene_id in variant_ids:
+        chain = []
+        in_chain = set()
+        current = scene_id
+        while current in variant_ids and current not in finished:
+            if current in in_chain:
+                errors.append((current, f"The state variants of scene {scene_id} redirect in a loop, back to scene {current}."))
+                break
+            chain.append(current)
+            in_chain.add(current)
+            current = variant_ids[current][0]
+        finished.update(chain)
+    return errors
+
+
+def check_redirect_chains(variant_ids: dict) -> None:
+    """
+    Check that every chain of state variants can be compiled by Scene.compile_redirect_rules(), before anything is
+    linked, e.g. so that reloading a broken canvas can leave the game as it was.
+    :param variant_ids:     dict as taken by find_redirect_chain_errors()
+    Raises RuntimeError if a scene has more than 1 outgoing orange choice, or a chain loops.
+    """
+    errors = find_redirect_chain_errors(variant_ids)
+    if len(errors) > 0:
+        raise RuntimeError(errors[0][1])
+
+
+def build_hub_return_choice(scene: Scene, world: Scene) -> Choice:
+    """
+    Build the Choice that returns from a scene to the world it's the child of.  It isn't added to either Scene.
+    :param scene:   Scene the choice leads away from
+    :param world:   world Scene the choice leads to
+    :return:        Choice object
+    """
+    choice = Choice(None, HUB_RETURN_CHOICE_STRING, None, None, "gray")
+    choice.set_leads_from_reference(scene)
+    choice.set_leads_to_reference(world)
+    choice.set_requires_tricks(tuple())
+    return choice
+
+
+def add_hub_return_choices(scenes: list, choices: list, stay_within: bool = False) -> None:
+    """
+    Give every linked Scene that is the child of a world a Choice to return to that world.  Hub-return choices are
+    gathered per scene first, so that each tuple of choices is only rebuilt once.
+    :param scenes:      list of linked Scene objects
+    :param choices:     list of Choice objects, which the new hub-return choices are appended to
+    :param stay_within: whether worlds must be found without leaving the given scenes; see find_world_parents()
+    """
+    world_parents = find_world_parents(scenes, stay_within)
+    new_choices_from = {}
+    new_choices_to = {}
     for scene in scenes:
-        is_child, world_parent = scene.is_child_of_world()
-        if is_child:
-            new_choice = Choice(None, HUB_RETURN_CHOICE_STRING, None, None, "gray")
-            new_choice.leads_from_reference = scene
-            new_choice.leads_to_reference = world_parent
-            new_choice.set_requires_tricks(tuple())
-            scene.set_choices_from_references(
-                tuple(list(scene.choices_from_references) +
-                      [
-                          new_choice
-                      ]
-                      )
-            )
-            world_parent.set_choices_to_references(
-                tuple(list(world_parent.choices_to_references) +
-                      [
-                          new_choice
-                      ]
-                      )
-            )
+        world_parent = world_parents.get(scene)
+        if world_parent is not None:
+            new_choice = build_hub_return_choice(scene, world_parent)
+            new_choices_from.setdefault(scene, []).append(new_choice)
+            new_choices_to.setdefault(world_parent, []).append(new_choice)
             choices.append(new_choice)
+    for scene, new_choices in new_choices_from.items():
+        scene.set_choices_from_references(scene.choices_from_references + tuple(new_choices))
+    for world_parent, new_choices in new_choices_to.items():
+        world_parent.set_choices_to_references(world_parent.choices_to_references + tuple(new_choices))
+
+
+def read_game_graph(flowchart_path: str = FLOWCHART_PATH, streaming: bool = None) -> Graph:
+    """
+    Read the canvas file
+    :param flowchart_path:  path to the Obsidian .canvas file to read
+    :param streaming:       whether to read the canvas file a piece at a time with stream_game_graph(), to keep peak
+                            memory down.  None picks streaming for files larger than STREAMING_THRESHOLD_BYTES
+    :return:                Graph object representing the full game
+    """
+    if streaming is None:
+        streaming = path.getsize(flowchart_path) > STREAMING_THRESHOLD_BYTES
+    if streaming:
+        return stream_game_graph(flowchart_path)
+
+    # Get scenes and choices from the canvas file
+    with profile_phase("load.parse"), open(flowchart_path, encoding="utf-8") as file:
+        content = json.load(file)
+    scenes = content["nodes"]
+    choices = content["edges"]
+
+    with paused_garbage_collection():
+        return build_game_graph(scenes, choices)
+
+
+def stream_game_graph(flowchart_path: str = FLOWCHART_PATH) -> Graph:
+    """
+    Read the canvas file a piece at a time, building each Scene and Choice as soon as its node or edge has been read.
+    Neither the whole file nor the whole list of node and edge dicts is ever held in memory, and fields the engine
+    doesn't use, like node positions and sizes, are dropped with their dicts.  Node ids and choice labels repeat a lot
+    across edges, so one copy of each is shared.
+    :param flowchart_path:  path to the Obsidian .canvas file to read
+    :return:                Graph object representing the full game
+    """
+    scenes = []
+    choices = []
+    strings = {}
+    with open(flowchart_path, encoding="utf-8") as file, paused_garbage_collection():
+        with profile_phase("load.parse"):
+            for key, item in iter_canvas_items(file):
+                if key == "nodes":
+                    item["id"] = strings.setdefault(item["id"], item["id"])
+                    scenes.append(build_scene_object(item))
+                else:
+                    for field in ("fromNode", "toNode", "label"):
+                        if field in item:
+                            item[field] = strings.setdefault(item[field], item[field])
+                    choices.append(build_choice_object(item))
+        del strings
+        return finish_game_graph(scenes, choices)
+
+
+def build_game_graph(scene_dicts: list, choice_dicts: list) -> Graph:
+    """
+    Build the linked game Graph from the scene and choice dicts read from the flowchart canvas file.
+    :param scene_dicts:     list of scene dicts read from the flowchart canvas file
+    :param choice_dicts:    list of choice dicts read from the flowchart canvas file
+    :return:                Graph object representing the full game
+    """
+    with profile_phase("load.build"):
+        scenes = build_scene_objects(scene_dicts)
+        choices = build_choice_objects(choice_dicts)
+    return finish_game_graph(scenes, choices)
+
+
+def finish_game_graph(scenes: list, choices: list) -> Graph:
+    """
+    Link freshly built Scene and Choice objects into the game Graph: wire up references, tricks, and hub-return
+    choices.
+    :param scenes:      list of Scene objects, as built by build_scene_objects()
+    :param choices:     list of Choice objects, as built by build_choice_objects()
+    :return:            Graph object representing the full game
+    """
+    # Link Scenes and Choices to each other
+    with profile_phase("load.link"):
+        link_graph(scenes, choices)
+
+    # Work out which tricks are given and required where
+    with profile_phase("load.tricks"):
+        for scene in scenes:
+            scene.set_gives_tricks(find_gives_tricks(scene))
+        for choice in choices:
+            choice.set_requires_tricks(find_requires_tricks(choice))
+
+    # For all Scenes, if that Scene is not a trick and is the child of a world through a sequence of choices without any blue or green choices, add a Choice to return to that world.
+    with profile_phase("load.hubs"):
+        add_hub_return_choices(scenes, choices)
 
     # Get rid of most ids and id pointers; they no longer tell the full story and are redundant with our reference pointers
     for scene in scenes:
@@ -202,5 +391,6 @@ def read_game_graph() -> Graph:
         delattr(choice, "leads_from_id")
 
     # Build the game Graph
-    game_graph = Graph(scenes, choices)
+    with profile_phase("load.precompute"):
+        game_graph = Graph(scenes, choices)
     return game_graph
@@ -1,16 +1,28 @@
 """For running the game proper"""
 
 
-from source.graph import Graph
-from source.basic_utils import make_player_choose
-from source.flowchart_syntax import trick_signifier
-from source.saving_and_loading import is_save_file_missing, is_save_data_empty, wipe_save, save, load
-from source.splash import display_splash_screen
-
-from playsound3 import playsound
+import sys
+from source.audio import INTRO_SONG_PATH, play_in_background, stop_sound
+from source.graph import Graph, Scene, Choice
+from source.metrics import count_turn, time_turn_phase
+from source.profiling import profile_phase
+from source.basic_utils import make_player_choose, format_choice_menu, read_player_choice, read_player_line, \
+    wait_for_line_or, wrap_to_screen
+from source.saving_and_loading import is_save_file_missing, is_save_data_empty, wipe_save, load, AutoSaver
+from source.search import SearchIndex, search_ship_log
+from source.splash import display_splash_screen, skip_song_prompt
 
 
 SCENE_DIVIDER = "\n" + "-" * 80 + "\n"
+CONTINUE_PROMPT = "Existing save data detected.  Welcome back, captain.  Would you like to continue your game or start over?"
+CONTINUE_OPTIONS = {"1": "Continue", "2": "Delete save data and start new game"}
+CONFIRM_WIPE_PROMPT = "Last chance -- delete your save data for good?"
+CONFIRM_WIPE_OPTIONS = {"1": "Keep my save data and continue my existing game", "2": "Delete my save data and start over"}
+HINT_KEY = "h"
+HINT_OPTION = "Ask for a hint"
+SEARCH_KEY = "s"
+SEARCH_OPTION = "Search your ship log"
+SEARCH_PROMPT = "Search your ship log for: "
 
 
 def get_initial_game_state() -> tuple:
@@ -24,10 +36,10 @@ def get_initial_game_state() -> tuple:
 
     # Else, ask the player
     print(SCENE_DIVIDER)
-    player_response = make_player_choose("Existing save data detected.  Welcome back, captain.  Would you like to continue your game or start over?", {"1": "Continue", "2": "Delete save data and start new game"})
+    player_response = make_player_choose(CONTINUE_PROMPT, CONTINUE_OPTIONS)
     if player_response == "2":
         print(SCENE_DIVIDER)
-        player_response = make_player_choose("Last chance -- delete your save data for good?", {"1": "Keep my save data and continue my existing game", "2": "Delete my save data and start over"})
+        player_response = make_player_choose(CONFIRM_WIPE_PROMPT, CONFIRM_WIPE_OPTIONS)
         if player_response == "2":
             wipe_save()
             return "", set()
@@ -35,78 +47,194 @@ def get_initial_game_state() -> tuple:
     return load()
 
 
-def run_game_main_loop(graph: Graph) -> None:
+def find_first_scene(graph: Graph) -> Scene:
+    """
+    Find the scene a new game starts at: the one that the START node points to.
+    :param graph:   Graph object representing the full game
+    :return:        the first Scene of a new game
+    """
+    # Find the START node.  Throw an error if there isn't exactly one.
+    start_nodes = []
+    for scene in graph.scenes:
+        if scene.is_start:
+            start_nodes.append(scene)
+    if len(start_nodes) != 1:
+        raise RuntimeError("number of START nodes must be exactly 1")
+    start_node = start_nodes[0]
+    del start_nodes
+
+    # Find the node that the START node points to.  Throw an error if there isn't exactly one.
+    if len(start_node.choices_from_references) != 1:
+        raise RuntimeError("the START node must point to exactly 1 scene")
+    return start_node.choices_from_references[0].leads_to_reference
+
+
+def take_choice(choice: Choice, found_mask: int) -> tuple:
+    """
+    Follow a choice to the scene it leads to, redirecting along its chain of state variants as far as the tricks found
+    allow.  Then add the tricks found at the resulting scene.
+    :param choice:          Choice the player picked
+    :param found_mask:      bitmask of tricks that have been discovered by the player
+    :return:                tuple with (the new active Scene, the new bitmask of tricks found)
+    """
+    active_scene = follow_choice(choice, found_mask)
+
+    # Unlock any tricks related to this new active scene
+    return active_scene, found_mask | active_scene.grants_mask
+
+
+def follow_choice(choice: Choice, found_mask: int) -> Scene:
+    """
+    Follow a choice to the scene it leads to, or along that scene's chain of state variants as far as the tricks
+    found allow.  Doesn't unlock any tricks; see take_choice().
+    :param choice:          Choice the player picked
+    :param found_mask:      bitmask of tricks that have been discovered by the player
+    :return:                the new active Scene
+    """
+    active_scene = choice.leads_to_reference
+
+    # Redirect to the deepest state variant of this scene whose tricks have all been found, if any
+    for required_mask, variant in active_scene.redirect_rules:
+        if found_mask & required_mask == required_mask:
+            return variant
+    return active_scene
+
+
+class GameSession:
+    """One player's game in progress: the active scene and the tricks found so far."""
+    def __init__(self, graph: Graph, starting_scene_id: str, found_tricks: set, pack=None):
+        """
+        :param graph:               Graph object representing the full game
+        :param starting_scene_id:   id of the scene to pick up the game at, or "" to start a new game
+        :param found_tricks:        set of tricks that have been discovered by the player, as strings
+        :param pack:                StoryPack whose Graph this is, to load worlds as the player enters them, or None
+        """
+        self.graph = graph
+        self.pack = pack
+        if len(starting_scene_id) == 0:     # If new game...
+            self.active_scene = find_first_scene(graph)
+        else:   # If continuing a saved game...
+            # Find the scene to make active
+            self.active_scene = graph.scene_by_id.get(starting_scene_id)
+            if self.active_scene is None and pack is not None:
+                self.active_scene = pack.find_scene(starting_scene_id)
+            if self.active_scene is None:
+                raise RuntimeError(f"Loading saved game failed; couldn't find a scene matching the scene id in save file: {starting_scene_id}")
+        if pack is not None:
+            pack.enter(self.active_scene)
+
+        # Hold found tricks as a bitmask.  Tricks in the save file that aren't in the graph are kept as they are.
+        self.found_mask = graph.tricks_to_mask(found_tricks)
+        self.unknown_tricks = {trick for trick in found_tricks if trick not in graph.trick_bits}
+        self.tricks_found = None
+        self.tricks_found_mask = None
+
+    def take_choice(self, choice: Choice) -> None:
+        """
+        Follow a choice, redirecting to a state variant and unlocking tricks as needed.
+        :param choice:  Choice the player picked
+        """
+        if self.pack is not None:
+            self.pack.enter(choice.leads_to_reference)
+            self.update_unknown_tricks()
+        with profile_phase("turn.redirect"), time_turn_phase("redirect"):
+            self.active_scene = follow_choice(choice, self.found_mask)
+        with profile_phase("turn.unlock"), time_turn_phase("unlock"):
+            self.found_mask |= self.active_scene.grants_mask
+        count_turn(self.active_scene.id)
+
+    def update_unknown_tricks(self) -> None:
+        """
+        Move found tricks that the Graph didn't have into the bitmask, once the Graph has them, e.g. after loading
+        another world or reloading the canvas.
+        """
+        if len(self.unknown_tricks) > 0:
+            self.found_mask |= self.graph.tricks_to_mask(self.unknown_tricks)
+            self.unknown_tricks = {trick for trick in self.unknown_tricks if trick not in self.graph.trick_bits}
+
+    def get_tricks_found(self) -> set:
+        """
+        Get the tricks found so far, as strings, e.g. for saving.  Only converted back from the bitmask when it has
+        changed, so the same set is returned until the player finds a new trick.
+        :return:    set of tricks that have been discovered by the player, as strings
+        """
+        if self.found_mask != self.tricks_found_mask:
+            self.tricks_found = self.graph.mask_to_tricks(self.found_mask) | self.unknown_tricks
+            self.tricks_found_mask = self.found_mask
+        return self.tricks_found
+
+
+def run_game_main_loop(graph: Graph, saver: AutoSaver = None, watcher=None, pack=None, recorder=None,
+                       hints=None) -> None:
     """
     Run the game.  Repeatedly show the user a scene and request a choice, until the game ends.  Keep track of tricks
     that the player uncovers.
-    :param graph:   Graph object representing the full game
+    :param graph:       Graph object representing the full game
+    :param saver:       AutoSaver or JournalSaver to save the game with after every action, or None for an AutoSaver
+                        that saves right away
+    :param watcher:     CanvasWatcher whose Graph this is, to reload the canvas whenever it changes, or None
+    :param pack:        StoryPack whose Graph this is, to load worlds as the player enters them, or None
+    :param recorder:    TraceRecorder to record every choice the player makes with, or None
+    :param hints:       HintIndex of this Graph, to offer the player hints with, or None
     """
+    if saver is None:
+        saver = AutoSaver()
     # Start a new game or pick up from a save
     starting_scene_id, found_tricks = get_initial_game_state()
-    if len(starting_scene_id) == 0:     # If new game...
-        # Find the START node.  Throw an error if there isn't exactly one.
-        start_nodes = []
-        for scene in graph.scenes:
-            if scene.is_start:
-                start_nodes.append(scene)
-        if len(start_nodes) != 1:
-            raise RuntimeError("number of START nodes must be exactly 1")
-        start_node = start_nodes[0]
-        del start_nodes
-
-        # Find the node that the START node points to.  Throw an error if there isn't exactly one.  Make it the active scene
-        if len(start_node.choices_from_references) != 1:
-            raise RuntimeError("the START node must point to exactly 1 scene")
-        active_scene = start_node.choices_from_references[0].leads_to_reference
-        # Title screen and play the intro song
-        display_splash_screen()
-        playsound("source/audio/Inner Wilds.mp3")
-    else:   # If continuing a saved game...
-        # Find the scene to make active
-        active_scene = None
-        for scene in graph.scenes:
-            if scene.id == starting_scene_id:
-                active_scene = scene
+    session = GameSession(graph, starting_scene_id, found_tricks, pack)
+    ship_log_index = SearchIndex()
+    if recorder is not None:
+        recorder.start(starting_scene_id, found_tricks)
+
+    # Main loop.  However it ends, even by Ctrl + C, make sure the last save gets written and the music stops.
+    intro_song = None
+    try:
+        if len(starting_scene_id) == 0:     # If new game...
+            # Title screen and the intro song, which plays in the background.  At a terminal, the game begins when
+            # the song ends, or sooner if the player presses Enter; otherwise the song plays on under the first scenes.
+            display_splash_screen()
+            intro_song = play_in_background(INTRO_SONG_PATH)
+            if intro_song is not None and sys.stdin.isatty():
+                wait_for_line_or(lambda: not intro_song.is_alive(), skip_song_prompt)
+                stop_sound(intro_song)
+
+        while True:
+            print(SCENE_DIVIDER)
+            if watcher is not None and watcher.has_changed():
+                print(watcher.reload_session(session))
+                if hints is not None:
+                    hints.refresh()
+
+            # Show the user the active scene and get the user to make a choice
+            with profile_phase("turn.render"):
+                num_to_choice, num_to_choice_text = session.active_scene.get_choice_menu(session.found_mask)
+                if hints is not None:
+                    num_to_choice_text[HINT_KEY] = HINT_OPTION
+                num_to_choice_text[SEARCH_KEY] = SEARCH_OPTION
+                prompt, menu = format_choice_menu(session.active_scene.text, num_to_choice_text)
+            with profile_phase("turn.input"):
+                player_response = read_player_choice(prompt, menu, num_to_choice_text)
+            if player_response == HINT_KEY:
+                print(wrap_to_screen(hints.get_hint_text(session.active_scene, session.found_mask)))
+                continue
+            if player_response == SEARCH_KEY:
+                print(search_ship_log(ship_log_index, session.get_tricks_found(), read_player_line(SEARCH_PROMPT)))
+                continue
+
+            # Change the active scene, redirecting to a state variant and unlocking tricks as needed
+            session.take_choice(num_to_choice[player_response])
+            if recorder is not None:
+                recorder.record(player_response, session.active_scene.id)
+
+            # If the active scene is an end scene, end the loop
+            if session.active_scene.is_end:
                 break
-        if active_scene is None:
-            raise RuntimeError(f"Loading saved game failed; couldn't find a scene matching the scene id in save file: {starting_scene_id}")
-
-    # Main loop
-    while True:
-        print(SCENE_DIVIDER)
 
-        # Show the user the active scene and get the user to make a choice
-        player_choice = active_scene.present_scene_and_make_player_choose(found_tricks)
-
-        # Change the active scene
-        active_scene = player_choice.leads_to_reference
-
-        # Redirect to a state variant of this scene if needed
-        should_redirect = True
-        if active_scene.has_state_variant():
-            for choice in active_scene.choices_to_references:
-                if choice.color == "orange" and choice.leads_from_reference.is_trick:
-                    trick = choice.leads_from_reference
-                    if trick.text[len(trick_signifier):] not in found_tricks:
-                        should_redirect = False
-        else:
-            should_redirect = False
-        if should_redirect:
-            outgoing_oranges = [choice for choice in active_scene.choices_from_references if choice.color == "orange"]
-            if len(outgoing_oranges) != 1:
-                raise RuntimeError(f"Cannot redirect to state variant of scene {active_scene.id} because does not have exactly 1 outgoing orange edge.")
-            active_scene = outgoing_oranges[0].leads_to_reference
-
-        
-        # Unlock any tricks related to this new active scene
-        for choice in active_scene.choices_from_references:
-            if choice.leads_to_reference.is_trick:
-                trick = choice.leads_to_reference.text[len(trick_signifier):]
-                found_tricks.add(trick)
-
-        # If the active scene is an end scene, end the loop
-        if active_scene.is_end:
-            break
-
-        # Save
-        save(active_scene.id, found_tricks)
+            # Save
+            with profile_phase("turn.save"), time_turn_phase("save"):
+                saver.save(session.active_scene.id, session.get_tricks_found())
+    finally:
+        stop_sound(intro_song)
+        saver.close()
+        if recorder is not None:
+            recorder.close()
@@ -2,18 +2,125 @@
 """
 
 
+from collections import deque
 from source.basic_utils import make_player_choose
+from source.flowchart_syntax import trick_signifier
 
 
 class Graph:
     """Contains the flow for the full game."""
     def __init__(self, scenes: tuple, choices: tuple):
+        """
+        :param scenes:      all Scene objects in the game
+        :param choices:     all Choice objects in the game
+        """
         self.scenes = scenes
         self.choices = choices
+        self.scene_by_id = {scene.id: scene for scene in scenes}
+        self.generation = 0     # Bumped whenever Scenes are added or removed after the Graph is built
+        for scene in scenes:
+            scene.precompute_transitions()
+
+        # Give every trick a bit, so that sets of tricks can be held as int bitmasks
+        self.trick_names = tuple()
+        self.trick_bits = {}
+        self.trick_mask_size = 0
+        trick_names = {}
+        for scene in scenes:
+            for trick in scene.gives_tricks + tuple(sorted(scene.grants_tricks | scene.redirect_requires_tricks)):
+                trick_names.setdefault(trick)
+        for choice in choices:
+            for trick in choice.requires_tricks:
+                trick_names.setdefault(trick)
+        self.add_tricks(trick_names)
+        for scene in scenes:
+            scene.precompute_trick_masks(self)
+        for choice in choices:
+            choice.precompute_trick_masks(self)
+        self.compile_redirect_rules(scenes)
+
+    def compile_redirect_rules(self, scenes) -> None:
+        """
+        Compile the redirect rules of some Scenes, and of every Scene whose chain of state variants passes through
+        them, e.g. after they changed.  Their trick masks must be up to date.
+        :param scenes:  iterable of Scene objects
+        """
+        to_compile = list(scenes)
+        found = set(to_compile)
+        fringe = deque(to_compile)
+        while len(fringe) > 0:
+            scene = fringe.popleft()
+            for choice in scene.choices_to_references:
+                source = choice.leads_from_reference
+                if choice.color == "orange" and not source.is_trick and source not in found:
+                    found.add(source)
+                    to_compile.append(source)
+                    fringe.append(source)
+        for scene in to_compile:
+            scene.compile_redirect_rules()
+
+    def add_tricks(self, tricks) -> None:
+        """
+        Give a bit to each trick that doesn't have one yet, e.g. a trick added to the canvas while the game is running.
+        Tricks that already have a bit keep it, so bitmasks made before stay valid.
+        :param tricks:  iterable of tricks, as strings
+        """
+        new_tricks = tuple(trick for trick in dict.fromkeys(tricks) if trick not in self.trick_bits)
+        for index, trick in enumerate(new_tricks, len(self.trick_names)):
+            self.trick_bits[trick] = 1 << index
+        self.trick_names += new_tricks
+        self.trick_mask_size = (len(self.trick_names) + 7) // 8
+
+    def tricks_to_mask(self, tricks) -> int:
+        """
+        Convert trick names to a bitmask.  Tricks that aren't in this graph are left out.
+        :param tricks:  iterable of tricks, as strings
+        :return:        int bitmask with the bit of every given trick set
+        """
+        mask = 0
+        for trick in tricks:
+            mask |= self.trick_bits.get(trick, 0)
+        return mask
+
+    def mask_to_tricks(self, mask: int) -> set:
+        """
+        Convert a bitmask to trick names.
+        :param mask:    int bitmask of tricks
+        :return:        set of tricks, as strings
+        """
+        tricks = set()
+        while mask:
+            lowest_bit = mask & -mask
+            tricks.add(self.trick_names[lowest_bit.bit_length() - 1])
+            mask ^= lowest_bit
+        return tricks
+
+    def pack_trick_mask(self, mask: int) -> bytes:
+        """
+        Convert a bitmask to little-endian bytes of a fixed width, trick_mask_size.  Many packed masks joined together
+        can be viewed as one 2D array, e.g. with numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, trick_mask_size)
+        :param mask:    int bitmask of tricks
+        :return:        bytes of length trick_mask_size
+        """
+        return mask.to_bytes(self.trick_mask_size, "little")
+
+    def unpack_trick_mask(self, packed: bytes) -> int:
+        """
+        Convert bytes made by pack_trick_mask() back to a bitmask.
+        :param packed:  bytes of length trick_mask_size
+        :return:        int bitmask of tricks
+        """
+        return int.from_bytes(packed, "little")
 
 
 class Scene:
     """Analogous to a node."""
+    # Scenes are kept in __slots__ rather than a __dict__, since a large canvas can have millions of them
+    __slots__ = ("id", "text", "color", "is_trick", "is_start", "is_end", "is_world",
+                 "choices_to_ids", "choices_from_ids", "choices_to_references", "choices_from_references",
+                 "gives_tricks", "visible_choices", "redirect_targets", "redirect_requires_tricks", "grants_tricks",
+                 "redirect_requires_mask", "grants_mask", "redirect_rules")
+
     def __init__(self, id: str, text: str, color: str, is_trick: bool, is_start: bool, is_end: bool):
         """
         :param id:              unique identifier
@@ -73,14 +180,88 @@ class Scene:
         """
         self.gives_tricks = tricks
 
-    def present_scene_and_make_player_choose(self, found_tricks: set):
+    def precompute_transitions(self) -> None:
         """
-        Get a choice from the player and return it.
-        :param found_tricks:        set of tricks that have been discovered by the player, as strings
+        Work out everything about arriving at and leaving this Scene that doesn't depend on the player's tricks, so
+        that each step of the game only has to do a few set operations.  Must be run once the graph is fully linked,
+        hub-return choices included.  Sets these attributes:
+        visible_choices:            choices the player can be offered here, if they have the tricks they require
+        redirect_targets:           Scenes that outgoing orange choices redirect to
+        redirect_requires_tricks:   frozenset of tricks that must all be found to redirect away from this Scene
+        grants_tricks:              frozenset of tricks the player finds on arriving at this Scene
+        """
+        self.visible_choices = tuple(choice for choice in self.choices_from_references
+                                     if choice.color != "orange" and not choice.leads_to_reference.is_trick)
+        self.redirect_targets = tuple(choice.leads_to_reference for choice in self.choices_from_references
+                                      if choice.color == "orange")
+        self.redirect_requires_tricks = frozenset(
+            choice.leads_from_reference.text[len(trick_signifier):] for choice in self.choices_to_references
+            if choice.color == "orange" and choice.leads_from_reference.is_trick
+        )
+        self.grants_tricks = frozenset(
+            choice.leads_to_reference.text[len(trick_signifier):] for choice in self.choices_from_references
+            if choice.leads_to_reference.is_trick
+        )
+
+    def precompute_trick_masks(self, graph: Graph) -> None:
+        """
+        Convert the tricks this Scene needs to redirect and grants on arrival to bitmasks.  Sets the attributes
+        redirect_requires_mask and grants_mask.
+        :param graph:   Graph that this Scene belongs to, with its trick bits assigned
+        """
+        self.redirect_requires_mask = graph.tricks_to_mask(self.redirect_requires_tricks)
+        self.grants_mask = graph.tricks_to_mask(self.grants_tricks)
+
+    def compile_redirect_rules(self) -> None:
+        """
+        Follow this Scene's chain of state variants to its end, so that arriving here resolves the whole chain with one
+        lookup.  Each hop of the chain needs the tricks of every hop before it.  Must be run once every Scene in the
+        chain has its trick masks.  Sets the attribute redirect_rules: a tuple of (required trick mask, Scene) pairs,
+        deepest state variant first.  The player is sent to the Scene of the first pair whose tricks they have all
+        found, or stays here if there's none.
+        Raises RuntimeError if a Scene in the chain doesn't have exactly 1 outgoing orange edge, or the chain loops.
+        """
+        rules = []
+        if not self.is_trick:   # Tricks are never arrived at.  Their orange edges say what redirects need them.
+            required_mask = 0
+            scene = self
+            chain = {self}
+            while len(scene.redirect_targets) > 0:
+                if len(scene.redirect_targets) != 1:
+                    raise RuntimeError(f"Cannot redirect to state variant of scene {scene.id} because does not have exactly 1 outgoing orange edge.")
+                required_mask |= scene.redirect_requires_mask
+                scene = scene.redirect_targets[0]
+                if scene in chain:
+                    raise RuntimeError(f"The state variants of scene {self.id} redirect in a loop, back to scene {scene.id}.")
+                chain.add(scene)
+                rules.append((required_mask, scene))
+        self.redirect_rules = tuple(reversed(rules))
+
+    def get_available_choices(self, found_mask: int) -> list:
+        """
+        Get the choices the player is offered at this Scene, in the order they're offered.
+        :param found_mask:          bitmask of tricks that have been discovered by the player
+        :return:                    list of Choice objects
+        """
+        return [choice for choice in self.visible_choices if choice.is_available(found_mask)]
+
+    def get_choice_menu(self, found_mask: int) -> tuple:
+        """
+        Number the choices the player is offered at this Scene, the way they're shown to the player.
+        :param found_mask:          bitmask of tricks that have been discovered by the player
+        :return:                    tuple with (dict of Choice objects by number, dict of choice texts by number)
         """
-        available_choices = [choice for choice in self.choices_from_references if choice.is_available(found_tricks) and not choice.leads_to_reference.is_trick]
+        available_choices = self.get_available_choices(found_mask)
         num_to_choice = {str(cc+1): choice for cc, choice in enumerate(available_choices)}
         num_to_choice_text = {str(cc+1): choice.text for cc, choice in enumerate(available_choices)}
+        return num_to_choice, num_to_choice_text
+
+    def present_scene_and_make_player_choose(self, found_mask: int):
+        """
+        Get a choice from the player and return it.
+        :param found_mask:          bitmask of tricks that have been discovered by the player
+        """
+        num_to_choice, num_to_choice_text = self.get_choice_menu(found_mask)
         player_response = make_player_choose(self.text, num_to_choice_text)
         return num_to_choice[player_response]
 
@@ -94,11 +275,11 @@ class Scene:
             return False, None
 
         # Search for a world that this is the child of, given the restrictions described in this function's docstring
-        visited_scenes = []
-        fringe = [self]
+        visited_scenes = {self}
+        fringe = deque([self])
         while len(fringe) > 0:
             # Pop a scene to explore from the fringe
-            to_explore = fringe.pop(0)
+            to_explore = fringe.popleft()
             # Explore that scene; get its neighbors given our restrictions
             neighbor_scenes = [choice.leads_from_reference for choice in to_explore.choices_to_references if choice.color not in ["green", "blue"]]
             # For each of these neighbors, check if it's a world.  Then if it's not in visited_scenes, add it to visited_scenes and then add it to the fringe
@@ -106,7 +287,7 @@ class Scene:
                 if scene.is_world:
                     return True, scene
                 if scene not in visited_scenes:
-                    visited_scenes.append(scene)
+                    visited_scenes.add(scene)
                     fringe.append(scene)
         return False, None
     
@@ -115,14 +296,14 @@ class Scene:
         If this Scene can be redirected to another scene under any circumstances, return True.  Else return False.
         :return:        True or False
         """
-        for choice in self.choices_from_references:
-            if choice.color == "orange":
-                return True
-        return False
+        return len(self.redirect_targets) > 0
 
 
 class Choice:
     """Analogous to an edge."""
+    __slots__ = ("id", "text", "leads_to_id", "leads_from_id", "color", "leads_to_reference", "leads_from_reference",
+                 "requires_tricks", "requires_mask")
+
     def __init__(self, id: str, text: str, leads_to_id: str, leads_from_id: str, color):
         """
         :param id:                  unique identifier
@@ -165,14 +346,16 @@ class Choice:
         """
         self.requires_tricks = tricks
 
-    def is_available(self, found_tricks: set) -> bool:
+    def precompute_trick_masks(self, graph: Graph) -> None:
+        """
+        Convert the tricks this Choice requires to a bitmask.  Sets the attribute requires_mask.
+        :param graph:   Graph that this Choice belongs to, with its trick bits assigned
+        """
+        self.requires_mask = graph.tricks_to_mask(self.requires_tricks)
+
+    def is_available(self, found_mask: int) -> bool:
         """
         Return False if this choice is barred by an unknown trick, or is a hidden redirect, else True.
-        :param found_tricks:        set of tricks that have been discovered by the player, as strings
-        """
-        if self.color == "orange":
-            return False
-        for trick in self.requires_tricks:
-            if trick not in found_tricks:
-                return False
-        return True
+        :param found_mask:          bitmask of tricks that have been discovered by the player
+        """
+        return self.color != "orange" and found_mask & self.requires_mask == self.requires_mask
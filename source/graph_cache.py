@@ -0,0 +1,214 @@
+"""For compiling the linked game Graph into a binary cache file, so that the game can start without parsing the
+flowchart canvas and linking the graph again.
+
+The cache file is a fixed-size header followed by a marshalled payload.  Scenes, choices, tricks and texts are
+referred to by compact integer indices, and the per-choice and per-scene numbers are stored as packed arrays.  The
+header records the canvas file's modification time and SHA-256 hash, so the cache is thrown out when the canvas
+changes.
+"""
+
+
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+from array import array
+from os import path
+from source.basic_utils import paused_garbage_collection
+from source.flowchart_importing import FLOWCHART_PATH, HUB_RETURN_CHOICE_STRING, read_game_graph
+from source.flowchart_syntax import trick_signifier
+from source.graph import Graph, Scene, Choice
+from source.profiling import profile_phase
+
+
+GRAPH_CACHE_PATH = path.join("source", "game_flowchart.compiled")
+CACHE_MAGIC = b"IWGRAPH\x00"
+CACHE_FORMAT_VERSION = 1
+# magic, format version, marshal version, canvas mtime in nanoseconds, canvas SHA-256 hash
+CACHE_HEADER = struct.Struct("<8sIIq32s")
+COLOR_NAMES = ("gray", "red", "orange", "yellow", "green", "blue", "purple")
+COLOR_CODES = {name: code for code, name in enumerate(COLOR_NAMES)}
+IS_TRICK_FLAG = 1
+IS_START_FLAG = 2
+IS_END_FLAG = 4
+
+
+def hash_file(file_path: str) -> bytes:
+    """
+    Get the SHA-256 hash of a file's contents.
+    :param file_path:   path to the file
+    :return:            32-byte digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def encode_graph(graph: Graph) -> tuple:
+    """
+    Flatten a linked Graph into a tuple of marshallable values, with integer indices in place of references.
+    :param graph:   Graph object to encode
+    :return:        tuple to be marshalled as the cache payload
+    """
+    strings = []
+    string_indices = {}
+
+    def intern_string(s: str) -> int:
+        if s not in string_indices:
+            string_indices[s] = len(strings)
+            strings.append(s)
+        return string_indices[s]
+
+    scene_indices = {scene: index for index, scene in enumerate(graph.scenes)}
+
+    scene_texts = array("i", (intern_string(scene.text) for scene in graph.scenes))
+    scene_colors = bytes(COLOR_CODES[scene.color] for scene in graph.scenes)
+    scene_flags = bytes(
+        (IS_TRICK_FLAG if scene.is_trick else 0) | (IS_START_FLAG if scene.is_start else 0) | (IS_END_FLAG if scene.is_end else 0)
+        for scene in graph.scenes
+    )
+    scene_gives_tricks = tuple(tuple(intern_string(trick) for trick in scene.gives_tricks) for scene in graph.scenes)
+
+    choice_texts = array("i", (intern_string(choice.text) for choice in graph.choices))
+    choice_from = array("i", (scene_indices[choice.leads_from_reference] for choice in graph.choices))
+    choice_to = array("i", (scene_indices[choice.leads_to_reference] for choice in graph.choices))
+    choice_colors = bytes(COLOR_CODES[choice.color] for choice in graph.choices)
+    choice_requires_tricks = tuple(tuple(intern_string(trick) for trick in choice.requires_tricks) for choice in graph.choices)
+
+    return (
+        (HUB_RETURN_CHOICE_STRING, trick_signifier),
+        tuple(strings),
+        tuple(scene.id for scene in graph.scenes),
+        scene_texts.tobytes(),
+        scene_colors,
+        scene_flags,
+        scene_gives_tricks,
+        choice_texts.tobytes(),
+        choice_from.tobytes(),
+        choice_to.tobytes(),
+        choice_colors,
+        choice_requires_tricks,
+    )
+
+
+def decode_graph(payload: tuple) -> Graph:
+    """
+    Rebuild a linked Graph from a tuple made by encode_graph().
+    :param payload:     tuple unmarshalled from the cache payload
+    :return:            Graph object, linked the same way read_game_graph() would link it
+    """
+    (_, strings, scene_ids, scene_texts, scene_colors, scene_flags, scene_gives_tricks,
+     choice_texts, choice_from, choice_to, choice_colors, choice_requires_tricks) = payload
+    scene_texts = array("i", scene_texts)
+    choice_texts = array("i", choice_texts)
+    choice_from = array("i", choice_from)
+    choice_to = array("i", choice_to)
+
+    # Scenes
+    scenes = []
+    for index, scene_id in enumerate(scene_ids):
+        flags = scene_flags[index]
+        scene = Scene(scene_id, strings[scene_texts[index]], COLOR_NAMES[scene_colors[index]],
+                      bool(flags & IS_TRICK_FLAG), bool(flags & IS_START_FLAG), bool(flags & IS_END_FLAG))
+        scene.set_gives_tricks(tuple(strings[trick] for trick in scene_gives_tricks[index]))
+        scenes.append(scene)
+
+    # Choices, keeping the order they had in the linked graph so that every scene's choices keep their order too
+    choices = []
+    choices_to = [[] for _ in scenes]
+    choices_from = [[] for _ in scenes]
+    for index in range(len(choice_texts)):
+        choice = Choice(None, strings[choice_texts[index]], None, None, COLOR_NAMES[choice_colors[index]])
+        delattr(choice, "id")
+        delattr(choice, "leads_to_id")
+        delattr(choice, "leads_from_id")
+        choice.set_leads_from_reference(scenes[choice_from[index]])
+        choice.set_leads_to_reference(scenes[choice_to[index]])
+        choice.set_requires_tricks(tuple(strings[trick] for trick in choice_requires_tricks[index]))
+        choices_from[choice_from[index]].append(choice)
+        choices_to[choice_to[index]].append(choice)
+        choices.append(choice)
+    for index, scene in enumerate(scenes):
+        scene.set_choices_to_references(tuple(choices_to[index]))
+        scene.set_choices_from_references(tuple(choices_from[index]))
+
+    return Graph(scenes, choices)
+
+
+def write_graph_cache(graph: Graph, flowchart_path: str = FLOWCHART_PATH, cache_path: str = GRAPH_CACHE_PATH) -> None:
+    """
+    Write a compiled Graph to the cache file, stamped with the modification time and hash of the canvas it came from.
+    The file is written to a temporary path first and then renamed, so a crash never leaves a half-written cache.
+    :param graph:           Graph object read from flowchart_path
+    :param flowchart_path:  path to the canvas file the graph was read from
+    :param cache_path:      path to the cache file to write
+    """
+    header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_FORMAT_VERSION, marshal.version,
+                               os.stat(flowchart_path).st_mtime_ns, hash_file(flowchart_path))
+    temporary_path = cache_path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(header)
+        marshal.dump(encode_graph(graph), file)
+    os.replace(temporary_path, cache_path)
+
+
+def read_graph_cache(flowchart_path: str = FLOWCHART_PATH, cache_path: str = GRAPH_CACHE_PATH):
+    """
+    Read the compiled Graph from the cache file, if there is a cache file and it is still valid for the canvas.
+    :param flowchart_path:  path to the canvas file the cache must match
+    :param cache_path:      path to the cache file
+    :return:                Graph object, or None if the cache is missing or stale
+    """
+    if not path.isfile(cache_path) or path.getsize(cache_path) <= CACHE_HEADER.size:
+        return None
+
+    with profile_phase("load.cache_read"), open(cache_path, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        magic, format_version, marshal_version, canvas_mtime_ns, canvas_hash = CACHE_HEADER.unpack_from(mapped)
+        if magic != CACHE_MAGIC or format_version != CACHE_FORMAT_VERSION or marshal_version != marshal.version:
+            return None
+        # If the canvas was touched since compiling, only trust the cache if its contents are the same.  A cache
+        # deployed without its canvas is trusted as is.
+        if path.isfile(flowchart_path) and os.stat(flowchart_path).st_mtime_ns != canvas_mtime_ns:
+            if hash_file(flowchart_path) != canvas_hash:
+                return None
+        with memoryview(mapped) as view:
+            payload = marshal.loads(view[CACHE_HEADER.size:])
+
+    if payload[0] != (HUB_RETURN_CHOICE_STRING, trick_signifier):
+        return None
+    with profile_phase("load.cache_decode"), paused_garbage_collection():
+        return decode_graph(payload)
+
+
+def compile_game_graph(flowchart_path: str = FLOWCHART_PATH, cache_path: str = GRAPH_CACHE_PATH) -> Graph:
+    """
+    Read the canvas file and write its compiled Graph to the cache file, ahead of time.
+    :param flowchart_path:  path to the canvas file
+    :param cache_path:      path to the cache file to write
+    :return:                the compiled Graph object
+    """
+    graph = read_game_graph(flowchart_path)
+    write_graph_cache(graph, flowchart_path, cache_path)
+    return graph
+
+
+def load_game_graph(flowchart_path: str = FLOWCHART_PATH, cache_path: str = GRAPH_CACHE_PATH) -> Graph:
+    """
+    Get the game Graph from the cache file if it's valid, else read the canvas file and try to refresh the cache.
+    :param flowchart_path:  path to the canvas file
+    :param cache_path:      path to the cache file
+    :return:                Graph object representing the full game
+    """
+    graph = read_graph_cache(flowchart_path, cache_path)
+    if graph is not None:
+        return graph
+    graph = read_game_graph(flowchart_path)
+    try:
+        write_graph_cache(graph, flowchart_path, cache_path)
+    except OSError:     # If the cache can't be written, e.g. on a read-only install, just go without it
+        pass
+    return graph
@@ -0,0 +1,205 @@
+"""For playing the game without a player, e.g. to load-test a story or measure how much of it gets explored.
+
+Playthroughs here use the same transitions as the real game, but never print, play audio, or touch the save file.
+Choices are made by policies: callables with the signature policy(scene, choices, step, visits, rng) -> Choice,
+where choices is the list of choices on offer, step counts the choices made so far, visits is a Counter of how many
+times each Scene has been active in this playthrough, and rng is a random.Random.  Policies must be picklable to be
+used with run_batch().
+"""
+
+
+import os
+import random
+import statistics
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from source.flowchart_importing import FLOWCHART_PATH
+from source.game_running import find_first_scene, take_choice
+from source.graph import Graph, Scene
+from source.graph_cache import load_game_graph
+
+
+MAX_STEPS = 10_000
+
+
+class RandomPolicy:
+    """Pick uniformly at random among the choices on offer."""
+    def __call__(self, scene: Scene, choices: list, step: int, visits: Counter, rng: random.Random):
+        return rng.choice(choices)
+
+
+class ScriptedPolicy:
+    """
+    Pick choices by their number in the menu, following a script, then pick at random once the script runs out.
+    Raises ValueError if the script picks a number the menu doesn't have.
+    """
+    def __init__(self, choice_numbers: list):
+        """
+        :param choice_numbers:  list of ints.  The number of the choice to pick at each step, counting from 1 like the
+                                menu shown to the player
+        """
+        self.choice_numbers = tuple(choice_numbers)
+
+    def __call__(self, scene: Scene, choices: list, step: int, visits: Counter, rng: random.Random):
+        if step < len(self.choice_numbers):
+            choice_number = self.choice_numbers[step]
+            if choice_number > len(choices):
+                raise ValueError(f"the script picks choice {choice_number} at step {step + 1}, but scene {scene.id} "
+                                 f"only offers {len(choices)}")
+            return choices[choice_number - 1]
+        return rng.choice(choices)
+
+
+class GreedyUnexploredPolicy:
+    """Pick the choice leading to the least visited scene, breaking ties at random."""
+    def __call__(self, scene: Scene, choices: list, step: int, visits: Counter, rng: random.Random):
+        fewest_visits = min(visits[choice.leads_to_reference] for choice in choices)
+        return rng.choice([choice for choice in choices if visits[choice.leads_to_reference] == fewest_visits])
+
+
+POLICIES = {
+    "random": RandomPolicy,
+    "scripted": ScriptedPolicy,
+    "greedy-unexplored": GreedyUnexploredPolicy,
+}
+
+
+def read_script(script_path: str) -> list:
+    """
+    Read a script of choices for a ScriptedPolicy.  It's laid out like a transcript piped into the game: choice
+    numbers separated by spaces or line breaks.
+    :param script_path:     path to the script file
+    :return:                list of choice numbers, as ints
+    Raises ValueError if the script holds anything but choice numbers.
+    """
+    with open(script_path, encoding="utf-8") as file:
+        words = file.read().split()
+    choice_numbers = []
+    for word in words:
+        if not word.isdigit() or int(word) == 0:
+            raise ValueError(f"{script_path} should only hold choice numbers, counting from 1, but holds {word!r}")
+        choice_numbers.append(int(word))
+    return choice_numbers
+
+
+def play_headless(graph: Graph, policy, rng: random.Random, max_steps: int = MAX_STEPS) -> tuple:
+    """
+    Play one new game from the START node until it reaches an END node, gets stuck, or runs out of steps.
+    :param graph:       Graph object representing the full game
+    :param policy:      policy callable that picks each choice
+    :param rng:         random number generator handed to the policy
+    :param max_steps:   give up after this many choices
+    :return:            tuple with (whether an END node was reached, number of choices made, Counter of Scene visits)
+    """
+    active_scene = find_first_scene(graph)
+    found_mask = 0
+    visits = Counter([active_scene])
+    for step in range(max_steps):
+        choices = active_scene.get_available_choices(found_mask)
+        if len(choices) == 0:
+            return False, step, visits
+        active_scene, found_mask = take_choice(policy(active_scene, choices, step, visits, rng), found_mask)
+        visits[active_scene] += 1
+        if active_scene.is_end:
+            return True, step + 1, visits
+    return False, max_steps, visits
+
+
+worker_graph = None
+
+
+def load_worker_graph(flowchart_path: str) -> None:
+    """
+    Load the game Graph once per worker process, for play_batch() to share across playthroughs.
+    :param flowchart_path:  path to the canvas file
+    """
+    global worker_graph
+    worker_graph = load_game_graph(flowchart_path)
+
+
+def play_batch(policy, seeds: list, max_steps: int) -> tuple:
+    """
+    Play one headless game per seed in a worker process.  Scenes are reported by id, since Scene objects don't
+    survive the trip back to the parent process.
+    :param policy:      policy callable that picks each choice
+    :param seeds:       list of seeds, one per playthrough
+    :param max_steps:   give up on a playthrough after this many choices
+    :return:            tuple with (list of step counts of playthroughs that reached an END node, number of
+                        playthroughs that didn't, Counter of visits by scene id)
+    """
+    steps_to_end = []
+    unfinished = 0
+    visits_by_id = Counter()
+    for seed in seeds:
+        reached_end, steps, visits = play_headless(worker_graph, policy, random.Random(seed), max_steps)
+        if reached_end:
+            steps_to_end.append(steps)
+        else:
+            unfinished += 1
+        for scene, count in visits.items():
+            visits_by_id[scene.id] += count
+    return steps_to_end, unfinished, visits_by_id
+
+
+def run_batch(policy, playthroughs: int, workers: int = None, max_steps: int = MAX_STEPS, seed: int = 0,
+              flowchart_path: str = FLOWCHART_PATH) -> dict:
+    """
+    Play many headless games in parallel across a pool of worker processes, and aggregate their statistics.
+    :param policy:          policy callable that picks each choice.  Must be picklable
+    :param playthroughs:    number of games to play
+    :param workers:         number of worker processes, or None for one per CPU
+    :param max_steps:       give up on a playthrough after this many choices
+    :param seed:            seed that the playthroughs' own seeds are derived from
+    :param flowchart_path:  path to the canvas file
+    :return:                dict of statistics, with keys "playthroughs", "unfinished", "steps_to_end" (a list),
+                            "visit_histogram" (a Counter by scene id), and "unreachable_scenes" (a list of scene ids
+                            that no playthrough visited)
+    """
+    graph = load_game_graph(flowchart_path)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    seeds = [seed * playthroughs + number for number in range(playthroughs)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_worker_graph, initargs=(flowchart_path,)) as executor:
+        chunk_size = max(1, playthroughs // (workers * 4))
+        chunks = [seeds[start:start + chunk_size] for start in range(0, playthroughs, chunk_size)]
+        results = executor.map(play_batch, [policy] * len(chunks), chunks, [max_steps] * len(chunks))
+
+        steps_to_end = []
+        unfinished = 0
+        visit_histogram = Counter()
+        for chunk_steps_to_end, chunk_unfinished, chunk_visits in results:
+            steps_to_end.extend(chunk_steps_to_end)
+            unfinished += chunk_unfinished
+            visit_histogram.update(chunk_visits)
+
+    unreachable_scenes = [scene.id for scene in graph.scenes
+                          if scene.id not in visit_histogram and not scene.is_trick and not scene.is_start]
+    return {
+        "playthroughs": playthroughs,
+        "unfinished": unfinished,
+        "steps_to_end": steps_to_end,
+        "visit_histogram": visit_histogram,
+        "unreachable_scenes": unreachable_scenes,
+    }
+
+
+def format_batch_statistics(batch_statistics: dict, graph: Graph) -> str:
+    """
+    Summarize the statistics from run_batch() for a person to read.
+    :param batch_statistics:    dict returned by run_batch()
+    :param graph:               Graph object the batch was played on, to look up scene text
+    :return:                    multi-line summary
+    """
+    lines = [f"Playthroughs: {batch_statistics['playthroughs']}  "
+             f"(reached an END: {len(batch_statistics['steps_to_end'])}, unfinished: {batch_statistics['unfinished']})"]
+    steps_to_end = batch_statistics["steps_to_end"]
+    if len(steps_to_end) > 0:
+        lines.append(f"Steps to END: min {min(steps_to_end)}, median {statistics.median(steps_to_end)}, "
+                     f"mean {statistics.mean(steps_to_end):.1f}, max {max(steps_to_end)}")
+    lines.append("Most visited scenes:")
+    for scene_id, count in batch_statistics["visit_histogram"].most_common(10):
+        lines.append(f"    {count:>10}  {scene_id}  {graph.scene_by_id[scene_id].text[:50]!r}")
+    lines.append(f"Scenes no playthrough visited: {len(batch_statistics['unreachable_scenes'])}")
+    for scene_id in batch_statistics["unreachable_scenes"]:
+        lines.append(f"    {scene_id}  {graph.scene_by_id[scene_id].text[:50]!r}")
+    return "\n".join(lines)
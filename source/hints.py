@@ -0,0 +1,150 @@
+"""For hinting to a stuck player where to find a trick that would open up a new choice.
+
+The hint index is built once, when the game is loaded, so that a hint takes a few table lookups however big the story
+is.  A hint only ever needs to know how far the player is from finding a trick some locked choice requires, from the
+scenes one choice away from that locked choice.  So for each trick, the index holds the fewest choices it takes to get
+from each of those scenes to a scene where the trick is found, worked out by a breadth-first search backward from all
+of the scenes where it's found at once.  The search stops as soon as every scene the index needs is settled, and the
+distances are kept in one flat array of 2-byte ints, so the index stays small however many tricks there are.
+
+Arriving at a scene counts as arriving at any of its state variants, and the search doesn't mind what tricks the way
+there needs, so distances can come out shorter than they are in play, never longer.
+"""
+
+
+from array import array
+from collections import deque
+from source.game_running import follow_choice
+from source.graph import Graph, Scene
+from source.profiling import profile_phase
+
+
+UNREACHABLE = 0xFFFF    # Distance from scenes that can't reach any scene where the trick is found
+NO_HINT = "No hints here.  Nothing you can learn from here would open up a new choice in this scene."
+
+
+class HintIndex:
+    """Distances to the nearest scene that grants each trick some choice requires, from where hints look them up."""
+    def __init__(self, graph: Graph):
+        """
+        :param graph:   Graph object representing the full game
+        """
+        self.graph = graph
+        self.generation = None          # Generation of the Graph the index was built from
+        self.slots = {}                 # Index into distances, by (trick bit, Scene)
+        self.distances = array("H")
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Rebuild the index from the Graph, e.g. after the canvas was reloaded."""
+        with profile_phase("load.hints"):
+            # The scenes a hint can look up, by trick: wherever a choice from a scene with a locked choice can lead
+            targets_by_trick = {}
+            for scene in self.graph.scenes:
+                required_mask = 0
+                for choice in scene.visible_choices:
+                    required_mask |= choice.requires_mask
+                if required_mask == 0:
+                    continue
+                targets = set()
+                for choice in scene.visible_choices:
+                    targets.add(choice.leads_to_reference)
+                    targets.update(variant for _, variant in choice.leads_to_reference.redirect_rules)
+                while required_mask:
+                    trick_bit = required_mask & -required_mask
+                    targets_by_trick.setdefault(trick_bit, set()).update(targets)
+                    required_mask ^= trick_bit
+
+            sources_by_trick = {}
+            for scene in self.graph.scenes:
+                grants_mask = scene.grants_mask
+                while grants_mask:
+                    trick_bit = grants_mask & -grants_mask
+                    if trick_bit in targets_by_trick:
+                        sources_by_trick.setdefault(trick_bit, []).append(scene)
+                    grants_mask ^= trick_bit
+
+            self.slots = {}
+            self.distances = array("H")
+            for trick_bit, targets in targets_by_trick.items():
+                distance_by_target = find_distances(sources_by_trick.get(trick_bit, ()), targets)
+                for target in targets:
+                    self.slots[trick_bit, target] = len(self.distances)
+                    self.distances.append(distance_by_target.get(target, UNREACHABLE))
+            self.generation = self.graph.generation
+
+    def find_hint(self, scene: Scene, found_mask: int) -> tuple:
+        """
+        Find the choice the player can't take yet at a scene that's closest to being unlocked, and which of the choices
+        they can take heads toward unlocking it.
+        :param scene:       the active Scene
+        :param found_mask:  bitmask of tricks that have been discovered by the player
+        :return:            tuple with (the locked Choice, the Choice to take toward it, number of choices it takes to
+                            find a trick it needs), or None if no locked choice here can be unlocked
+        """
+        if self.generation != self.graph.generation:
+            self.refresh()  # A story pack loaded or unloaded a world since the index was built
+        available_choices = scene.get_available_choices(found_mask)
+        best = None
+        for locked_choice in scene.visible_choices:
+            missing_mask = locked_choice.requires_mask & ~found_mask
+            while missing_mask:
+                trick_bit = missing_mask & -missing_mask
+                missing_mask ^= trick_bit
+                for next_choice in available_choices:
+                    slot = self.slots.get((trick_bit, follow_choice(next_choice, found_mask)))
+                    if slot is None:
+                        continue
+                    distance = self.distances[slot]
+                    if distance != UNREACHABLE and (best is None or distance + 1 < best[2]):
+                        best = (locked_choice, next_choice, distance + 1)
+        return best
+
+    def get_hint_text(self, scene: Scene, found_mask: int) -> str:
+        """
+        Put the hint for a scene into words for the player, without giving away the trick or the choice it opens up.
+        :param scene:       the active Scene
+        :param found_mask:  bitmask of tricks that have been discovered by the player
+        :return:            the hint text
+        """
+        hint = self.find_hint(scene, found_mask)
+        if hint is None:
+            return NO_HINT
+        _, next_choice, distance = hint
+        return (f"Hint: something you can learn {distance} choice{'' if distance == 1 else 's'} from here would open "
+                f"up a new choice in this scene.  Try \"{next_choice.text}\".")
+
+
+def find_distances(sources, targets: set) -> dict:
+    """
+    Search backward from the scenes where a trick is found, for the fewest choices from some target scenes to any of
+    them.  Redirects to state variants cost nothing, so they're searched first, keeping the fringe in order of distance.
+    :param sources:     iterable of the Scenes where the trick is found
+    :param targets:     set of Scenes to find the distances of
+    :return:            dict of distances by Scene, for the targets that can reach a source and any Scenes searched
+                        on the way
+    """
+    distances = {}
+    fringe = deque()
+    for scene in sources:
+        distances[scene] = 0
+        fringe.append((0, scene))
+    unsettled = len(targets)
+    while len(fringe) > 0 and unsettled > 0:
+        distance, scene = fringe.popleft()
+        if distance > distances[scene]:
+            continue    # Reached again later by a shorter way
+        if scene in targets:
+            unsettled -= 1
+        for choice in scene.choices_to_references:
+            source = choice.leads_from_reference
+            if source.is_trick:
+                continue
+            source_distance = distance if choice.color == "orange" else distance + 1
+            if source_distance < distances.get(source, UNREACHABLE):
+                distances[source] = source_distance
+                if source_distance == distance:
+                    fringe.appendleft((source_distance, source))
+                else:
+                    fringe.append((source_distance, source))
+    return distances
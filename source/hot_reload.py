@@ -0,0 +1,427 @@
+"""For reloading the flowchart canvas while the game is running, e.g. while writing a story in Obsidian and testing it.
+
+The canvas is compared with the version loaded before, node by node and edge by edge, using their ids.  Only what
+changed is relinked: the scenes touching a changed node or edge get their tricks and transitions worked out again, and
+changed scenes are updated in place, so a game in progress keeps its active scene and the tricks it found.
+
+A single edge can move the nearest world of scenes anywhere downstream of it, so worlds are found again for every
+scene downstream of a changed one, up to the next world, and only the hub-return choices whose world changed are
+replaced.  To pick the search up there rather than search the whole story, the watcher keeps how far each scene is
+from its world.  Only parsing still covers the whole story on every reload, since the JSON can't be read in part.
+"""
+
+
+import heapq
+import itertools
+import json
+import os
+import time
+from collections import deque
+from source.basic_utils import paused_garbage_collection
+from source.flowchart_importing import FLOWCHART_PATH, build_choice_object, build_game_graph, build_hub_return_choice, \
+    build_scene_object, check_redirect_chains, find_gives_tricks, find_requires_tricks
+from source.game_running import GameSession, find_first_scene
+from source.profiling import profile_phase
+
+
+# Attributes of a Scene that come from its node alone, copied onto the existing Scene when its node changes
+NODE_ATTRIBUTES = ("text", "color", "is_trick", "is_start", "is_end", "is_world")
+
+
+def read_canvas(flowchart_path: str) -> dict:
+    """
+    Read a canvas file.
+    :param flowchart_path:  path to the canvas file
+    :return:                dict with keys "nodes" and "edges", both lists of dicts
+    """
+    with open(flowchart_path, encoding="utf-8") as file:
+        content = json.load(file)
+    return {"nodes": content.get("nodes", []), "edges": content.get("edges", [])}
+
+
+def get_file_signature(flowchart_path: str) -> tuple:
+    """
+    Get what's needed to notice a file has changed, without reading it.
+    :param flowchart_path:  path to the file
+    :return:                tuple with (modification time in nanoseconds, size in bytes)
+    """
+    stat = os.stat(flowchart_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_node_signature(node: dict) -> tuple:
+    """
+    Get everything about a canvas node that matters to the game, to tell whether it changed.
+    :param node:    node dict from the canvas
+    :return:        tuple with (text, color number)
+    """
+    return node["text"], node.get("color")
+
+
+def get_edge_signature(edge: dict) -> tuple:
+    """
+    Get everything about a canvas edge that matters to the game, to tell whether it changed.
+    :param edge:    edge dict from the canvas
+    :return:        tuple with (from node id, to node id, label, color number)
+    """
+    return edge["fromNode"], edge["toNode"], edge.get("label"), edge.get("color")
+
+
+def remove_choices(choices: tuple, removed: set) -> tuple:
+    """
+    Remove choices from a tuple of choices.
+    :param choices:     tuple of Choice objects
+    :param removed:     set of Choice objects to remove
+    :return:            new tuple of Choice objects
+    """
+    return tuple(choice for choice in choices if choice not in removed)
+
+
+def find_world_distances(scenes: list) -> dict:
+    """
+    Find the nearest world of every Scene, with the same search as find_world_parents(), but keep how far each Scene
+    is from its world too, so that the search can be picked up again for part of the story.
+    :param scenes:  list of linked Scene objects, in canvas order
+    :return:        dict mapping each Scene the search reached, worlds included, to a tuple with (its world Scene, the
+                    number of choices from the world to it)
+    """
+    distances = {}
+    fringe = deque()
+    for scene in scenes:
+        if scene.is_world:
+            distances[scene] = (scene, 0)
+            fringe.append(scene)
+    while len(fringe) > 0:
+        to_explore = fringe.popleft()
+        world, distance = distances[to_explore]
+        for choice in to_explore.choices_from_references:
+            neighbor = choice.leads_to_reference
+            if choice.color not in ("green", "blue") and neighbor not in distances:
+                distances[neighbor] = (world, distance + 1)
+                fringe.append(neighbor)
+    return distances
+
+
+
+class CanvasWatcher:
+    """Loads the game Graph from a canvas file, then keeps it up to date with changes to the file."""
+    def __init__(self, flowchart_path: str = FLOWCHART_PATH):
+        """
+        :param flowchart_path:  path to the canvas file to load and watch
+        """
+        self.flowchart_path = flowchart_path
+        self.file_signature = get_file_signature(flowchart_path)
+        content = read_canvas(flowchart_path)
+        with paused_garbage_collection():
+            self.graph = build_game_graph(content["nodes"], content["edges"])
+
+        # What each node and edge looked like, and the Choice each edge became.  The Graph's choices start with one per
+        # edge, in canvas order, followed by the hub-return choices.
+        self.node_signatures = {node["id"]: get_node_signature(node) for node in content["nodes"]}
+        self.edge_signatures = {edge["id"]: get_edge_signature(edge) for edge in content["edges"]}
+        self.choice_by_edge_id = {edge["id"]: choice for edge, choice in zip(content["edges"], self.graph.choices)}
+        self.edge_id_by_choice = {choice: edge_id for edge_id, choice in self.choice_by_edge_id.items()}
+        self.hub_returns = {choice.leads_from_reference: choice
+                            for choice in self.graph.choices[len(content["edges"]):]}
+        self.edge_order = {edge["id"]: index for index, edge in enumerate(content["edges"])}
+        self.node_order = {node["id"]: index for index, node in enumerate(content["nodes"])}
+        self.world_distances = find_world_distances(sorted(self.graph.scenes,
+                                                           key=lambda scene: self.node_order[scene.id]))
+
+    def has_changed(self) -> bool:
+        """
+        Check whether the canvas file has been written to since it was last loaded.
+        :return:    True or False
+        """
+        try:
+            return get_file_signature(self.flowchart_path) != self.file_signature
+        except OSError:     # E.g. the file is being replaced right now.  Check again later.
+            return False
+
+    def reload(self) -> str:
+        """
+        Bring the Graph up to date with the canvas file, relinking only what changed.  If the canvas can't be loaded,
+        the Graph is left as it was.
+        :return:    summary of what changed, for the author to read
+        """
+        start = time.perf_counter()
+        self.file_signature = get_file_signature(self.flowchart_path)
+        content = read_canvas(self.flowchart_path)
+        nodes = {node["id"]: node for node in content["nodes"]}
+        edges = {edge["id"]: edge for edge in content["edges"]}
+
+        # Compare with the canvas as it was
+        removed_node_ids = [node_id for node_id in self.node_signatures if node_id not in nodes]
+        added_node_ids = [node_id for node_id in nodes if node_id not in self.node_signatures]
+        changed_node_ids = [node_id for node_id, node in nodes.items() if node_id in self.node_signatures
+                            and get_node_signature(node) != self.node_signatures[node_id]]
+        removed_edge_ids = [edge_id for edge_id in self.edge_signatures if edge_id not in edges]
+        added_edge_ids = [edge_id for edge_id in edges if edge_id not in self.edge_signatures]
+        changed_edge_ids = [edge_id for edge_id, edge in edges.items() if edge_id in self.edge_signatures
+                            and get_edge_signature(edge) != self.edge_signatures[edge_id]]
+        if not (removed_node_ids or added_node_ids or changed_node_ids or removed_edge_ids or added_edge_ids or changed_edge_ids):
+            return f"Reloaded {self.flowchart_path}: nothing the game uses changed."
+
+        # Build the new Scenes and Choices, and check every edge still has both its nodes and every chain of state
+        # variants can be compiled, before touching the Graph.  That way a canvas that can't be loaded leaves the game
+        # as it was.
+        new_scenes = {node_id: build_scene_object(nodes[node_id]) for node_id in added_node_ids + changed_node_ids}
+        new_choices = {edge_id: build_choice_object(edges[edge_id]) for edge_id in added_edge_ids + changed_edge_ids}
+        for edge_id, edge in edges.items():
+            for node_id in (edge["fromNode"], edge["toNode"]):
+                if node_id not in nodes:
+                    raise ValueError(f"edge {edge_id} points at node {node_id}, which isn't in the canvas")
+        variant_ids = {}
+        for edge in edges.values():
+            if edge.get("color") == "2":
+                from_scene = new_scenes.get(edge["fromNode"]) or self.graph.scene_by_id[edge["fromNode"]]
+                if not from_scene.is_trick:
+                    variant_ids.setdefault(edge["fromNode"], []).append(edge["toNode"])
+        check_redirect_chains(variant_ids)
+
+        self.edge_order = {edge_id: index for index, edge_id in enumerate(edges)}
+        self.node_order = {node_id: index for index, node_id in enumerate(nodes)}
+        with profile_phase("reload"):
+            relinked = self.apply_changes(new_scenes, new_choices, set(removed_node_ids), removed_edge_ids,
+                                          changed_node_ids, changed_edge_ids)
+        self.node_signatures = {node_id: get_node_signature(node) for node_id, node in nodes.items()}
+        self.edge_signatures = {edge_id: get_edge_signature(edge) for edge_id, edge in edges.items()}
+
+        milliseconds = (time.perf_counter() - start) * 1000
+        return (f"Reloaded {self.flowchart_path} in {milliseconds:.0f} ms: "
+                f"{len(added_node_ids)} scenes added, {len(changed_node_ids)} changed, {len(removed_node_ids)} removed; "
+                f"{len(added_edge_ids)} choices added, {len(changed_edge_ids)} changed, {len(removed_edge_ids)} removed; "
+                f"{relinked} scenes relinked.")
+
+    def apply_changes(self, new_scenes: dict, new_choices: dict, removed_node_ids: set, removed_edge_ids: list,
+                      changed_node_ids: list, changed_edge_ids: list) -> int:
+        """
+        Change the Graph to match the canvas.  Used by reload(), once the canvas is known to be loadable.
+        :param new_scenes:          dict of Scene objects built from added and changed nodes, by node id
+        :param new_choices:         dict of Choice objects built from added and changed edges, by edge id
+        :param removed_node_ids:    set of ids of removed nodes
+        :param removed_edge_ids:    list of ids of removed edges
+        :param changed_node_ids:    list of ids of changed nodes
+        :param changed_edge_ids:    list of ids of changed edges
+        :return:                    number of scenes relinked
+        """
+        graph = self.graph
+        scene_by_id = graph.scene_by_id
+        touched = set()     # Scenes whose choices, or whose neighbors, changed
+
+        # Unlink removed edges, and the old versions of changed edges.  Changed edges get a new Choice.
+        removed_choices = set()
+        for edge_id in removed_edge_ids + changed_edge_ids:
+            choice = self.choice_by_edge_id.pop(edge_id)
+            del self.edge_id_by_choice[choice]
+            removed_choices.add(choice)
+            touched.add(choice.leads_from_reference)
+            touched.add(choice.leads_to_reference)
+        for scene in touched:
+            scene.set_choices_from_references(remove_choices(scene.choices_from_references, removed_choices))
+            scene.set_choices_to_references(remove_choices(scene.choices_to_references, removed_choices))
+
+        # Remove scenes whose nodes were removed.  Their edges were all removed too.
+        removed_scenes = set()
+        for node_id in removed_node_ids:
+            scene = scene_by_id.pop(node_id)
+            removed_scenes.add(scene)
+            hub_return = self.hub_returns.pop(scene, None)
+            if hub_return is not None:
+                removed_choices.add(hub_return)
+                world = hub_return.leads_to_reference
+                world.set_choices_to_references(remove_choices(world.choices_to_references, {hub_return}))
+                touched.add(world)
+        touched -= removed_scenes
+
+        # Update changed scenes in place, so that anything holding them, like the active game, stays valid
+        for node_id in changed_node_ids:
+            scene = scene_by_id[node_id]
+            for attribute in NODE_ATTRIBUTES:
+                setattr(scene, attribute, getattr(new_scenes[node_id], attribute))
+            touched.add(scene)
+            touched.update(choice.leads_from_reference for choice in scene.choices_to_references)
+            touched.update(choice.leads_to_reference for choice in scene.choices_from_references)
+
+        # Add scenes for added nodes, then link added edges and the new versions of changed edges
+        added_scenes = []
+        for node_id, scene in new_scenes.items():
+            if node_id not in scene_by_id:
+                scene.set_choices_to_references(tuple())
+                scene.set_choices_from_references(tuple())
+                scene_by_id[node_id] = scene
+                added_scenes.append(scene)
+                touched.add(scene)
+        added_choices = []
+        for edge_id, choice in new_choices.items():
+            from_scene = scene_by_id[choice.leads_from_id]
+            to_scene = scene_by_id[choice.leads_to_id]
+            choice.set_leads_from_reference(from_scene)
+            choice.set_leads_to_reference(to_scene)
+            for attribute in ("id", "leads_to_id", "leads_from_id"):
+                delattr(choice, attribute)
+            from_scene.set_choices_from_references(from_scene.choices_from_references + (choice,))
+            to_scene.set_choices_to_references(to_scene.choices_to_references + (choice,))
+            self.choice_by_edge_id[edge_id] = choice
+            self.edge_id_by_choice[choice] = edge_id
+            added_choices.append(choice)
+            touched.add(from_scene)
+            touched.add(to_scene)
+
+        # Put choices back in the order a full load would give them: canvas edges in canvas order, then hub returns.
+        self.sort_choices(touched)
+
+        # Work out the world of every scene downstream of the changes again, and swap the hub-return choices that changed
+        for scene in removed_scenes:
+            self.world_distances.pop(scene, None)
+        searched = sorted(self.find_worlds_again(touched), key=lambda scene: self.node_order[scene.id])
+        rehubbed = set()
+        for scene in searched:
+            world = None
+            if not (scene.is_world or scene.is_trick) and scene in self.world_distances:
+                world = self.world_distances[scene][0]
+            hub_return = self.hub_returns.get(scene)
+            old_world = hub_return.leads_to_reference if hub_return is not None else None
+            if old_world is world:
+                continue
+            if hub_return is not None:
+                del self.hub_returns[scene]
+                removed_choices.add(hub_return)
+                old_world.set_choices_to_references(remove_choices(old_world.choices_to_references, {hub_return}))
+                scene.set_choices_from_references(remove_choices(scene.choices_from_references, {hub_return}))
+                rehubbed.add(old_world)
+            if world is not None:
+                hub_return = build_hub_return_choice(scene, world)
+                self.hub_returns[scene] = hub_return
+                scene.set_choices_from_references(scene.choices_from_references + (hub_return,))
+                world.set_choices_to_references(world.choices_to_references + (hub_return,))
+                added_choices.append(hub_return)
+                rehubbed.add(world)
+            rehubbed.add(scene)
+        self.sort_choices(rehubbed)
+        touched |= rehubbed
+
+        # Work out tricks and transitions again for the touched scenes and the choices leading away from them
+        for scene in touched:
+            scene.set_gives_tricks(find_gives_tricks(scene))
+            for choice in scene.choices_from_references:
+                if choice not in self.edge_id_by_choice:
+                    continue    # Hub-return choices never require tricks
+                choice.set_requires_tricks(find_requires_tricks(choice))
+        for scene in touched:
+            scene.precompute_transitions()
+            graph.add_tricks(scene.gives_tricks + tuple(sorted(scene.grants_tricks | scene.redirect_requires_tricks)))
+            for choice in scene.choices_from_references:
+                graph.add_tricks(choice.requires_tricks)
+        for scene in touched:
+            scene.precompute_trick_masks(graph)
+            for choice in scene.choices_from_references:
+                choice.precompute_trick_masks(graph)
+        graph.compile_redirect_rules(touched)
+
+        # Keep the Graph's lists of scenes and choices complete
+        if len(removed_scenes) > 0:
+            graph.scenes[:] = [scene for scene in graph.scenes if scene not in removed_scenes]
+        graph.scenes.extend(added_scenes)
+        if len(removed_choices) > 0:
+            graph.choices[:] = [choice for choice in graph.choices if choice not in removed_choices]
+        graph.choices.extend(added_choices)
+        graph.generation += 1
+        return len(touched)
+
+    def find_worlds_again(self, touched: set) -> set:
+        """
+        Find the world of every scene whose world may have changed again: the scenes downstream of the touched scenes,
+        through choices that aren't blue or green, up to the next world.  A world that wasn't touched is its own world,
+        and any way through it is longer than the way from it, so nothing past it can change.
+
+        The search is picked up from the scenes outside that region which lead into it, in order of distance from their
+        world.  The load-time search goes through the scenes at each distance grouped by world, in the canvas order of
+        the worlds, so where two worlds are equally near, the one first in the canvas wins.  Hub-return choices aren't
+        followed: a full load searches before adding them, and the ones leading to a scene that is no longer a world
+        haven't been swapped yet.
+        :param touched:     set of Scenes whose choices, or whose neighbors, changed
+        :return:            set of Scenes whose world was found again
+        """
+        distances = self.world_distances
+        region = set(touched)
+        fringe = deque(touched)
+        while len(fringe) > 0:
+            scene = fringe.popleft()
+            for choice in scene.choices_from_references:
+                neighbor = choice.leads_to_reference
+                if self.is_searched(choice) and neighbor not in region and not neighbor.is_world:
+                    region.add(neighbor)
+                    fringe.append(neighbor)
+
+        # Queue the worlds in the region and the ways into it from outside, then search outward from the nearest
+        queue = []
+        order = itertools.count()   # Breaks ties in the heap, which can't compare Scenes
+        for scene in region:
+            distances.pop(scene, None)
+        for scene in region:
+            if scene.is_world:
+                queue.append((0, self.node_order[scene.id], next(order), scene, scene))
+                continue
+            for choice in scene.choices_to_references:
+                parent = choice.leads_from_reference
+                if self.is_searched(choice) and parent not in region and parent in distances:
+                    world, distance = distances[parent]
+                    queue.append((distance + 1, self.node_order[world.id], next(order), scene, world))
+        heapq.heapify(queue)
+        while len(queue) > 0:
+            distance, world_order, _, scene, world = heapq.heappop(queue)
+            if scene in distances:
+                continue
+            distances[scene] = (world, distance)
+            for choice in scene.choices_from_references:
+                neighbor = choice.leads_to_reference
+                if self.is_searched(choice) and neighbor in region and neighbor not in distances:
+                    heapq.heappush(queue, (distance + 1, world_order, next(order), neighbor, world))
+        return region
+
+    def is_searched(self, choice) -> bool:
+        """
+        Tell whether the search for worlds follows a Choice: a canvas edge that isn't blue or green.
+        :param choice:  linked Choice object
+        :return:        True or False
+        """
+        return choice.color not in ("green", "blue") and choice in self.edge_id_by_choice
+
+    def sort_choices(self, scenes: set) -> None:
+        """
+        Put the choices of some scenes in the order a full load of the canvas would give them: canvas edges in canvas
+        order, then hub-return choices.
+        :param scenes:  set of Scene objects
+        """
+        for scene in scenes:
+            scene.set_choices_from_references(tuple(sorted(scene.choices_from_references, key=self.get_choice_order)))
+            scene.set_choices_to_references(tuple(sorted(scene.choices_to_references, key=self.get_choice_order)))
+
+    def get_choice_order(self, choice) -> tuple:
+        """
+        Sort key putting choices in the order a full load of the canvas would give them.
+        :param choice:  Choice object
+        :return:        sort key
+        """
+        edge_id = self.edge_id_by_choice.get(choice)
+        if edge_id is not None:
+            return 0, self.edge_order[edge_id]
+        return 1, self.node_order[choice.leads_from_reference.id]
+
+    def reload_session(self, session: GameSession) -> str:
+        """
+        Reload the canvas for a game in progress.  The game keeps its active scene and the tricks it found, unless the
+        active scene was removed, in which case it goes back to the first scene.
+        :param session:     the GameSession being played on this watcher's Graph
+        :return:            summary of what happened, for the author to read
+        """
+        try:
+            summary = self.reload()
+        except (OSError, ValueError, KeyError, TypeError, RuntimeError) as error:
+            return f"Couldn't reload {self.flowchart_path}, so the story is unchanged: {error!r}"
+        session.update_unknown_tricks()
+        if self.graph.scene_by_id.get(session.active_scene.id) is not session.active_scene:
+            session.active_scene = find_first_scene(self.graph)
+            summary += "  The active scene was removed, so the game went back to the first scene."
+        return summary
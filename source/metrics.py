@@ -0,0 +1,263 @@
+"""For watching a hosted game live: how many turns players take, how long each step of a turn and each save takes,
+and which scenes players pile up in.
+
+Metrics are off until start_metrics() is called.  Until then, the timers hand back one shared do-nothing context
+manager and the counters return right away, so they cost next to nothing in normal play.  serve_metrics() exposes them
+over HTTP in the Prometheus text format, at /metrics.
+
+Recording never takes a lock.  Each thread records into its own shard of counters and histogram buckets, and the
+shards are only added up when the metrics are scraped, so turns on the server's event loop never wait on saves being
+timed on worker threads.  A scrape can miss a recording made while it runs; the next scrape has it.
+
+Metrics:
+inner_wilds_turns_total             counter of choices taken by every player.  rate() of it is turns per second
+inner_wilds_scene_visits_total      counter of arrivals at each scene, after any redirect, by scene id
+inner_wilds_turn_phase_seconds      histogram of the time spent in each step of a turn: redirect, unlock and save
+inner_wilds_save_seconds            histogram of the time taken to write a save file
+inner_wilds_start_time_seconds      gauge of when metrics were started, in seconds since the Unix epoch
+"""
+
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Upper bounds of the histogram buckets, in seconds, from 10 microseconds up to 10 seconds
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_HELP = {
+    "inner_wilds_turns_total": ("counter", "Choices taken by every player."),
+    "inner_wilds_scene_visits_total": ("counter", "Arrivals at each scene, after any redirect to a state variant."),
+    "inner_wilds_turn_phase_seconds": ("histogram", "Time spent in each step of a turn."),
+    "inner_wilds_save_seconds": ("histogram", "Time taken to write a save file."),
+    "inner_wilds_start_time_seconds": ("gauge", "When metrics were started, in seconds since the Unix epoch."),
+}
+
+NO_METRICS = nullcontext()
+
+active_metrics = None
+
+
+class MetricsShard:
+    """The counters and histograms recorded by one thread."""
+    def __init__(self):
+        self.turns = 0
+        self.scene_visits = {}      # Number of arrivals, by scene id
+        self.histograms = {}        # List of counts per bucket with the sum of the values last, by (name, labels)
+
+
+class HistogramTimer:
+    """Times the body of a with block into a histogram.  A plain class rather than a generator, to time every turn."""
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name: str, labels: tuple):
+        """
+        :param metrics:     the Metrics to record into
+        :param name:        name of the histogram
+        :param labels:      tuple of (label name, label value) pairs
+        """
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception_info) -> None:
+        self.metrics.observe(self.name, self.labels, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """Collects counters and histograms from every thread, and lays them out for scraping."""
+    def __init__(self):
+        self.start_time = time.time()
+        self.shards = []
+        self.shards_lock = threading.Lock()     # Only taken the first time a thread records, and to list the shards
+        self.local = threading.local()
+
+    def get_shard(self) -> MetricsShard:
+        """
+        Get the shard the calling thread records into, creating it the first time.
+        :return:    the thread's MetricsShard
+        """
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = MetricsShard()
+            with self.shards_lock:
+                self.shards.append(shard)
+            self.local.shard = shard
+            return shard
+
+    def count_turn(self, scene_id: str) -> None:
+        """
+        Count one choice taken, and the arrival at the scene it led to.
+        :param scene_id:    id of the scene the choice led to, after any redirect
+        """
+        shard = self.get_shard()
+        shard.turns += 1
+        shard.scene_visits[scene_id] = shard.scene_visits.get(scene_id, 0) + 1
+
+    def observe(self, name: str, labels: tuple, seconds: float) -> None:
+        """
+        Add one value to a histogram.
+        :param name:        name of the histogram
+        :param labels:      tuple of (label name, label value) pairs
+        :param seconds:     the value
+        """
+        histograms = self.get_shard().histograms
+        buckets = histograms.get((name, labels))
+        if buckets is None:
+            buckets = histograms[name, labels] = [0] * (len(LATENCY_BUCKETS) + 2)
+        buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        buckets[-1] += seconds
+
+    def get_totals(self) -> tuple:
+        """
+        Add up the shards of every thread.
+        :return:    tuple with (number of turns, dict of scene visits by scene id, dict of histogram bucket lists by
+                    (name, labels), as kept by MetricsShard)
+        """
+        with self.shards_lock:
+            shards = list(self.shards)
+        turns = 0
+        scene_visits = {}
+        histograms = {}
+        for shard in shards:
+            turns += shard.turns
+            for scene_id, visits in list(shard.scene_visits.items()):
+                scene_visits[scene_id] = scene_visits.get(scene_id, 0) + visits
+            for key, buckets in list(shard.histograms.items()):
+                total = histograms.setdefault(key, [0] * len(buckets))
+                for index, value in enumerate(list(buckets)):
+                    total[index] += value
+        return turns, scene_visits, histograms
+
+    def format_prometheus(self) -> str:
+        """
+        Lay out every metric in the Prometheus text exposition format.
+        :return:    the metrics, one sample to a line
+        """
+        turns, scene_visits, histograms = self.get_totals()
+        lines = []
+        add_metric_header(lines, "inner_wilds_turns_total")
+        lines.append(f"inner_wilds_turns_total {turns}")
+        add_metric_header(lines, "inner_wilds_scene_visits_total")
+        for scene_id, visits in sorted(scene_visits.items()):
+            lines.append(f"inner_wilds_scene_visits_total{format_labels((('scene', scene_id),))} {visits}")
+        for name in ("inner_wilds_turn_phase_seconds", "inner_wilds_save_seconds"):
+            add_metric_header(lines, name)
+            for (histogram_name, labels), buckets in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                count = 0
+                for upper_bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+                    count += bucket_count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(upper_bound)),))} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {buckets[-1]!r}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        add_metric_header(lines, "inner_wilds_start_time_seconds")
+        lines.append(f"inner_wilds_start_time_seconds {self.start_time!r}")
+        return "\n".join(lines) + "\n"
+
+
+def add_metric_header(lines: list, name: str) -> None:
+    """
+    Add the HELP and TYPE lines that come before a metric's samples.
+    :param lines:   list of lines to add to
+    :param name:    name of the metric, as in METRIC_HELP
+    """
+    metric_type, help_text = METRIC_HELP[name]
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+
+
+def format_labels(labels: tuple) -> str:
+    """
+    Lay out the labels of a sample, escaping their values.
+    :param labels:  tuple of (label name, label value) pairs
+    :return:        the labels in braces, or "" if there are none
+    """
+    if len(labels) == 0:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f"{name}=\"{value}\"" for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def start_metrics() -> Metrics:
+    """
+    Start recording metrics from now on.
+    :return:    the Metrics that collects them
+    """
+    global active_metrics
+    active_metrics = Metrics()
+    return active_metrics
+
+
+def count_turn(scene_id: str) -> None:
+    """
+    Count one choice taken, and the arrival at the scene it led to, if metrics have been started.
+    :param scene_id:    id of the scene the choice led to, after any redirect
+    """
+    if active_metrics is not None:
+        active_metrics.count_turn(scene_id)
+
+
+def time_turn_phase(phase: str):
+    """
+    Get a context manager that times its with block as one step of a turn, if metrics have been started.
+    :param phase:   name of the step: "redirect", "unlock" or "save"
+    :return:        context manager
+    """
+    if active_metrics is None:
+        return NO_METRICS
+    return HistogramTimer(active_metrics, "inner_wilds_turn_phase_seconds", (("phase", phase),))
+
+
+def time_save():
+    """
+    Get a context manager that times its with block as writing one save file, if metrics have been started.
+    :return:    context manager
+    """
+    if active_metrics is None:
+        return NO_METRICS
+    return HistogramTimer(active_metrics, "inner_wilds_save_seconds", ())
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Answers scrapes of METRICS_PATH with the active metrics."""
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != METRICS_PATH or active_metrics is None:
+            self.send_error(404)
+            return
+        body = active_metrics.format_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass    # Scrapes would otherwise be logged over the game
+
+
+def serve_metrics(port: int, host: str = DEFAULT_METRICS_HOST) -> ThreadingHTTPServer:
+    """
+    Start metrics, and serve them over HTTP on a background thread until the program exits.
+    :param port:    TCP port to serve the metrics on
+    :param host:    interface to serve the metrics on
+    :return:        the HTTP server, already serving
+    """
+    start_metrics()
+    http_server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    http_server.daemon_threads = True
+    threading.Thread(target=http_server.serve_forever, name="MetricsServer", daemon=True).start()
+    return http_server
@@ -0,0 +1,137 @@
+"""For measuring where the game spends its time, while loading the flowchart and on every turn.
+
+Code to be measured is wrapped in `with profile_phase("name"):`.  Until start_profiling() is called, that hands back
+one shared do-nothing context manager, so the phases cost next to nothing in normal play.  Once profiling, every run
+of a phase is timed, and the timings can be written as a JSON report and summarized as a table.
+
+Phases are named "load.*" for reading and linking the flowchart, and "turn.*" for each turn of the game:
+load.parse          reading the canvas JSON.  When the canvas is streamed, this includes building the objects
+load.build          building Scene and Choice objects from the canvas dicts
+load.link           linking Scenes and Choices to each other by id
+load.tricks         working out which tricks each Scene gives and each Choice requires
+load.hubs           finding each Scene's world and adding hub-return choices
+load.precompute     building the Graph: per-scene transition tables and trick bitmasks
+load.cache_read     reading and checking the compiled graph cache file
+load.cache_decode   building the Graph from the compiled graph cache
+load.world          loading and linking one world's canvas of a story pack, parsing included
+load.hints          building the hint index: distances to where the tricks that lock choices are found
+load.search         reading the search index, and updating it if the canvas changed, with --search
+turn.render         numbering the available choices and laying out the scene text and menu
+turn.input          waiting for the player to pick a valid choice
+turn.redirect       following the choice, and redirecting to a state variant if needed
+turn.unlock         adding the tricks found at the new scene
+turn.save           saving the game
+reload              relinking the Graph after the canvas changed, with --watch
+"""
+
+
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+
+NO_PROFILING = nullcontext()
+
+active_profiler = None
+
+
+class Profiler:
+    """Collects the timings of every run of every phase."""
+    def __init__(self):
+        self.timings = {}
+        self.context = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time the body of a with block as one run of a phase.
+        :param name:    name of the phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        Record one run of a phase that was timed some other way.
+        :param name:        name of the phase
+        :param seconds:     how long it took
+        """
+        self.timings.setdefault(name, []).append(seconds)
+
+    def get_report(self) -> dict:
+        """
+        Summarize the timings of every phase.
+        :return:    dict with keys "context" (anything stored in the context attribute, e.g. which canvas was loaded)
+                    and "phases" (a dict by phase name of dicts with keys "count", "total_seconds", "mean_seconds",
+                    "p50_seconds", "p99_seconds" and "max_seconds")
+        """
+        phases = {}
+        for name, timings in self.timings.items():
+            ordered = sorted(timings)
+            phases[name] = {
+                "count": len(ordered),
+                "total_seconds": sum(ordered),
+                "mean_seconds": sum(ordered) / len(ordered),
+                "p50_seconds": get_percentile(ordered, 50),
+                "p99_seconds": get_percentile(ordered, 99),
+                "max_seconds": ordered[-1],
+            }
+        return {"context": self.context, "phases": phases}
+
+    def write_report(self, report_path: str) -> None:
+        """
+        Write the report from get_report() to a JSON file.
+        :param report_path:     path of the file to write
+        """
+        with open(report_path, "w", encoding="utf-8") as file:
+            json.dump(self.get_report(), file, indent=2)
+            file.write("\n")
+
+
+def get_percentile(ordered: list, percentile: float) -> float:
+    """
+    Get a percentile of some numbers by the nearest-rank method.
+    :param ordered:         non-empty list of numbers, sorted from smallest to largest
+    :param percentile:      percentile to get, from 0 to 100
+    :return:                the smallest number that at least that percent of the numbers are less than or equal to
+    """
+    rank = -(-len(ordered) * percentile // 100)     # Rounded up
+    return ordered[max(0, int(rank) - 1)]
+
+
+def start_profiling() -> Profiler:
+    """
+    Start timing every phase from now on.
+    :return:    the Profiler that collects the timings
+    """
+    global active_profiler
+    active_profiler = Profiler()
+    return active_profiler
+
+
+def profile_phase(name: str):
+    """
+    Get a context manager that times its with block as one run of a phase, if profiling has been started.
+    :param name:    name of the phase
+    :return:        context manager
+    """
+    if active_profiler is None:
+        return NO_PROFILING
+    return active_profiler.phase(name)
+
+
+def format_profile_report(report: dict) -> str:
+    """
+    Lay out the report from Profiler.get_report() as a table for a person to read.
+    :param report:  dict returned by Profiler.get_report()
+    :return:        multi-line table, with times in milliseconds
+    """
+    lines = [f"{'phase':<20}{'count':>8}{'total ms':>12}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for name, phase in sorted(report["phases"].items()):
+        lines.append(f"{name:<20}{phase['count']:>8}{phase['total_seconds'] * 1000:>12.2f}"
+                     f"{phase['mean_seconds'] * 1000:>10.3f}{phase['p50_seconds'] * 1000:>10.3f}"
+                     f"{phase['p99_seconds'] * 1000:>10.3f}{phase['max_seconds'] * 1000:>10.3f}")
+    return "\n".join(lines)
@@ -1,64 +1,349 @@
 """For saving and loading the game."""
 
 
+import atexit
 import os
+import struct
+import threading
+import time
+from source.metrics import time_save
 
 
 SHIP_LOG_PATH = "ship_log.txt"
 SHIP_LOG_HEADER = "--------LOG BEGINS BELOW--------\n"
 LOG_ENTRY_SIGNIFIER = "LOG ENTRY: "
+JOURNAL_SUFFIX = ".journal"
+# Each journal record is a record type and a payload length, followed by that many bytes of UTF-8 payload
+JOURNAL_RECORD_HEADER = struct.Struct("<BI")
+JOURNAL_SCENE_RECORD = 1
+JOURNAL_TRICK_RECORD = 2
 
 
-def is_save_file_missing() -> bool:
+def get_journal_path(ship_log_path: str = None) -> str:
+    """
+    Get the path of the journal that goes with a ship log.
+    :param ship_log_path:   path to the ship log, or None for SHIP_LOG_PATH
+    :return:                path to the journal
+    """
+    return (SHIP_LOG_PATH if ship_log_path is None else ship_log_path) + JOURNAL_SUFFIX
+
+
+def is_save_file_missing(ship_log_path: str = None) -> bool:
     """
     Check if the save file is missing entirely.
-    :return:    True if the save file does not exist, else False
+    :param ship_log_path:   path to the ship log, or None for SHIP_LOG_PATH
+    :return:                True if neither the save file nor its journal exists, else False
     """
-    return not os.path.isfile(SHIP_LOG_PATH)
+    if ship_log_path is None:
+        ship_log_path = SHIP_LOG_PATH
+    return not os.path.isfile(ship_log_path) and not os.path.isfile(get_journal_path(ship_log_path))
 
 
-def is_save_data_empty() -> bool:
+def is_save_data_empty(ship_log_path: str = None) -> bool:
     """
     Check if the save data is empty.
-    :return:    True if the save file is empty, else False
+    :param ship_log_path:   path to the ship log, or None for SHIP_LOG_PATH
+    :return:                True if the save file and its journal are both empty or missing, else False
     """
-    with open(SHIP_LOG_PATH, "r", encoding="utf-8") as file:
-        content = file.read()
-    return len(content) == 0
+    if ship_log_path is None:
+        ship_log_path = SHIP_LOG_PATH
+    for file_path in (ship_log_path, get_journal_path(ship_log_path)):
+        if os.path.isfile(file_path) and os.path.getsize(file_path) > 0:
+            return False
+    return True
 
 
-def wipe_save() -> None:
-    """Empty the ship log."""
-    with open(SHIP_LOG_PATH, "w", encoding="utf-8") as file:
+def wipe_save(ship_log_path: str = None) -> None:
+    """
+    Empty the ship log, and delete its journal.
+    :param ship_log_path:   path to the ship log, or None for SHIP_LOG_PATH
+    """
+    if ship_log_path is None:
+        ship_log_path = SHIP_LOG_PATH
+    with open(ship_log_path, "w", encoding="utf-8") as file:
         file.write("")
+    if os.path.isfile(get_journal_path(ship_log_path)):
+        os.remove(get_journal_path(ship_log_path))
+
+
+def save(scene_id: str, tricks_found: set, ship_log_path: str = None, sync: bool = False) -> None:
+    """
+    Save the game to the ship log path.  The ship log is written to a temporary file first and then renamed over the
+    old one, so the game crashing mid-write never leaves a corrupted save behind.  Waiting for the save to reach the
+    disk, which also guards against the whole machine going down, takes far longer than the rest of a turn, so it's
+    only done when asked for, e.g. for the last save before the game exits.
+    :param scene_id:        id of the active scene
+    :param tricks_found:    set of tricks that have been discovered by the player, as strings
+    :param ship_log_path:   path to the ship log, or None for SHIP_LOG_PATH
+    :param sync:            whether to wait for the save to reach the disk
+    """
+    if ship_log_path is None:
+        ship_log_path = SHIP_LOG_PATH
+    lines = [f"current scene id: {scene_id}\n", "\n", SHIP_LOG_HEADER]
+    lines.extend(f"{LOG_ENTRY_SIGNIFIER}{trick}\n" for trick in tricks_found)
+    temporary_path = ship_log_path + ".tmp"
+    with time_save():
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write("".join(lines))
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temporary_path, ship_log_path)
+
+    # The ship log now holds everything, so any journal on top of it is stale
+    if os.path.isfile(get_journal_path(ship_log_path)):
+        os.remove(get_journal_path(ship_log_path))
+
+
+class AutoSaver:
+    """
+    Saves the game after each action, skipping saves that wouldn't change anything.  Saves can be debounced, so that
+    at most one is written per debounce period, and can be written by a background thread, off the main loop.  A save
+    held back by the debounce period is written when the period ends, even if no other save comes in.  Any save still
+    pending is written when the AutoSaver is closed, and at interpreter exit.
+    """
+    def __init__(self, ship_log_path: str = None, debounce_seconds: float = 0.0, background: bool = False):
+        """
+        :param ship_log_path:       path to the ship log, or None for SHIP_LOG_PATH
+        :param debounce_seconds:    minimum time between two writes.  0 writes every changed save right away
+        :param background:          whether to write saves on a background thread
+        """
+        self.ship_log_path = ship_log_path
+        self.debounce_seconds = debounce_seconds
+        self.saved_state = None
+        self.saved_state_synced = True     # Whether the last save written is known to have reached the disk
+        self.pending_state = None
+        self.last_write_time = float("-inf")
+        self.closed = False
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.timer = None       # Writes the save held back by the debounce period, without a background thread
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.run_background_writer, name="AutoSaver", daemon=True)
+            self.thread.start()
+        atexit.register(self.close)
+
+    def save(self, scene_id: str, tricks_found: set) -> None:
+        """
+        Ask for the game to be saved.  Depending on the debounce period and background setting, the save may be
+        written now or later.
+        :param scene_id:        id of the active scene
+        :param tricks_found:    set of tricks that have been discovered by the player, as strings
+        """
+        state = (scene_id, frozenset(tricks_found))
+        with self.condition:
+            if state == self.saved_state:
+                self.pending_state = None
+                return
+            self.pending_state = state
+            if self.thread is not None:
+                self.condition.notify()
+                return
+            delay = self.last_write_time + self.debounce_seconds - time.monotonic()
+            if delay > 0:
+                if self.timer is None and not self.closed:
+                    self.timer = threading.Timer(delay, self.run_trailing_save)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return
+        self.flush()
+
+    def flush(self, sync: bool = False) -> None:
+        """
+        Write the pending save, if there is one, right now.
+        :param sync:    whether to wait for the save to reach the disk.  If so, the last save written is written again
+                        if it wasn't synced, even with no save pending
+        """
+        with self.write_lock:
+            with self.condition:
+                state = self.pending_state
+                self.pending_state = None
+                if state is None and sync and not self.saved_state_synced:
+                    state = self.saved_state
+            if state is None:
+                return
+            save(state[0], state[1], self.ship_log_path, sync)
+            with self.condition:
+                self.saved_state = state
+                self.saved_state_synced = sync
+                self.last_write_time = time.monotonic()
 
+    def close(self) -> None:
+        """Write any pending save and stop the background thread.  Safe to call more than once."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush(sync=True)
+        atexit.unregister(self.close)
 
-def save(scene_id: str, tricks_found: set) -> None:
+    def run_trailing_save(self) -> None:
+        """Write the save held back by the debounce period, once the period is over."""
+        with self.condition:
+            self.timer = None
+        self.flush()
+
+    def run_background_writer(self) -> None:
+        """Write pending saves as they come in, at most once per debounce period, until closed."""
+        while True:
+            with self.condition:
+                while self.pending_state is None and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                delay = self.last_write_time + self.debounce_seconds - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    if self.closed:
+                        return
+            self.flush()
+
+
+class JournalSaver:
+    """
+    Saves the game after each action by appending only what changed, a new scene id and any newly found tricks, to a
+    journal next to the ship log.  Every compact_every records, and when closed, the journal is compacted into the
+    full, human-readable ship log.  load() replays the journal on top of the ship log.  Has the same interface as
+    AutoSaver.
+    """
+    def __init__(self, ship_log_path: str = None, compact_every: int = 1000):
+        """
+        :param ship_log_path:   path to the ship log, or None for SHIP_LOG_PATH
+        :param compact_every:   number of journal records after which the journal is compacted into the ship log
+        """
+        self.ship_log_path = SHIP_LOG_PATH if ship_log_path is None else ship_log_path
+        self.journal_path = get_journal_path(self.ship_log_path)
+        self.compact_every = compact_every
+        self.journal = None
+        self.scene_id = None
+        self.tricks_found = None
+        self.records_in_journal = 0
+        atexit.register(self.close)
+
+    def open_journal(self) -> None:
+        """
+        Read the saved game that the journal continues from, and open the journal for appending.  Done on the first
+        save rather than on construction, since the save may be wiped in between.  A journal left behind by a game
+        that didn't close, e.g. after a crash, is compacted into the ship log first, since it can end in a record cut
+        short, which records appended after it would be read as part of.
+        """
+        if is_save_file_missing(self.ship_log_path):
+            self.scene_id, self.tricks_found = "", set()
+        else:
+            self.scene_id, self.tricks_found = load(self.ship_log_path)
+        if os.path.isfile(self.journal_path):
+            save(self.scene_id, self.tricks_found, self.ship_log_path, sync=True)
+        self.journal = open(self.journal_path, "ab")
+
+    def save(self, scene_id: str, tricks_found: set) -> None:
+        """
+        Append what changed since the last save to the journal.  Tricks are only ever gained, so the tricks found are
+        only compared when their count has changed.
+        :param scene_id:        id of the active scene
+        :param tricks_found:    set of tricks that have been discovered by the player, as strings
+        """
+        if self.journal is None:
+            self.open_journal()
+        records = []
+        if scene_id != self.scene_id:
+            records.append(encode_journal_record(JOURNAL_SCENE_RECORD, scene_id))
+            self.scene_id = scene_id
+        if len(tricks_found) != len(self.tricks_found):
+            for trick in tricks_found - self.tricks_found:
+                records.append(encode_journal_record(JOURNAL_TRICK_RECORD, trick))
+            self.tricks_found = set(tricks_found)
+        if len(records) == 0:
+            return
+        self.journal.write(b"".join(records))
+        self.journal.flush()
+        self.records_in_journal += len(records)
+        if self.records_in_journal >= self.compact_every:
+            self.compact()
+
+    def flush(self) -> None:
+        """Make sure every journal record written so far has reached the disk."""
+        if self.journal is None or self.journal.closed:
+            return
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def compact(self) -> None:
+        """Rewrite the ship log with the full save and start a new, empty journal."""
+        self.journal.close()
+        save(self.scene_id, self.tricks_found, self.ship_log_path, sync=True)
+        self.journal = open(self.journal_path, "ab")
+        self.records_in_journal = 0
+
+    def close(self) -> None:
+        """Compact the journal into the ship log and stop journaling.  Safe to call more than once."""
+        if self.journal is None or self.journal.closed:
+            atexit.unregister(self.close)
+            return
+        if self.records_in_journal > 0:
+            self.compact()
+        self.journal.close()
+        if os.path.isfile(self.journal_path) and os.path.getsize(self.journal_path) == 0:
+            os.remove(self.journal_path)
+        atexit.unregister(self.close)
+
+
+def encode_journal_record(record_type: int, payload: str) -> bytes:
     """
-    Save the game to the ship log path.
-    :param scene_id:
-    :param tricks_found:
-    :return:
+    Encode one journal record.
+    :param record_type:     JOURNAL_SCENE_RECORD or JOURNAL_TRICK_RECORD
+    :param payload:         scene id or trick
+    :return:                the record's bytes
     """
-    with open(SHIP_LOG_PATH, "w", encoding="utf-8") as file:
-        file.write(f"current scene id: {scene_id}\n")
-        file.write("\n")
-        file.write(SHIP_LOG_HEADER)
-        for trick in tricks_found:
-            file.write(f"{LOG_ENTRY_SIGNIFIER}{trick}\n")
+    encoded = payload.encode("utf-8")
+    return JOURNAL_RECORD_HEADER.pack(record_type, len(encoded)) + encoded
 
 
-def load() -> tuple:
+def replay_journal(journal_path: str, scene_id: str, tricks_found: set) -> tuple:
     """
-    Load the game from the ship log.
-    :return:    tuple with (scene id, set of tricks found)
+    Apply the records in a journal to a saved game.  A record cut short by a crash mid-write is ignored.
+    :param journal_path:    path to the journal
+    :param scene_id:        id of the active scene before the journal
+    :param tricks_found:    set of tricks found before the journal.  Updated in place
+    :return:                tuple with (scene id, set of tricks found)
     """
+    with open(journal_path, "rb") as file:
+        content = file.read()
+    position = 0
+    while position + JOURNAL_RECORD_HEADER.size <= len(content):
+        record_type, length = JOURNAL_RECORD_HEADER.unpack_from(content, position)
+        position += JOURNAL_RECORD_HEADER.size
+        if position + length > len(content):
+            break
+        payload = content[position:position + length].decode("utf-8")
+        position += length
+        if record_type == JOURNAL_SCENE_RECORD:
+            scene_id = payload
+        elif record_type == JOURNAL_TRICK_RECORD:
+            tricks_found.add(payload)
+    return scene_id, tricks_found
+
+
+def load(ship_log_path: str = None) -> tuple:
+    """
+    Load the game from the ship log, and its journal if it has one.
+    :param ship_log_path:   path to the ship log, or None for SHIP_LOG_PATH
+    :return:                tuple with (scene id, set of tricks found)
+    """
+    if ship_log_path is None:
+        ship_log_path = SHIP_LOG_PATH
+
     # If no ship log, create a blank one
-    if is_save_file_missing():
-        wipe_save()
+    if not os.path.isfile(ship_log_path):
+        with open(ship_log_path, "w", encoding="utf-8") as file:
+            file.write("")
 
     # Load
-    with open(SHIP_LOG_PATH, "r", encoding="utf-8") as file:
+    with open(ship_log_path, "r", encoding="utf-8") as file:
         content = file.read()
     try:
         content = content.split("\n")
@@ -67,6 +352,8 @@ def load() -> tuple:
         for line in content[3:]:
             if line.startswith(LOG_ENTRY_SIGNIFIER):
                 tricks.add(line[len(LOG_ENTRY_SIGNIFIER):])
+        if os.path.isfile(get_journal_path(ship_log_path)):
+            scene_id, tricks = replay_journal(get_journal_path(ship_log_path), scene_id, tricks)
         return (scene_id, tricks)
     except:
-        raise RuntimeError(f"Unfortunately the current state of your save file ({SHIP_LOG_PATH}) is invalid.  You'll have to start a new game.")
+        raise RuntimeError(f"Unfortunately the current state of your save file ({ship_log_path}) is invalid.  You'll have to start a new game.")
@@ -0,0 +1,359 @@
+"""For searching where words are mentioned in a story: in scene text, choice labels and trick names.
+
+Texts are split into lowercase words, and an inverted index maps each word to the documents it's in and how often.
+Queries are words that must all be found; a word ending in * matches every word it begins.  Matches are ranked by BM25,
+so rarer words and shorter texts count for more.
+
+The index is updated incrementally: it remembers a digest of every document's text, and given the documents of a
+changed Graph, only splits and re-indexes the ones that were added or changed.  It's cached in a file next to the
+canvas, which is brought up to date this way whenever the canvas changes, rather than being rebuilt from scratch.
+"""
+
+
+import hashlib
+import heapq
+import marshal
+import math
+import os
+import re
+import struct
+from bisect import bisect_left
+from operator import itemgetter
+from os import path
+from source.flowchart_importing import FLOWCHART_PATH, HUB_RETURN_CHOICE_STRING
+from source.graph import Graph
+from source.graph_cache import hash_file
+from source.profiling import profile_phase
+from source.saving_and_loading import LOG_ENTRY_SIGNIFIER
+
+
+SEARCH_INDEX_PATH = path.join("source", "game_flowchart.search")
+SEARCH_INDEX_MAGIC = b"IWSERCH\x00"
+SEARCH_INDEX_FORMAT_VERSION = 1
+# magic, format version, marshal version, canvas mtime in nanoseconds, canvas SHA-256 hash
+SEARCH_INDEX_HEADER = struct.Struct("<8sIIq32s")
+WORD_PATTERN = re.compile(r"[^\W_]+")
+PREFIX_SIGNIFIER = "*"
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_RESULTS = 20
+SNIPPET_LENGTH = 60
+SHIP_LOG_EMPTY = "Your ship log is empty.  Explore to fill it."
+
+
+def split_words(text: str) -> list:
+    """
+    Split text into the words the index is made of.
+    :param text:    any text
+    :return:        list of lowercase words, in order, with repeats
+    """
+    return WORD_PATTERN.findall(text.lower())
+
+
+def get_text_digest(text: str) -> bytes:
+    """
+    Get a short digest of a document's text, to tell whether it changed.
+    :param text:    the document's text
+    :return:        8-byte digest
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+def get_graph_documents(graph: Graph) -> dict:
+    """
+    Get the searchable documents of a Graph: the text of every scene, the label of every choice the player can be
+    offered, except the hub-return choices added to every scene, and the name of every trick.
+    :param graph:   Graph object representing the full game
+    :return:        dict of texts by document key.  Keys are ("scene", scene id), ("choice", id of the scene it leads
+                    away from, its number among that scene's choices, from 0), or ("trick", trick name)
+    """
+    documents = {}
+    for scene in graph.scenes:
+        if scene.is_trick:
+            continue
+        documents["scene", scene.id] = scene.text
+        for number, choice in enumerate(scene.visible_choices):
+            if choice.text != HUB_RETURN_CHOICE_STRING:
+                documents["choice", scene.id, number] = choice.text
+    for trick in graph.trick_names:
+        documents["trick", trick] = trick
+    return documents
+
+
+class SearchIndex:
+    """An inverted index from words to the documents they're in, that can be updated one document at a time."""
+    def __init__(self):
+        self.documents = {}     # (text digest, number of words, tuple of its distinct words) by document key
+        self.postings = {}      # Dict of the number of times the word is in each document by key, by word
+        self.total_words = 0
+        self.sorted_words = None
+
+    def add_document(self, key: tuple, text: str) -> None:
+        """
+        Index one document, replacing any document with the same key.
+        :param key:     tuple identifying the document
+        :param text:    the document's text
+        """
+        if key in self.documents:
+            self.remove_document(key)
+        words = split_words(text)
+        counts = {}
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1
+        for word, count in counts.items():
+            postings = self.postings.get(word)
+            if postings is None:
+                self.postings[word] = {key: count}
+                self.sorted_words = None
+            else:
+                postings[key] = count
+        self.documents[key] = (get_text_digest(text), len(words), tuple(counts))
+        self.total_words += len(words)
+
+    def remove_document(self, key: tuple) -> None:
+        """
+        Take one document out of the index.
+        :param key:     tuple identifying the document
+        """
+        _, word_count, distinct_words = self.documents.pop(key)
+        for word in distinct_words:
+            postings = self.postings[word]
+            del postings[key]
+            if len(postings) == 0:
+                del self.postings[word]
+                self.sorted_words = None
+        self.total_words -= word_count
+
+    def update(self, documents: dict) -> int:
+        """
+        Bring the index in line with a new set of documents, re-indexing only those that were added or changed, and
+        removing those that are gone.
+        :param documents:   dict of texts by document key
+        :return:            number of documents that were added, changed or removed
+        """
+        changes = 0
+        for key in [key for key in self.documents if key not in documents]:
+            self.remove_document(key)
+            changes += 1
+        for key, text in documents.items():
+            indexed = self.documents.get(key)
+            if indexed is None or indexed[0] != get_text_digest(text):
+                self.add_document(key, text)
+                changes += 1
+        return changes
+
+    def expand_word(self, word: str) -> list:
+        """
+        Find the indexed words a query word matches.
+        :param word:    a word from a query.  If it ends in PREFIX_SIGNIFIER, it matches every word it begins
+        :return:        list of indexed words
+        """
+        if not word.endswith(PREFIX_SIGNIFIER):
+            return [word] if word in self.postings else []
+        prefix = word[:-len(PREFIX_SIGNIFIER)]
+        if self.sorted_words is None:
+            self.sorted_words = sorted(self.postings)
+        matches = []
+        for index in range(bisect_left(self.sorted_words, prefix), len(self.sorted_words)):
+            if not self.sorted_words[index].startswith(prefix):
+                break
+            matches.append(self.sorted_words[index])
+        return matches
+
+    def search(self, query: str, max_results: int = MAX_RESULTS, keys=None) -> list:
+        """
+        Find the documents that contain every word of a query, best match first.
+        :param query:           words to look for.  A word ending in PREFIX_SIGNIFIER matches every word it begins
+        :param max_results:     most documents to return
+        :param keys:            set of the keys of the only documents to search, or None to search them all
+        :return:                list of (score, document key) pairs, highest score first
+        """
+        query_words = [word + PREFIX_SIGNIFIER if raw.endswith(PREFIX_SIGNIFIER) else word
+                       for raw in query.lower().split() for word in split_words(raw)]
+        if len(query_words) == 0 or len(self.documents) == 0:
+            return []
+
+        # Start from the documents of the rarest query word, then keep those every other word is found in too
+        matches_by_word = []
+        for query_word in dict.fromkeys(query_words):
+            matches = []
+            for word in self.expand_word(query_word):
+                postings = self.postings[word]
+                idf = math.log(1 + (len(self.documents) - len(postings) + 0.5) / (len(postings) + 0.5))
+                matches.append((idf, postings))
+            if len(matches) == 0:
+                return []
+            matches_by_word.append(matches)
+        matches_by_word.sort(key=lambda matches: sum(len(postings) for _, postings in matches))
+
+        # BM25 scores a word found n times in a document of l words as idf * n * (k1 + 1) / (n + offset + scale * l)
+        documents = self.documents
+        length_offset = BM25_K1 * (1 - BM25_B)
+        length_scale = BM25_K1 * BM25_B * len(documents) / max(self.total_words, 1)
+        scores = None
+        for matches in matches_by_word:
+            word_scores = {}
+            for idf, postings in matches:
+                weight = idf * (BM25_K1 + 1)
+                if scores is not None:
+                    counts = [(key, postings[key]) for key in scores if key in postings]
+                elif keys is not None:
+                    counts = [(key, postings[key]) for key in keys if key in postings]
+                else:
+                    counts = postings.items()
+                for key, count in counts:
+                    score = weight * count / (count + length_offset + length_scale * documents[key][1])
+                    if score > word_scores.get(key, 0.0):
+                        word_scores[key] = score
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {key: score + word_scores[key] for key, score in scores.items() if key in word_scores}
+            if len(scores) == 0:
+                return []
+        return [(score, key) for key, score in heapq.nlargest(max_results, scores.items(), key=itemgetter(1))]
+
+    def encode(self) -> tuple:
+        """
+        Convert the index to plain tuples and dicts, for marshal.
+        :return:    tuple with (documents, postings)
+        """
+        return self.documents, self.postings
+
+    def decode(self, payload: tuple) -> None:
+        """
+        Fill the index from a payload made by encode().
+        :param payload:     tuple returned by encode()
+        """
+        self.documents, self.postings = payload
+        self.total_words = sum(word_count for _, word_count, _ in self.documents.values())
+        self.sorted_words = None
+
+
+def write_search_index(index: SearchIndex, flowchart_path: str = FLOWCHART_PATH,
+                       index_path: str = SEARCH_INDEX_PATH) -> None:
+    """
+    Write a search index to its cache file, stamped with the modification time and hash of the canvas it came from.
+    :param index:           SearchIndex of the canvas's Graph
+    :param flowchart_path:  path to the canvas file
+    :param index_path:      path to the cache file to write
+    """
+    header = SEARCH_INDEX_HEADER.pack(SEARCH_INDEX_MAGIC, SEARCH_INDEX_FORMAT_VERSION, marshal.version,
+                                      os.stat(flowchart_path).st_mtime_ns, hash_file(flowchart_path))
+    temporary_path = index_path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(header)
+        marshal.dump(index.encode(), file)
+    os.replace(temporary_path, index_path)
+
+
+def read_search_index(flowchart_path: str = FLOWCHART_PATH, index_path: str = SEARCH_INDEX_PATH) -> tuple:
+    """
+    Read a search index from its cache file, whether or not the canvas changed since.
+    :param flowchart_path:  path to the canvas file
+    :param index_path:      path to the cache file
+    :return:                tuple with (SearchIndex, or None if there's no usable cache file, whether the canvas is
+                            the same as when the cache was written, or missing)
+    """
+    if not path.isfile(index_path) or path.getsize(index_path) <= SEARCH_INDEX_HEADER.size:
+        return None, False
+    with open(index_path, "rb") as file:
+        data = file.read()
+    magic, format_version, marshal_version, canvas_mtime_ns, canvas_hash = SEARCH_INDEX_HEADER.unpack_from(data)
+    if magic != SEARCH_INDEX_MAGIC or format_version != SEARCH_INDEX_FORMAT_VERSION \
+            or marshal_version != marshal.version:
+        return None, False
+    index = SearchIndex()
+    index.decode(marshal.loads(memoryview(data)[SEARCH_INDEX_HEADER.size:]))
+    # Like the graph cache, an index deployed without its canvas is trusted as is
+    if not path.isfile(flowchart_path):
+        return index, True
+    is_same = os.stat(flowchart_path).st_mtime_ns == canvas_mtime_ns or hash_file(flowchart_path) == canvas_hash
+    return index, is_same
+
+
+def load_search_index(graph: Graph, flowchart_path: str = FLOWCHART_PATH,
+                      index_path: str = SEARCH_INDEX_PATH) -> SearchIndex:
+    """
+    Get the search index of a Graph from its cache file, updating it and the file if the canvas changed since, or build
+    it if there's no cache file yet.
+    :param graph:           Graph object read from flowchart_path
+    :param flowchart_path:  path to the canvas file
+    :param index_path:      path to the cache file
+    :return:                SearchIndex of the Graph
+    """
+    with profile_phase("load.search"):
+        index, is_same = read_search_index(flowchart_path, index_path)
+        if index is not None and is_same:
+            return index
+        if index is None:
+            index = SearchIndex()
+        index.update(get_graph_documents(graph))
+        try:
+            write_search_index(index, flowchart_path, index_path)
+        except OSError:     # If the cache can't be written, e.g. on a read-only install, just go without it
+            pass
+        return index
+
+
+def get_snippet(text: str, query: str) -> str:
+    """
+    Get a short piece of a text around the first word of a query found in it.
+    :param text:    the text
+    :param query:   the query that matched it
+    :return:        up to SNIPPET_LENGTH characters of the text, with ... where it was cut
+    """
+    lowered = text.lower()
+    found_at = [lowered.find(word) for word in split_words(query)]
+    start = max(0, min([position for position in found_at if position >= 0], default=0) - SNIPPET_LENGTH // 4)
+    start = text.rfind(" ", 0, start) + 1   # Don't cut a word in half
+    snippet = text[start:start + SNIPPET_LENGTH].replace("\n", " ")
+    return ("..." if start > 0 else "") + snippet + ("..." if start + SNIPPET_LENGTH < len(text) else "")
+
+
+def describe_document(key: tuple, graph: Graph, query: str) -> str:
+    """
+    Say where a document is, with a snippet of its text, for search results.
+    :param key:     document key, as made by get_graph_documents()
+    :param graph:   Graph object the documents came from
+    :param query:   the query that matched it
+    :return:        one line of text
+    """
+    if key[0] == "scene":
+        return f"scene {key[1]}: {get_snippet(graph.scene_by_id[key[1]].text, query)}"
+    if key[0] == "choice":
+        return f"choice in scene {key[1]}: {get_snippet(graph.scene_by_id[key[1]].visible_choices[key[2]].text, query)}"
+    return f"trick: {key[1]}"
+
+
+def format_search_results(results: list, graph: Graph, query: str) -> str:
+    """
+    Summarize the results of SearchIndex.search() on a Graph's documents for a person to read.
+    :param results:     list returned by SearchIndex.search()
+    :param graph:       Graph object the documents came from
+    :param query:       the query that was searched for
+    :return:            multi-line summary
+    """
+    if len(results) == 0:
+        return f"Nothing found for {query!r}."
+    lines = [f"Best matches for {query!r}:"]
+    for score, key in results:
+        lines.append(f"    {score:6.2f}  {describe_document(key, graph, query)}")
+    return "\n".join(lines)
+
+
+def search_ship_log(index: SearchIndex, tricks_found: set, query: str) -> str:
+    """
+    Search the entries of a player's ship log, i.e. the tricks they've found, and put the results into words.
+    :param index:           SearchIndex kept for the player's ship log.  Updated with any new entries first
+    :param tricks_found:    set of tricks that have been discovered by the player, as strings
+    :param query:           words to look for
+    :return:                the ship log entries that match, best match first, or a message saying there are none
+    """
+    index.update({("trick", trick): trick for trick in tricks_found})
+    if len(tricks_found) == 0:
+        return SHIP_LOG_EMPTY
+    results = index.search(query)
+    if len(results) == 0:
+        return f"Nothing in your ship log mentions {query!r}."
+    return "\n".join(f"{LOG_ENTRY_SIGNIFIER}{key[1]}" for _, key in results)
@@ -0,0 +1,197 @@
+"""For hosting the game for many players at once.
+
+Players connect over TCP, e.g. with `nc localhost 7777` or `telnet localhost 7777`, and play with the same line-based
+input as the terminal game.  Every time the server is waiting for a line of input, it ends its output with
+INPUT_MARKER.  The game Graph is loaded once and shared, read-only, by every connection.  Each connection has its own
+GameSession and its own ship log, named after the captain.
+"""
+
+
+import asyncio
+import os
+import re
+from source.basic_utils import make_player_choose_async, wrap_to_screen
+from source.game_running import GameSession, SCENE_DIVIDER, CONTINUE_PROMPT, CONTINUE_OPTIONS, CONFIRM_WIPE_PROMPT, \
+    CONFIRM_WIPE_OPTIONS, HINT_KEY, HINT_OPTION, SEARCH_KEY, SEARCH_OPTION, SEARCH_PROMPT
+from source.graph import Graph
+from source.hints import HintIndex
+from source.metrics import time_turn_phase
+from source.saving_and_loading import AutoSaver, is_save_file_missing, is_save_data_empty, wipe_save, load
+from source.search import SearchIndex, search_ship_log
+from source.splash import splash_title
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7777
+SESSION_SAVE_DIRECTORY = "ship_logs"
+INPUT_MARKER = "> "
+NAME_PROMPT = "Welcome aboard, captain!  What's your name?  (Letters, numbers, - and _ only)"
+MAX_NAME_LENGTH = 64
+CONNECTION_BACKLOG = 4096
+
+
+class ConnectionIO:
+    """Line-based player input and output over an asyncio stream connection."""
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        :param reader:      stream to read the player's input from
+        :param writer:      stream to write output to the player
+        """
+        self.reader = reader
+        self.writer = writer
+
+    def write(self, text: str) -> None:
+        """
+        Queue text to be sent to the player.  It's sent the next time the player is asked for input.
+        :param text:    text to send
+        """
+        self.writer.write(text.encode("utf-8"))
+
+    async def readline(self) -> str:
+        """
+        Send all queued output followed by INPUT_MARKER, then wait for the player's next line of input.
+        :return:    the line, without its line ending
+        """
+        self.writer.write(INPUT_MARKER.encode("utf-8"))
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if len(line) == 0:
+            raise ConnectionResetError("the player disconnected")
+        return line.decode("utf-8", errors="replace").rstrip("\r\n")
+
+
+class GameServer:
+    """Serves one shared game Graph to many concurrent players."""
+    def __init__(self, graph: Graph, save_directory: str = SESSION_SAVE_DIRECTORY, save_debounce_seconds: float = 0.0):
+        """
+        :param graph:                   Graph object representing the full game
+        :param save_directory:          directory to keep each captain's ship log in
+        :param save_debounce_seconds:   minimum time between two writes of a captain's ship log
+        """
+        self.graph = graph
+        self.hints = HintIndex(graph)
+        self.save_directory = save_directory
+        self.save_debounce_seconds = save_debounce_seconds
+        self.captains_aboard = set()
+
+    async def ask_for_name(self, player_io: ConnectionIO) -> str:
+        """
+        Ask a connecting player for their name until they give one that's usable in a file name and not in use.
+        :param player_io:   the player's ConnectionIO
+        :return:            the captain's name
+        """
+        player_io.write(NAME_PROMPT + "\n")
+        while True:
+            name = (await player_io.readline()).strip()
+            if re.fullmatch(r"[A-Za-z0-9_-]+", name) is None or len(name) > MAX_NAME_LENGTH:
+                player_io.write(f"Please use only letters, numbers, - and _, up to {MAX_NAME_LENGTH} characters.\n")
+            elif name in self.captains_aboard:
+                player_io.write("A captain by that name is already aboard.  Please pick another name.\n")
+            else:
+                return name
+
+    async def get_initial_game_state(self, player_io: ConnectionIO, ship_log_path: str) -> tuple:
+        """
+        Like game_running.get_initial_game_state(), but for a player on a connection, with their own ship log.
+        :param player_io:       the player's ConnectionIO
+        :param ship_log_path:   path to the captain's ship log
+        :return:                tuple with (scene id, set of tricks found).  If we should start a new game,
+                                return ("", set())
+        """
+        if is_save_file_missing(ship_log_path) or is_save_data_empty(ship_log_path):
+            return "", set()
+
+        player_io.write(SCENE_DIVIDER + "\n")
+        player_response = await make_player_choose_async(player_io, CONTINUE_PROMPT, CONTINUE_OPTIONS)
+        if player_response == "2":
+            player_io.write(SCENE_DIVIDER + "\n")
+            player_response = await make_player_choose_async(player_io, CONFIRM_WIPE_PROMPT, CONFIRM_WIPE_OPTIONS)
+            if player_response == "2":
+                wipe_save(ship_log_path)
+                return "", set()
+        return load(ship_log_path)
+
+    async def play_session(self, player_io: ConnectionIO, ship_log_path: str) -> None:
+        """
+        Run one player's game until it ends.  Saves are written on worker threads, to keep the event loop free.
+        :param player_io:       the player's ConnectionIO
+        :param ship_log_path:   path to the captain's ship log
+        """
+        starting_scene_id, found_tricks = await self.get_initial_game_state(player_io, ship_log_path)
+        session = GameSession(self.graph, starting_scene_id, found_tricks)
+        if len(starting_scene_id) == 0:
+            player_io.write(splash_title + "\n")
+
+        saver = AutoSaver(ship_log_path, self.save_debounce_seconds)
+        ship_log_index = SearchIndex()
+        try:
+            while True:
+                player_io.write(SCENE_DIVIDER + "\n")
+                num_to_choice, num_to_choice_text = session.active_scene.get_choice_menu(session.found_mask)
+                num_to_choice_text[HINT_KEY] = HINT_OPTION
+                num_to_choice_text[SEARCH_KEY] = SEARCH_OPTION
+                player_response = await make_player_choose_async(player_io, session.active_scene.text, num_to_choice_text)
+                if player_response == HINT_KEY:
+                    hint_text = self.hints.get_hint_text(session.active_scene, session.found_mask)
+                    player_io.write(wrap_to_screen(hint_text) + "\n")
+                    continue
+                if player_response == SEARCH_KEY:
+                    player_io.write(SEARCH_PROMPT)
+                    query = await player_io.readline()
+                    player_io.write(search_ship_log(ship_log_index, session.get_tricks_found(), query) + "\n")
+                    continue
+                session.take_choice(num_to_choice[player_response])
+                if session.active_scene.is_end:
+                    player_io.write(SCENE_DIVIDER + "\n")
+                    break
+                with time_turn_phase("save"):
+                    await asyncio.to_thread(saver.save, session.active_scene.id, session.get_tricks_found())
+        finally:
+            await asyncio.to_thread(saver.close)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serve one player, from connecting to disconnecting.
+        :param reader:      stream to read the player's input from
+        :param writer:      stream to write output to the player
+        """
+        player_io = ConnectionIO(reader, writer)
+        name = None
+        try:
+            name = await self.ask_for_name(player_io)
+            self.captains_aboard.add(name)
+            await self.play_session(player_io, os.path.join(self.save_directory, f"{name}.txt"))
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.captains_aboard.discard(name)
+            writer.close()
+
+    async def serve_forever(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        """
+        Accept players until cancelled.
+        :param host:    interface to listen on
+        :param port:    TCP port to listen on
+        """
+        os.makedirs(self.save_directory, exist_ok=True)
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=CONNECTION_BACKLOG)
+        async with server:
+            await server.serve_forever()
+
+
+def run_server(graph: Graph, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+               save_directory: str = SESSION_SAVE_DIRECTORY, save_debounce_seconds: float = 0.0) -> None:
+    """
+    Host the game until interrupted with Ctrl + C.
+    :param graph:                   Graph object representing the full game
+    :param host:                    interface to listen on
+    :param port:                    TCP port to listen on
+    :param save_directory:          directory to keep each captain's ship log in
+    :param save_debounce_seconds:   minimum time between two writes of a captain's ship log
+    """
+    print(f"Hosting the game on {host}:{port}.  Press Ctrl + C to stop.")
+    try:
+        asyncio.run(GameServer(graph, save_directory, save_debounce_seconds).serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
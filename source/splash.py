@@ -13,9 +13,9 @@ splash_title = r"""
  
 """
 
-splash_message = r"""Welcome aboard, captain!  Please check the readme for instructions on how to play.
+splash_message = r"""Welcome aboard, captain!  Please check the readme for instructions on how to play."""
 
-(Game will start when song is finished)"""
+skip_song_prompt = "(Press Enter to skip the song and begin)"
 
 
 def display_splash_screen() -> None:
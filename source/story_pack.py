@@ -0,0 +1,401 @@
+"""For stories split into a story pack: a manifest plus one canvas per world, so that a big story only loads and links
+the worlds the player actually visits.
+
+The manifest is a JSON file like this, with canvas paths relative to the manifest:
+{
+    "start": "start.canvas",
+    "worlds": [
+        {"canvas": "timber_hearth.canvas", "entries": ["<node id>", ...]},
+        ...
+    ]
+}
+The start canvas holds the START node and everything that isn't part of any world, and is loaded right away.  Each
+world canvas holds a WORLD hub and the scenes around it, and is loaded, linked and cached the first time the player
+enters it.  Each edge is stored in the canvas of the node it leads away from, and can lead to a node in another canvas
+by that node's id, as long as the node is in the start canvas or is one of its world's entries.  Until a world is
+loaded, edges into it lead to placeholder Scenes, which are filled in place when it loads, so that choices leading
+into a world never need relinking.
+
+Within a canvas, everything works as it does for a single canvas, except that a world's hub-return choices only reach
+scenes in the world's own canvas.  Edges between canvases can't be orange and can't lead to tricks.  To gate a choice
+on a trick found in another world, put a copy of the trick node, with the same text, in the choice's canvas.
+split_canvas_into_pack() splits a single canvas into a story pack along these lines, by WORLD hub.
+"""
+
+
+import json
+import os
+import re
+from collections import OrderedDict, deque
+from os import path
+from source.basic_utils import paused_garbage_collection
+from source.flowchart_importing import FLOWCHART_PATH, add_hub_return_choices, build_choice_objects, \
+    build_scene_objects, check_redirect_chains, find_gives_tricks, find_requires_tricks, find_world_parents, link_graph
+from source.graph import Graph, Scene
+from source.hot_reload import NODE_ATTRIBUTES, remove_choices
+from source.profiling import profile_phase
+
+
+MANIFEST_NAME = "story_pack.json"
+START_CANVAS_NAME = "start.canvas"
+PLACEHOLDER_TEXT = "This part of the story hasn't been loaded yet."
+CANVAS_NAME_LENGTH = 40
+
+
+def read_manifest(manifest_path: str) -> tuple:
+    """
+    Read a story pack manifest.
+    :param manifest_path:   path to the manifest file
+    :return:                tuple with (path to the start canvas, list of (path to the canvas, tuple of entry node
+                            ids) tuples, one per world)
+    """
+    with open(manifest_path, encoding="utf-8") as file:
+        manifest = json.load(file)
+    directory = path.dirname(manifest_path)
+    try:
+        start_path = path.join(directory, manifest["start"])
+        worlds = [(path.join(directory, world["canvas"]), tuple(world["entries"])) for world in manifest["worlds"]]
+    except (KeyError, TypeError) as error:
+        raise RuntimeError(f"story pack manifest {manifest_path} is malformed: {error!r}")
+    return start_path, worlds
+
+
+class StoryPack:
+    """
+    A story split into one canvas per world.  Holds a single Graph, which grows as the player enters worlds and,
+    optionally, shrinks again by evicting the worlds entered least recently.
+    """
+    def __init__(self, manifest_path: str, max_loaded_worlds: int = None):
+        """
+        :param manifest_path:       path to the story pack's manifest file
+        :param max_loaded_worlds:   most worlds to keep loaded at once, or None to keep every world once it's loaded
+        """
+        if max_loaded_worlds is not None and max_loaded_worlds < 1:
+            raise ValueError("max_loaded_worlds must be at least 1")
+        self.manifest_path = manifest_path
+        self.max_loaded_worlds = max_loaded_worlds
+        self.start_path, self.worlds = read_manifest(manifest_path)
+        self.world_of_entry = {}
+        for world_index, (canvas_path, entries) in enumerate(self.worlds):
+            for node_id in entries:
+                if node_id in self.world_of_entry:
+                    raise RuntimeError(f"node {node_id} is an entry of more than one world in {manifest_path}")
+                self.world_of_entry[node_id] = world_index
+
+        self.graph = Graph([], [])
+        self.placeholders = {}              # Placeholder Scenes for the entries of worlds that aren't loaded, by id
+        self.world_of_scene = {}            # World index of every loaded Scene, or None for the start canvas
+        self.loaded_worlds = OrderedDict()  # (Scenes, Choices) of each loaded world by index, least recently entered first
+        self.load_canvas(self.start_path, None)
+
+    def enter(self, scene: Scene) -> None:
+        """
+        Get a Scene ready for the player to arrive at, loading its world if it's a placeholder.  Must be called before
+        following any choice.  May evict the world entered least recently.
+        :param scene:   Scene a choice leads to
+        """
+        if scene in self.world_of_scene:
+            world_index = self.world_of_scene[scene]
+            if world_index is not None:
+                self.loaded_worlds.move_to_end(world_index)
+            return
+        self.load_world(self.world_of_entry[scene.id])
+
+    def find_scene(self, scene_id: str) -> Scene:
+        """
+        Find a Scene by id, loading worlds one at a time until it's found, e.g. to pick up a saved game.
+        :param scene_id:    id of the Scene
+        :return:            Scene object, or None if it isn't in any canvas of the pack
+        """
+        if scene_id in self.world_of_entry and self.world_of_entry[scene_id] not in self.loaded_worlds:
+            self.load_world(self.world_of_entry[scene_id])
+        scene = self.graph.scene_by_id.get(scene_id)
+        for world_index in range(len(self.worlds)):
+            if scene is not None:
+                break
+            if world_index not in self.loaded_worlds:
+                self.load_world(world_index)
+                scene = self.graph.scene_by_id.get(scene_id)
+        return scene
+
+    def load_all_worlds(self) -> Graph:
+        """
+        Load every world that isn't loaded yet, e.g. to analyze the whole story.  Nothing is evicted.
+        :return:    the Graph, now holding the whole story
+        """
+        for world_index, (canvas_path, _) in enumerate(self.worlds):
+            if world_index not in self.loaded_worlds:
+                with profile_phase("load.world"):
+                    self.load_canvas(canvas_path, world_index)
+        return self.graph
+
+    def load_world(self, world_index: int) -> None:
+        """
+        Load a world, then evict the worlds entered least recently if too many are loaded.
+        :param world_index:     index of the world in the manifest
+        """
+        with profile_phase("load.world"):
+            self.load_canvas(self.worlds[world_index][0], world_index)
+        if self.max_loaded_worlds is not None:
+            while len(self.loaded_worlds) > self.max_loaded_worlds:
+                self.evict_world(next(iter(self.loaded_worlds)))
+
+    def get_placeholder(self, node_id: str) -> Scene:
+        """
+        Get the placeholder Scene for an entry of a world that isn't loaded, making it if there isn't one yet.
+        :param node_id:     id of the entry node
+        :return:            placeholder Scene, with no choices leading away from it
+        """
+        placeholder = self.placeholders.get(node_id)
+        if placeholder is None:
+            placeholder = Scene(node_id, PLACEHOLDER_TEXT, "gray", False, False, False)
+            placeholder.set_choices_to_references(tuple())
+            placeholder.set_choices_from_references(tuple())
+            placeholder.set_gives_tricks(tuple())
+            self.placeholders[node_id] = placeholder
+        return placeholder
+
+    def load_canvas(self, canvas_path: str, world_index: int) -> None:
+        """
+        Read one canvas of the pack and link it into the Graph.  The canvas is checked before the Graph is touched.
+        :param canvas_path:     path to the canvas file
+        :param world_index:     index of the canvas's world in the manifest, or None for the start canvas
+        """
+        graph = self.graph
+        with profile_phase("load.parse"), open(canvas_path, encoding="utf-8") as file:
+            content = json.load(file)
+        with paused_garbage_collection():
+            scenes = build_scene_objects(content.get("nodes", []))
+            choices = build_choice_objects(content.get("edges", []))
+
+            # Check the canvas fits the rest of the pack
+            scene_by_id = {scene.id: scene for scene in scenes}
+            for scene in scenes:
+                if scene.id in graph.scene_by_id:
+                    raise RuntimeError(f"node {scene.id} in {canvas_path} is also in another canvas of the story pack")
+            if world_index is not None:
+                for node_id in self.worlds[world_index][1]:
+                    if node_id not in scene_by_id or scene_by_id[node_id].is_trick:
+                        raise RuntimeError(f"entry {node_id} of {canvas_path} must be a scene in that canvas, and not a trick")
+            outbound_choices = []
+            for choice in choices:
+                if choice.leads_from_id not in scene_by_id:
+                    raise RuntimeError(f"edge {choice.id} in {canvas_path} must lead away from a node in that canvas")
+                if choice.leads_to_id in scene_by_id:
+                    continue
+                target = graph.scene_by_id.get(choice.leads_to_id)
+                in_start_canvas = target is not None and self.world_of_scene[target] is None and not target.is_trick
+                if choice.color == "orange" or not (in_start_canvas or choice.leads_to_id in self.world_of_entry):
+                    raise RuntimeError(f"edge {choice.id} in {canvas_path} leads to node {choice.leads_to_id} in another "
+                                       "canvas, but isn't a non-orange edge to a scene in the start canvas or to an "
+                                       "entry of a world")
+                outbound_choices.append(choice)
+            variant_ids = {}
+            for choice in choices:
+                if choice.color == "orange" and not scene_by_id[choice.leads_from_id].is_trick:
+                    variant_ids.setdefault(choice.leads_from_id, []).append(choice.leads_to_id)
+            check_redirect_chains(variant_ids)
+
+            # Fill in the placeholders for this canvas's entries in place, so that choices leading to them stay valid
+            inbound_choices = {}
+            for index, scene in enumerate(scenes):
+                placeholder = self.placeholders.pop(scene.id, None)
+                if placeholder is not None:
+                    for attribute in NODE_ATTRIBUTES:
+                        setattr(placeholder, attribute, getattr(scene, attribute))
+                    inbound_choices[placeholder] = placeholder.choices_to_references
+                    scenes[index] = placeholder
+
+            # Link the canvas, then its edges into other canvases, to their Scenes or to placeholders
+            link_graph(scenes, choices, allow_outside_targets=True)
+            for placeholder, inbound in inbound_choices.items():
+                placeholder.set_choices_to_references(placeholder.choices_to_references + inbound)
+            new_choices_to = {}
+            for choice in outbound_choices:
+                target = graph.scene_by_id.get(choice.leads_to_id) or self.get_placeholder(choice.leads_to_id)
+                choice.set_leads_to_reference(target)
+                new_choices_to.setdefault(target, []).append(choice)
+            for target, new_choices in new_choices_to.items():
+                target.set_choices_to_references(target.choices_to_references + tuple(new_choices))
+
+            # Tricks and hub-return choices, as for a single canvas
+            for scene in scenes:
+                scene.set_gives_tricks(find_gives_tricks(scene))
+            for choice in choices:
+                choice.set_requires_tricks(find_requires_tricks(choice))
+            add_hub_return_choices(scenes, choices, stay_within=True)
+            for scene in scenes:
+                delattr(scene, "choices_to_ids")
+                delattr(scene, "choices_from_ids")
+            for choice in choices:
+                delattr(choice, "id")
+                delattr(choice, "leads_to_id")
+                delattr(choice, "leads_from_id")
+
+            # Add the canvas to the Graph.  Tricks new to the Graph get new bits, so bitmasks made before stay valid.
+            for scene in scenes:
+                graph.scene_by_id[scene.id] = scene
+                self.world_of_scene[scene] = world_index
+            graph.scenes.extend(scenes)
+            graph.choices.extend(choices)
+            graph.generation += 1
+            touched = scenes + list(new_choices_to)
+            for scene in touched:
+                scene.precompute_transitions()
+                graph.add_tricks(scene.gives_tricks + tuple(sorted(scene.grants_tricks | scene.redirect_requires_tricks)))
+            for choice in choices:
+                graph.add_tricks(choice.requires_tricks)
+            for scene in touched:
+                scene.precompute_trick_masks(graph)
+            for choice in choices:
+                choice.precompute_trick_masks(graph)
+            graph.compile_redirect_rules(touched)
+            if world_index is not None:
+                self.loaded_worlds[world_index] = (scenes, choices)
+
+    def evict_world(self, world_index: int) -> None:
+        """
+        Unload a world.  Its entries that other canvases still lead to become placeholders again, and it's loaded
+        again when next entered.  Trick bits are kept.
+        :param world_index:     index of a loaded world in the manifest
+        """
+        graph = self.graph
+        scenes, choices = self.loaded_worlds.pop(world_index)
+        evicted_scenes = set(scenes)
+        evicted_choices = set(choices)
+
+        # Unlink the world's edges into other canvases
+        for target in {choice.leads_to_reference for choice in choices} - evicted_scenes:
+            target.set_choices_to_references(remove_choices(target.choices_to_references, evicted_choices))
+            if len(target.choices_to_references) == 0 and self.placeholders.get(target.id) is target:
+                del self.placeholders[target.id]
+
+        # Forget the world's Scenes, except for entries that other canvases still lead to
+        for scene in scenes:
+            del graph.scene_by_id[scene.id]
+            del self.world_of_scene[scene]
+            inbound = remove_choices(scene.choices_to_references, evicted_choices)
+            if len(inbound) > 0:
+                scene.set_choices_to_references(inbound)
+                scene.set_choices_from_references(tuple())
+                scene.set_gives_tricks(tuple())
+                scene.precompute_transitions()
+                scene.precompute_trick_masks(graph)
+                scene.compile_redirect_rules()
+                self.placeholders[scene.id] = scene
+        graph.scenes[:] = [scene for scene in graph.scenes if scene not in evicted_scenes]
+        graph.choices[:] = [choice for choice in graph.choices if choice not in evicted_choices]
+        graph.generation += 1
+
+
+def get_canvas_name(world_text: str, taken: set) -> str:
+    """
+    Name the canvas file for a world after the first line of its hub's text, e.g. "timber_hearth.canvas" for
+    "WORLD: Timber Hearth".
+    :param world_text:  text of the world's hub node
+    :param taken:       set of canvas file names already used, which the new name is added to
+    :return:            canvas file name
+    """
+    title = world_text[len("WORLD: "):].split("\n", 1)[0]
+    stem = re.sub(r"[^a-z0-9]+", "_", title.lower())[:CANVAS_NAME_LENGTH].strip("_") or "world"
+    name = f"{stem}.canvas"
+    number = 2
+    while name in taken or name == START_CANVAS_NAME:
+        name = f"{stem}_{number}.canvas"
+        number += 1
+    taken.add(name)
+    return name
+
+
+def split_canvas_into_pack(flowchart_path: str = FLOWCHART_PATH, pack_directory: str = "story_pack") -> str:
+    """
+    Split a single canvas into a story pack, with one canvas per WORLD hub.  Each scene goes in the canvas of the
+    nearest world it's the child of, found the same way as for hub-return choices, or in the start canvas if it isn't
+    the child of any world.  State variants go with the scene they redirect from, and each trick node is copied into
+    every canvas with an edge to or from it.
+    :param flowchart_path:  path to the canvas file to split
+    :param pack_directory:  directory to write the manifest and canvases to
+    :return:                path to the manifest
+    """
+    with open(flowchart_path, encoding="utf-8") as file:
+        content = json.load(file)
+    nodes = content["nodes"]
+    edges = content["edges"]
+    scenes = build_scene_objects(nodes)
+    choices = build_choice_objects(edges)
+    link_graph(scenes, choices)
+    scene_by_id = {scene.id: scene for scene in scenes}
+
+    # Pick each scene's canvas, by the id of its world, or None for the start canvas
+    world_parents = find_world_parents(scenes)
+    canvas_of_node = {}
+    for scene in scenes:
+        if scene.is_world:
+            canvas_of_node[scene.id] = scene.id
+        else:
+            world_parent = world_parents.get(scene)
+            canvas_of_node[scene.id] = world_parent.id if world_parent is not None else None
+
+    # Orange edges can't cross canvases, so move state variants, and theirs in turn, to the scene they redirect from
+    moved = set()
+    fringe = deque(scene for scene in scenes if not scene.is_trick)
+    while len(fringe) > 0:
+        scene = fringe.popleft()
+        for choice in scene.choices_from_references:
+            variant = choice.leads_to_reference
+            if choice.color == "orange" and not variant.is_trick and variant not in moved:
+                moved.add(variant)
+                canvas_of_node[variant.id] = canvas_of_node[scene.id]
+                fringe.append(variant)
+
+    # Put each edge in the canvas of the node it leads away from, or for edges to or from a trick, the canvas of the
+    # scene at the other end, with a copy of the trick node
+    node_by_id = {node["id"]: node for node in nodes}
+    canvas_nodes = {None: []}
+    canvas_edges = {}
+    entries = {}
+    trick_copies = {}       # Id of each trick node's copy in each canvas, by (trick node id, canvas)
+    trick_copy_counts = {}
+    for node in nodes:
+        if not scene_by_id[node["id"]].is_trick:
+            canvas_nodes.setdefault(canvas_of_node[node["id"]], []).append(node)
+    for edge in edges:
+        from_scene = scene_by_id[edge["fromNode"]]
+        to_scene = scene_by_id[edge["toNode"]]
+        if not from_scene.is_trick:
+            canvas = canvas_of_node[from_scene.id]
+        elif not to_scene.is_trick:
+            canvas = canvas_of_node[to_scene.id]
+        else:
+            canvas = None
+        edge = dict(edge)
+        for end in ("fromNode", "toNode"):
+            if scene_by_id[edge[end]].is_trick:
+                trick_id = edge[end]
+                if (trick_id, canvas) not in trick_copies:
+                    copies = trick_copy_counts.get(trick_id, 0)
+                    trick_copy_counts[trick_id] = copies + 1
+                    trick_copies[trick_id, canvas] = trick_id if copies == 0 else f"{trick_id}-{copies}"
+                    canvas_nodes.setdefault(canvas, []).append(dict(node_by_id[trick_id], id=trick_copies[trick_id, canvas]))
+                edge[end] = trick_copies[trick_id, canvas]
+        if not to_scene.is_trick and canvas_of_node[to_scene.id] not in (canvas, None):
+            entries.setdefault(canvas_of_node[to_scene.id], set()).add(to_scene.id)
+        canvas_edges.setdefault(canvas, []).append(edge)
+
+    # Write the canvases and the manifest
+    os.makedirs(pack_directory, exist_ok=True)
+    manifest = {"start": START_CANVAS_NAME, "worlds": []}
+    taken = set()
+    for canvas, canvas_node_list in canvas_nodes.items():
+        if canvas is None:
+            name = START_CANVAS_NAME
+        else:
+            name = get_canvas_name(scene_by_id[canvas].text, taken)
+            manifest["worlds"].append({"canvas": name, "entries": sorted(entries.get(canvas, ()))})
+        with open(path.join(pack_directory, name), "w", encoding="utf-8") as file:
+            json.dump({"nodes": canvas_node_list, "edges": canvas_edges.get(canvas, [])}, file, indent="\t")
+    manifest_path = path.join(pack_directory, MANIFEST_NAME)
+    with open(manifest_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4)
+        file.write("\n")
+    return manifest_path
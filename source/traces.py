@@ -0,0 +1,162 @@
+"""For recording playthroughs as traces, and replaying them without a player, e.g. to reproduce a bug report or check
+that edits to the canvas haven't broken the paths real players took.
+
+A trace is a text file.  Its first line is a JSON header with the SHA-256 hash of the canvas the game was played on,
+and the scene id and tricks found that the game started from, the same as a save file: "" and no tricks for a new
+game.  Each line after that is one step: the number of the choice the player picked, counting from 1 like the menu
+shown to the player, then a space, then the id of the scene the choice led to.  Steps are written as they're taken, so
+a trace survives the game crashing.
+
+Replaying follows the same transitions as the real game, but never prints, plays audio, or touches the save file.
+"""
+
+
+import json
+import os
+from source.flowchart_importing import FLOWCHART_PATH
+from source.game_running import GameSession
+from source.graph import Graph
+from source.graph_cache import hash_file, load_game_graph
+
+
+TRACE_FORMAT_VERSION = 1
+TRACE_SUFFIX = ".trace"
+
+
+class TraceRecorder:
+    """Writes a trace of one playthrough, one step at a time."""
+    def __init__(self, trace_path: str, canvas_hash: bytes):
+        """
+        :param trace_path:      path to write the trace to.  Overwritten if it exists
+        :param canvas_hash:     SHA-256 hash of the canvas being played, as returned by hash_file()
+        """
+        self.trace_path = trace_path
+        self.canvas_hash = canvas_hash
+        self.file = None
+
+    def start(self, starting_scene_id: str, found_tricks: set) -> None:
+        """
+        Begin the trace with the state the game starts from.
+        :param starting_scene_id:   id of the scene the game is picked up at, or "" for a new game
+        :param found_tricks:        set of tricks found when the game starts, as strings
+        """
+        self.file = open(self.trace_path, "w", encoding="utf-8", buffering=1)
+        header = {"format": TRACE_FORMAT_VERSION, "canvas_sha256": self.canvas_hash.hex(),
+                  "start": starting_scene_id, "tricks": sorted(found_tricks)}
+        self.file.write(json.dumps(header) + "\n")
+
+    def record(self, choice_number: str, scene_id: str) -> None:
+        """
+        Add one step to the trace.
+        :param choice_number:   number of the choice the player picked, as shown in the menu
+        :param scene_id:        id of the scene the choice led to, after any redirect
+        """
+        self.file.write(f"{choice_number} {scene_id}\n")
+
+    def close(self) -> None:
+        """Finish writing the trace."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_trace(trace_path: str) -> tuple:
+    """
+    Read a trace written by a TraceRecorder.
+    :param trace_path:  path to the trace file
+    :return:            tuple with (canvas SHA-256 hash as bytes, starting scene id, set of starting tricks, list of
+                        (choice number, scene id) pairs with the choice numbers as ints)
+    Raises ValueError if the file isn't a trace this version can read.
+    """
+    with open(trace_path, encoding="utf-8") as file:
+        lines = file.read().splitlines()
+    if len(lines) == 0:
+        raise ValueError(f"{trace_path} is empty")
+    header = json.loads(lines[0])
+    if not isinstance(header, dict) or header.get("format") != TRACE_FORMAT_VERSION:
+        raise ValueError(f"{trace_path} isn't a version {TRACE_FORMAT_VERSION} trace")
+    steps = []
+    for line in lines[1:]:
+        choice_number, _, scene_id = line.partition(" ")
+        steps.append((int(choice_number), scene_id))
+    return bytes.fromhex(header["canvas_sha256"]), header["start"], set(header["tricks"]), steps
+
+
+def replay_trace(graph: Graph, starting_scene_id: str, found_tricks: set, steps: list) -> tuple:
+    """
+    Replay the steps of a trace, checking that each choice is still on offer and still leads to the scene it did.
+    :param graph:               Graph object representing the full game
+    :param starting_scene_id:   id of the scene the trace starts from, or "" for a new game
+    :param found_tricks:        set of tricks found when the trace starts, as strings
+    :param steps:               list of (choice number, scene id) pairs, as returned by read_trace()
+    :return:                    tuple with (number of the first step that diverged, counting from 1, or None if every
+                                step replayed the same, description of how it diverged, or "")
+    """
+    if len(starting_scene_id) > 0 and starting_scene_id not in graph.scene_by_id:
+        return 0, f"the scene the trace starts at, {starting_scene_id}, isn't in the canvas"
+    # Play it as a GameSession, so that tricks the canvas doesn't know are carried along just like in the real game
+    session = GameSession(graph, starting_scene_id, found_tricks)
+
+    for step, (choice_number, scene_id) in enumerate(steps, 1):
+        if session.active_scene.is_end:
+            return step, f"the game already ended at scene {session.active_scene.id}, but the trace goes on"
+        choices = session.active_scene.get_available_choices(session.found_mask)
+        if not 1 <= choice_number <= len(choices):
+            return step, (f"scene {session.active_scene.id} offers {len(choices)} choices, so there's no choice "
+                          f"{choice_number}")
+        session.take_choice(choices[choice_number - 1])
+        if session.active_scene.id != scene_id:
+            return step, f"choice {choice_number} led to scene {session.active_scene.id} instead of {scene_id}"
+    return None, ""
+
+
+def find_trace_paths(paths: list) -> list:
+    """
+    Expand a list of trace files and directories of them into a list of trace files.
+    :param paths:   list of paths.  Directories stand for every trace file directly inside them
+    :return:        sorted list of paths to trace files
+    """
+    trace_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            trace_paths.extend(os.path.join(path, name) for name in os.listdir(path) if name.endswith(TRACE_SUFFIX))
+        else:
+            trace_paths.append(path)
+    return sorted(trace_paths)
+
+
+def replay_traces(paths: list, flowchart_path: str = FLOWCHART_PATH) -> list:
+    """
+    Replay many traces against a canvas, which is loaded once for all of them.
+    :param paths:           list of trace files and directories of them
+    :param flowchart_path:  path to the canvas file
+    :return:                list of (trace path, whether the canvas changed since it was recorded, number of the first
+                            step that diverged or None, description of how it diverged) tuples, in order of path
+    """
+    graph = load_game_graph(flowchart_path)
+    canvas_hash = hash_file(flowchart_path)
+    results = []
+    for trace_path in find_trace_paths(paths):
+        try:
+            trace_canvas_hash, starting_scene_id, found_tricks, steps = read_trace(trace_path)
+        except (OSError, ValueError, KeyError) as error:
+            results.append((trace_path, False, 0, f"couldn't read the trace: {error}"))
+            continue
+        diverged_step, description = replay_trace(graph, starting_scene_id, found_tricks, steps)
+        results.append((trace_path, trace_canvas_hash != canvas_hash, diverged_step, description))
+    return results
+
+
+def format_replay_report(results: list) -> str:
+    """
+    Summarize the results of replay_traces() for a person to read.
+    :param results: list returned by replay_traces()
+    :return:        multi-line summary
+    """
+    diverged = [result for result in results if result[2] is not None]
+    changed = sum(1 for result in results if result[1])
+    lines = [f"Traces replayed: {len(results)}  (diverged: {len(diverged)}, "
+             f"recorded on a different version of the canvas: {changed})"]
+    for trace_path, _, diverged_step, description in diverged:
+        lines.append(f"    {trace_path}  step {diverged_step}: {description}")
+    return "\n".join(lines)
@@ -0,0 +1,257 @@
+"""For checking a flowchart canvas for structural errors without loading it, e.g. to gate deploying a story.
+
+Every error is reported, each with the id of the node or edge it's about, rather than stopping at the first one.  The
+checks run in two rounds, in time linear in the size of the canvas.  First, the canvas is cut into slices, and each
+node and edge is checked on its own and sorted into a partition by a hash of the node ids it refers to: a node goes to
+the partition of its id, and an edge to the partitions of both its ends.  Then each partition checks what needs nodes
+and edges together, like edges to missing nodes.  On large canvases, the slices and the partitions are checked in
+parallel across worker processes.  Only the START node and loops of state variants are checked over the whole canvas
+at the end, from the few facts the partitions report about them.
+"""
+
+
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from source.flowchart_importing import FLOWCHART_PATH, color_number_to_name, find_redirect_chain_errors
+from source.flowchart_syntax import trick_signifier
+
+
+PARALLEL_THRESHOLD = 200_000    # Canvases with fewer nodes plus edges than this are checked in one process
+
+# The canvas being checked, for worker processes to read their slices from.  Forked workers inherit it from the main
+# process, rather than have it pickled and sent to them.
+worker_canvas = None
+
+
+def load_worker_canvas(flowchart_path: str) -> None:
+    """
+    Initialize a worker process with the canvas being checked, unless it was inherited from the main process.
+    :param flowchart_path:  path to the canvas file
+    """
+    global worker_canvas
+    if worker_canvas is None:   # Spawned rather than forked, e.g. on Windows
+        with open(flowchart_path, encoding="utf-8") as file:
+            worker_canvas = json.load(file)
+
+
+def scan_worker_slice(node_start: int, node_end: int, edge_start: int, edge_end: int, partitions: int) -> tuple:
+    """
+    Run scan_slice() in a worker process, on a slice of the canvas it was initialized with.
+    :param node_start:  index of the slice's first node
+    :param node_end:    index just past the slice's last node
+    :param edge_start:  index of the slice's first edge
+    :param edge_end:    index just past the slice's last edge
+    :param partitions:  number of partitions
+    :return:            tuple returned by scan_slice()
+    """
+    nodes = worker_canvas.get("nodes", [])[node_start:node_end]
+    edges = worker_canvas.get("edges", [])[edge_start:edge_end]
+    return scan_slice(nodes, edges, node_start, edge_start, partitions)
+
+
+def get_partition(node_id: str, partitions: int) -> int:
+    """
+    Get the partition a node id belongs to.  The hash is the same in every process, unlike hash().
+    :param node_id:     id of a node
+    :param partitions:  number of partitions
+    :return:            partition number
+    """
+    return zlib.crc32(node_id.encode()) % partitions
+
+
+def get_color_name(color_number, item_id: str, errors: list) -> str:
+    """
+    Get the name of a node or edge's color, noting an error if it isn't a color the game knows.
+    :param color_number:    color number from the canvas, or None
+    :param item_id:         id of the node or edge, for the error
+    :param errors:          list of (id, error message) pairs to add to
+    :return:                color name, or None if it isn't known
+    """
+    try:
+        return color_number_to_name(color_number)
+    except ValueError:
+        errors.append((item_id, f"color {color_number!r} isn't one of the 6 preset colors"))
+        return None
+
+
+def scan_slice(nodes: list, edges: list, node_offset: int, edge_offset: int, partitions: int) -> tuple:
+    """
+    Check each node and edge of one slice of a canvas on its own, and sort them into partitions for check_partition().
+    :param nodes:           node dicts in the slice
+    :param edges:           edge dicts in the slice
+    :param node_offset:     index of the slice's first node in the canvas, to name nodes without ids
+    :param edge_offset:     index of the slice's first edge in the canvas, to name edges without ids
+    :param partitions:      number of partitions
+    :return:                tuple with (list of (id, error message) pairs, list of partitions, each a tuple of (list of
+                            (node id, is trick, is START) tuples, list of (edge id, from node id, to node id, is
+                            orange, is unlabeled) tuples for edges leading away from its nodes, list of (edge id, to
+                            node id) tuples for edges leading to its nodes))
+    """
+    errors = []
+    buckets = [([], [], []) for _ in range(partitions)]
+    for index, node in enumerate(nodes, node_offset):
+        node_id = node.get("id")
+        if not isinstance(node_id, str):
+            errors.append((f"node #{index}", "node has no id"))
+            continue
+        text = node.get("text")
+        if not isinstance(text, str):
+            errors.append((node_id, f"node has no text.  Only text nodes are supported, not {node.get('type')!r} nodes"))
+            text = ""
+        color = get_color_name(node.get("color"), node_id, errors)
+        is_trick = text.startswith(trick_signifier) and color == "green"
+        is_start = text == "START" and color == "red"
+        buckets[get_partition(node_id, partitions)][0].append((node_id, is_trick, is_start))
+
+    for index, edge in enumerate(edges, edge_offset):
+        edge_id = edge.get("id")
+        if not isinstance(edge_id, str):
+            errors.append((f"edge #{index}", "edge has no id"))
+            continue
+        from_id = edge.get("fromNode")
+        to_id = edge.get("toNode")
+        if not isinstance(from_id, str) or not isinstance(to_id, str):
+            errors.append((edge_id, "edge isn't connected to a node at both ends"))
+            continue
+        color = get_color_name(edge.get("color"), edge_id, errors)
+        if edge.get("label") == "":
+            errors.append((edge_id, "edge label is empty.  Remove the label instead, to have it read \"Continue\""))
+        buckets[get_partition(from_id, partitions)][1].append((edge_id, from_id, to_id, color == "orange", "label" not in edge))
+        buckets[get_partition(to_id, partitions)][2].append((edge_id, to_id))
+    return errors, buckets
+
+
+def check_partition(nodes: list, outgoing: list, incoming: list) -> tuple:
+    """
+    Check the nodes of one partition together with the edges leading away from and to them.
+    :param nodes:       list of node tuples, as sorted into partitions by scan_slice()
+    :param outgoing:    list of tuples for the edges leading away from ids in this partition
+    :param incoming:    list of tuples for the edges leading to ids in this partition
+    :return:            tuple with (list of (id, error message) pairs, list of (START node id, number of outgoing
+                        edges) pairs, dict of variant ids as taken by find_redirect_chain_errors(), dict of the ids of
+                        unlabeled choices by the id of the scene they lead away from, for scenes with more than 1,
+                        list of the ids of edges leading to tricks)
+    """
+    errors = []
+    node_flags = {}
+    for node_id, is_trick, is_start in nodes:
+        if node_id in node_flags:
+            errors.append((node_id, "more than one node has this id"))
+        node_flags[node_id] = (is_trick, is_start)
+
+    starts = {node_id: 0 for node_id, (_, is_start) in node_flags.items() if is_start}
+    variant_ids = {}
+    unlabeled_choices = {}
+    for edge_id, from_id, to_id, is_orange, is_unlabeled in outgoing:
+        flags = node_flags.get(from_id)
+        if flags is None:
+            errors.append((edge_id, f"edge leads away from node {from_id}, which isn't in the canvas"))
+            continue
+        if from_id in starts:
+            starts[from_id] += 1
+        if flags[0]:
+            continue    # Edges leading away from tricks never become choices
+        if is_orange:
+            variant_ids.setdefault(from_id, []).append(to_id)
+        elif is_unlabeled:
+            unlabeled_choices.setdefault(from_id, []).append(edge_id)
+
+    edges_to_tricks = []
+    for edge_id, to_id in incoming:
+        flags = node_flags.get(to_id)
+        if flags is None:
+            errors.append((edge_id, f"edge points at node {to_id}, which isn't in the canvas"))
+        elif flags[0]:
+            edges_to_tricks.append(edge_id)
+
+    unlabeled_choices = {scene_id: edge_ids for scene_id, edge_ids in unlabeled_choices.items() if len(edge_ids) > 1}
+    return errors, list(starts.items()), variant_ids, unlabeled_choices, edges_to_tricks
+
+
+def validate_canvas(flowchart_path: str = FLOWCHART_PATH, workers: int = None) -> list:
+    """
+    Find every structural error in a canvas: nodes and edges without ids, text or ends, unknown colors, empty labels,
+    nodes with the same id, edges to or from missing nodes, not exactly 1 START node pointing to exactly 1 scene,
+    scenes with more than 1 unlabeled choice, and state variants that can't be compiled.
+    :param flowchart_path:  path to the canvas file
+    :param workers:         number of worker processes, or None for one per CPU.  Small canvases always use one
+    :return:                list of (id, error message) pairs, sorted by id.  The id is None for errors about the
+                            whole canvas
+    """
+    with open(flowchart_path, encoding="utf-8") as file:
+        content = json.load(file)
+    nodes = content.get("nodes", [])
+    edges = content.get("edges", [])
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if len(nodes) + len(edges) < PARALLEL_THRESHOLD:
+        workers = 1
+
+    if workers == 1:
+        errors, buckets = scan_slice(nodes, edges, 0, 0, 1)
+        results = [check_partition(*buckets[0])]
+    else:
+        # Only slice bounds are sent to the workers, and only the compact tuples sorted into partitions come back
+        global worker_canvas
+        node_starts = [len(nodes) * number // workers for number in range(workers + 1)]
+        edge_starts = [len(edges) * number // workers for number in range(workers + 1)]
+        worker_canvas = content
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=load_worker_canvas, initargs=(flowchart_path,)) as executor:
+                scanned = executor.map(scan_worker_slice, node_starts[:-1], node_starts[1:], edge_starts[:-1],
+                                       edge_starts[1:], [workers] * workers)
+                errors = []
+                partitions = [([], [], []) for _ in range(workers)]
+                for slice_errors, buckets in scanned:
+                    errors.extend(slice_errors)
+                    for partition, bucket in zip(partitions, buckets):
+                        for whole, part in zip(partition, bucket):
+                            whole.extend(part)
+                results = list(executor.map(check_partition, *zip(*partitions)))
+        finally:
+            worker_canvas = None
+
+    # Put together what the partitions found about the whole canvas
+    starts = []
+    variant_ids = {}
+    unlabeled_choices = {}
+    edges_to_tricks = set()
+    for partition_errors, partition_starts, partition_variant_ids, partition_unlabeled_choices, partition_edges_to_tricks in results:
+        errors.extend(partition_errors)
+        starts.extend(partition_starts)
+        variant_ids.update(partition_variant_ids)
+        unlabeled_choices.update(partition_unlabeled_choices)
+        edges_to_tricks.update(partition_edges_to_tricks)
+
+    if len(starts) == 0:
+        errors.append((None, "number of START nodes must be exactly 1, but there are none"))
+    elif len(starts) > 1:
+        errors.extend((start_id, f"number of START nodes must be exactly 1, but there are {len(starts)}") for start_id, _ in starts)
+    for start_id, out_degree in starts:
+        if out_degree != 1:
+            errors.append((start_id, f"the START node must point to exactly 1 scene, but points to {out_degree}"))
+    for scene_id, edge_ids in unlabeled_choices.items():
+        edge_ids = [edge_id for edge_id in edge_ids if edge_id not in edges_to_tricks]
+        if len(edge_ids) > 1:
+            errors.append((scene_id, f"{len(edge_ids)} choices leading away from this scene have no label, but at "
+                                     f"most 1 can be left blank to read \"Continue\": {', '.join(edge_ids)}"))
+    errors.extend(find_redirect_chain_errors(variant_ids))
+    errors.sort(key=lambda error: "" if error[0] is None else error[0])
+    return errors
+
+
+def format_validation_report(errors: list, flowchart_path: str) -> str:
+    """
+    Summarize the errors from validate_canvas() for a person to read.
+    :param errors:          list returned by validate_canvas()
+    :param flowchart_path:  path to the canvas file that was checked
+    :return:                multi-line summary
+    """
+    if len(errors) == 0:
+        return f"No structural errors found in {flowchart_path}."
+    lines = [f"Structural errors found in {flowchart_path}: {len(errors)}"]
+    for item_id, message in errors:
+        lines.append(f"    {'(whole canvas)' if item_id is None else item_id}  {message}")
+    return "\n".join(lines)